@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Bulk export/import of every user and conversation in the storage backend
+
+    python admin_transfer.py export backup.ndjson
+    python admin_transfer.py export backup.parquet --workers 16
+    python admin_transfer.py import backup.ndjson
+    python admin_transfer.py migrate
+
+Users are listed a page at a time and exported by parallel workers, each
+streaming its user's turns in chunks into a spooled temporary file, so memory
+stays bounded however large the environment is. A user that cannot be read
+is reported and skipped. Imports write each thread's turns in chunks of up to
+500, i.e. one Firestore batch per chunk, and index and archive them before
+moving on, so nothing is left to background threads when the command exits.
+migrate rewrites legacy inline histories into the current schema (SCHEMA_VERSION).
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import orjson
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import STORAGE_CONFIG
+from firebase_utils import get_storage_backend, read_chat_page, store_user_data, update_thread
+from history_archive import archive_now, truncate_archive
+from search_index import index_turns
+from storage_backends import THREAD_INDEX_FIELDS, FIRESTORE_BATCH_LIMIT, MAIN_THREAD, SCHEMA_VERSION
+
+# Every record is a row of this schema. user and thread records carry their
+# fields in data (a JSON object); turn records use the turn columns.
+RECORD_SCHEMA = pa.schema([
+    ("record_type", pa.string()),
+    ("username", pa.string()),
+    ("thread_id", pa.string()),
+    ("message_id", pa.int64()),
+    ("user_message", pa.string()),
+    ("bot_reply", pa.string()),
+    ("timestamp", pa.string()),
+    ("data", pa.string()),
+])
+PARQUET_ROWS_PER_GROUP = 10000
+SPOOL_MAX_BYTES = 4 * 1024 * 1024
+PROFILE_DERIVED_FIELDS = ("message_count", "last_updated", "threads", "schema_version")
+
+def _dumps(record):
+    # default=str covers Firestore timestamps and other non-JSON profile values
+    return orjson.dumps(record, default=str) + b"\n"
+
+def _format_for(path, fmt):
+    if fmt:
+        return fmt
+    return "parquet" if path.endswith(".parquet") else "ndjson"
+
+# --- export ---
+def iter_usernames(backend, page_size):
+    after = None
+    while True:
+        usernames = backend.list_users(after, page_size)
+        yield from usernames
+        if len(usernames) < page_size:
+            return
+        after = usernames[-1]
+
+def export_user(backend, username, chunk_turns):
+    """Spool one user's records as NDJSON; returns (spool, turn count) or (None, 0) if gone"""
+    profile = backend.get_user(username)
+    if profile is None:
+        return None, 0
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    profile = {k: v for k, v in profile.items() if k not in PROFILE_DERIVED_FIELDS}
+    spool.write(_dumps({"record_type": "user", "username": username, "data": profile}))
+    turn_count = 0
+    for thread_id, entry in sorted(backend.list_threads(username).items()):
+        spool.write(_dumps({
+            "record_type": "thread",
+            "username": username,
+            "thread_id": thread_id,
+            "data": {k: entry[k] for k in THREAD_INDEX_FIELDS if k in entry}
+        }))
+        message_count = entry.get("message_count", 0)
+        for start in range(0, message_count, chunk_turns):
+            end = min(start + chunk_turns, message_count)
+            turns = read_chat_page(backend, username, before=end, limit=end - start, thread_id=thread_id)
+            spool.write(b"".join(
+                _dumps({"record_type": "turn", "username": username, "thread_id": thread_id, **turn})
+                for turn in turns
+            ))
+            turn_count += len(turns)
+    spool.seek(0)
+    return spool, turn_count
+
+class RecordWriter:
+    """Appends spooled NDJSON records to the output file, converting to Parquet if asked"""
+
+    def __init__(self, path, fmt):
+        self.fmt = fmt
+        self._file = open(path, "wb")
+        self._parquet = pq.ParquetWriter(self._file, RECORD_SCHEMA, compression="zstd") if fmt == "parquet" else None
+        self._rows = []
+
+    def write_spool(self, spool):
+        if self._parquet is None:
+            shutil.copyfileobj(spool, self._file)
+            return
+        for line in spool:
+            record = orjson.loads(line)
+            if "data" in record:
+                record["data"] = orjson.dumps(record["data"], default=str).decode()
+            self._rows.append(record)
+            if len(self._rows) >= PARQUET_ROWS_PER_GROUP:
+                self._flush_rows()
+
+    def _flush_rows(self):
+        if self._rows:
+            columns = {field.name: [row.get(field.name) for row in self._rows] for field in RECORD_SCHEMA}
+            self._parquet.write_table(pa.Table.from_pydict(columns, schema=RECORD_SCHEMA))
+            self._rows = []
+
+    def close(self):
+        if self._parquet is not None:
+            self._flush_rows()
+            self._parquet.close()
+        self._file.close()
+
+def export_all(path, fmt, workers, page_size, chunk_turns):
+    backend = get_storage_backend()
+    writer = RecordWriter(path, fmt)
+    users = turns = 0
+    failed = []
+    started = time.monotonic()
+
+    def drain(username, future):
+        nonlocal users, turns
+        try:
+            spool, turn_count = future.result()
+        except Exception as e:
+            print(f"❌ Export failed for {username}: {e}")
+            failed.append(username)
+            return
+        if spool is None:
+            return
+        with spool:
+            writer.write_spool(spool)
+        users += 1
+        turns += turn_count
+        if users % 1000 == 0:
+            print(f"📦 Exported {users} users, {turns} turns...")
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # Bounded in-flight work; results are written in username order
+            pending = deque()
+            for username in iter_usernames(backend, page_size):
+                pending.append((username, pool.submit(export_user, backend, username, chunk_turns)))
+                if len(pending) >= workers * 2:
+                    drain(*pending.popleft())
+            while pending:
+                drain(*pending.popleft())
+    finally:
+        writer.close()
+    print(f"✅ Exported {users} users and {turns} turns to {path} in {time.monotonic() - started:.1f}s"
+          + (f" ({len(failed)} failed)" if failed else ""))
+    if failed:
+        print(f"❌ Not exported: {', '.join(failed)}")
+    return users, turns, failed
+
+# --- import ---
+def read_records(path, fmt):
+    if fmt == "parquet":
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=PARQUET_ROWS_PER_GROUP):
+            for record in batch.to_pylist():
+                if record.get("data") is not None:
+                    record["data"] = orjson.loads(record["data"])
+                yield record
+        return
+    with open(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                yield orjson.loads(line)
+
+def iter_user_groups(records):
+    """Group consecutive records by username (an export writes each user contiguously)"""
+    username, group = None, []
+    for record in records:
+        if record["username"] != username and group:
+            yield username, group
+            group = []
+        username = record["username"]
+        group.append(record)
+    if group:
+        yield username, group
+
+def import_user(backend, username, records):
+    """Write one user's profile, thread index and turns; returns the number of turns written.
+
+    Turns go straight to the backend and are indexed and archived here, not
+    by the background jobs save_chat_turns would start. A thread the target
+    already holds is replaced, so no turns past the imported ones survive.
+    """
+    profile = next((r["data"] for r in records if r["record_type"] == "user"), None)
+    if profile is None:
+        # A truncated export; an empty profile would wipe the target's password
+        raise RuntimeError(f"no profile record for {username}")
+    if not store_user_data(username, profile):
+        raise RuntimeError(f"could not store profile of {username}")
+
+    turns_by_thread = {}
+    for record in records:
+        if record["record_type"] == "thread":
+            if record["thread_id"] != MAIN_THREAD and record.get("data"):
+                update_thread(username, record["thread_id"], record["data"])
+            turns_by_thread.setdefault(record["thread_id"], [])
+        elif record["record_type"] == "turn":
+            turns_by_thread.setdefault(record["thread_id"], []).append({
+                "message_id": record["message_id"],
+                "user_message": record["user_message"],
+                "bot_reply": record["bot_reply"],
+                "timestamp": record.get("timestamp")
+            })
+
+    written = 0
+    existing = backend.list_threads(username)
+    for thread_id, turns in turns_by_thread.items():
+        turns.sort(key=lambda turn: turn["message_id"])
+        previous_count = existing.get(thread_id, {}).get("message_count", 0)
+        if previous_count:
+            # The target's archive and summary cover turns that are being replaced
+            truncate_archive(backend, username, thread_id, 0)
+            backend.put_summary(username, thread_id, None)
+        # Chunks in message order, each saved as one batch of at most 500 writes;
+        # the first one trims the target's turns past it, an empty thread trims them all
+        chunks = [turns[start:start + FIRESTORE_BATCH_LIMIT] for start in range(0, len(turns), FIRESTORE_BATCH_LIMIT)]
+        for chunk in chunks or ([[]] if previous_count else []):
+            message_count = chunk[-1]["message_id"] + 1 if chunk else 0
+            backend.save_turns(username, chunk, message_count, previous_count, thread_id)
+            if STORAGE_CONFIG['SEARCH_ENABLED']:
+                index_turns(backend, username, thread_id, chunk, message_count, previous_count)
+            previous_count = message_count
+            written += len(chunk)
+        if turns and STORAGE_CONFIG['ARCHIVE_ENABLED']:
+            archive_now(
+                backend, username, thread_id, turns[-1]["message_id"] + 1,
+                STORAGE_CONFIG['ARCHIVE_HOT_WINDOW'],
+                STORAGE_CONFIG['ARCHIVE_SEGMENT_TURNS'],
+                STORAGE_CONFIG['ARCHIVE_ZSTD_LEVEL']
+            )
+    return written
+
+def import_all(path, fmt, workers):
+    backend = get_storage_backend()
+    users = turns = failed = 0
+    started = time.monotonic()
+
+    def drain(future):
+        nonlocal users, turns, failed
+        try:
+            turns += future.result()
+            users += 1
+        except Exception as e:
+            print(f"❌ Import failed: {e}")
+            failed += 1
+        if users and users % 1000 == 0:
+            print(f"📥 Imported {users} users, {turns} turns...")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for username, records in iter_user_groups(read_records(path, fmt)):
+            pending.append(pool.submit(import_user, backend, username, records))
+            if len(pending) >= workers * 2:
+                drain(pending.popleft())
+        while pending:
+            drain(pending.popleft())
+    print(f"✅ Imported {users} users and {turns} turns from {path} in {time.monotonic() - started:.1f}s"
+          + (f" ({failed} failed)" if failed else ""))
+    return users, turns, failed
+
+# --- schema migration ---
+def migrate_user(backend, username, chunk_turns):
+    """Migrate one user and add the turns moved out of the legacy layout to the search index"""
+    outcome = backend.migrate_user(username)
+    if outcome == "migrated" and STORAGE_CONFIG['SEARCH_ENABLED']:
+        message_count = backend.list_threads(username).get(MAIN_THREAD, {}).get("message_count", 0)
+        for start in range(0, message_count, chunk_turns):
+            end = min(start + chunk_turns, message_count)
+            index_turns(backend, username, MAIN_THREAD, read_chat_page(backend, username, before=end, limit=end - start), end)
+    return outcome
+
+def migrate_all(workers, page_size, chunk_turns):
+    backend = get_storage_backend()
+    outcomes = {"migrated": 0, "current": 0, "missing": 0, "failed": 0}
+    started = time.monotonic()
+
+    def drain(username, future):
+        try:
+            outcomes[future.result()] += 1
+        except Exception as e:
+            print(f"❌ Migration failed for {username}: {e}")
+            outcomes["failed"] += 1
+        if outcomes["migrated"] and outcomes["migrated"] % 1000 == 0:
+            print(f"🔧 Migrated {outcomes['migrated']} users...")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for username in iter_usernames(backend, page_size):
+            pending.append((username, pool.submit(migrate_user, backend, username, chunk_turns)))
+            if len(pending) >= workers * 2:
+                drain(*pending.popleft())
+        while pending:
+            drain(*pending.popleft())
+    print(f"✅ Migrated {outcomes['migrated']} users to schema version {SCHEMA_VERSION} "
+          f"({outcomes['current']} already current, {outcomes['failed']} failed) in {time.monotonic() - started:.1f}s")
+    return outcomes
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk export/import and migration of users and chat history")
+    parser.add_argument("command", choices=["export", "import", "migrate"])
+    parser.add_argument("path", nargs="?", help="NDJSON or Parquet file (export and import)")
+    parser.add_argument("--format", choices=["ndjson", "parquet"], help="default: from the file extension")
+    parser.add_argument("--workers", type=int, default=STORAGE_CONFIG['TRANSFER_WORKERS'], help="parallel workers")
+    parser.add_argument("--page-size", type=int, default=500, help="users listed per query")
+    parser.add_argument("--chunk-turns", type=int, default=STORAGE_CONFIG['EXPORT_CHUNK_TURNS'], help="turns read per query")
+    args = parser.parse_args(argv)
+
+    workers = max(1, args.workers)
+    if args.command == "migrate":
+        return 1 if migrate_all(workers, args.page_size, args.chunk_turns)["failed"] else 0
+    if not args.path:
+        parser.error(f"{args.command} needs a file path")
+    fmt = _format_for(args.path, args.format)
+    if args.command == "export":
+        _, _, failed = export_all(args.path, fmt, workers, args.page_size, args.chunk_turns)
+        return 1 if failed else 0
+    _, _, failed = import_all(args.path, fmt, workers)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,13 @@
 import streamlit as st
 from auth import auth_page
 from chatbot import chatbot_ui
+from firebase_utils import start_firebase_warmup
+from retention import start_retention_scheduler
+
+# Connect to storage in the background while the first page renders
+start_firebase_warmup()
+# Periodic cleanup of abandoned demo accounts and old conversations
+start_retention_scheduler()
 
 # Redirect to Login/Signup Page
 if "authenticated" not in st.session_state:
@@ -1,5 +1,5 @@
 import streamlit as st
-from firebase_utils import get_user_data, store_user_data, initialize_firebase
+from firebase_utils import get_user_data, get_user_fields, store_user_data, initialize_firebase, firebase_readiness
 import time
 from oauth_handler import demo_oauth_login
 
@@ -229,6 +229,8 @@ def auth_page():
         st.write("**Testing Firebase initialization...**")
         firebase_status = initialize_firebase()
         st.write(f"Firebase initialized: {firebase_status}")
+        ready, readiness_message = firebase_readiness(timeout=5)
+        st.write(f"Firebase connection: {readiness_message}")
         
         # Check Streamlit secrets
         try:
@@ -492,11 +494,12 @@ def login_form():
                         st.error("Please fill in all fields")
                     else:
                         show_loading_animation()
-                        user_data = get_user_data(username)
-                        if user_data and user_data["password"] == password:
+                        # Only the credential is needed here, not the profile or history
+                        credentials = get_user_fields(username, ["password"])
+                        if credentials and credentials.get("password") == password:
                             st.session_state.authenticated = True
                             st.session_state.current_user = username
-                            st.session_state.chat_history = user_data.get("chat_history", [])
+                            st.session_state.chat_history = []  # newest page is loaded by chatbot_ui
                             st.success("🎉 Login successful! Redirecting...")
                             time.sleep(1)
                             st.rerun()
@@ -543,17 +546,6 @@ def login_form():
         
         st.markdown('</div>', unsafe_allow_html=True)
 
-    if login_button:
-        user_data = get_user_data(username)
-        if user_data and user_data["password"] == password:
-            st.session_state.authenticated = True
-            st.session_state.current_user = username
-            st.session_state.chat_history = user_data.get("chat_history", [])
-            st.success(f"Welcome, {username}!")
-            st.rerun()
-        else:
-            st.error("Invalid username or password. Please try again.")
-
 def signup_form():
     with st.container():
         st.markdown('<div class="auth-container">', unsafe_allow_html=True)
@@ -580,24 +572,22 @@ def signup_form():
                         st.error("Passwords do not match")
                     else:
                         show_loading_animation()
-                        user_data = get_user_data(new_username)
-                        if user_data:
-                            st.error("Username already exists. Please choose a different one.")
+                        # An empty field mask is enough to check whether the username is taken;
+                        # if that can't be checked, nothing is written over a possible existing account
+                        try:
+                            taken = get_user_fields(new_username, [], raise_errors=True) is not None
+                        except Exception:
+                            st.error("❌ Accounts cannot be created right now. Please try again in a few minutes.")
                         else:
-                            store_user_data(new_username, {
-                                "password": new_password,
-                                "chat_history": [],
-                                "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
-                                "last_login": time.strftime("%Y-%m-%d %H:%M:%S")
-                            })
-                            st.success("🎉 Account created successfully! Please log in.")
-
-        st.markdown('</div>', unsafe_allow_html=True)
+                            if taken:
+                                st.error("Username already exists. Please choose a different one.")
+                            elif store_user_data(new_username, {
+                                    "password": new_password,
+                                    "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                                    "last_login": time.strftime("%Y-%m-%d %H:%M:%S")
+                                }):
+                                st.success("🎉 Account created successfully! Please log in.")
+                            else:
+                                st.error("❌ Accounts cannot be created right now. Please try again in a few minutes.")
 
-    if signup_button:
-        user_data = get_user_data(new_username)
-        if user_data:
-            st.error("Username already exists. Please choose a different one.")
-        else:
-            store_user_data(new_username, {"password": new_password, "chat_history": []})
-            st.success("Account created successfully! Please log in.")
\ No newline at end of file
+        st.markdown('</div>', unsafe_allow_html=True)
\ No newline at end of file
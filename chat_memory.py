@@ -0,0 +1,102 @@
+# Conversation memory for the LLM prompt
+# Each question is sent with the turns before it, newest first, until the
+# model's history budget is spent. Token counts come from tiktoken and are
+# cached per turn in session state (by message id, checked against the text),
+# so building a prompt only tokenizes turns that are new or were edited.
+# Turns already folded into the thread's rolling summary are left out and
+# the summary's tokens come off the budget instead.
+
+import threading
+import tiktoken
+from config import LLM_CONFIG
+
+# Context windows of the selectable models; others get DEFAULT_CONTEXT_TOKENS
+MODEL_CONTEXT_TOKENS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4": 8192,
+    "gpt-4-turbo-preview": 128000,
+    "gemini-pro": 30720,
+    "gemini-pro-vision": 12288,
+}
+DEFAULT_CONTEXT_TOKENS = 8192
+# Models tiktoken has no tokenizer for (Gemini) are counted with this one
+FALLBACK_ENCODING = "cl100k_base"
+# Role markers and separators tiktoken does not see, per message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+def _encoding(model):
+    """tiktoken encoding for a model, or None if it cannot be loaded (e.g. offline)"""
+    try:
+        name = tiktoken.encoding_name_for_model(model)
+    except KeyError:
+        name = FALLBACK_ENCODING
+    with _encodings_lock:
+        if name not in _encodings:
+            try:
+                _encodings[name] = tiktoken.get_encoding(name)
+            except Exception as e:
+                print(f"⚠️ tiktoken encoding {name} unavailable ({e}). Estimating token counts.")
+                _encodings[name] = None
+        return name, _encodings[name]
+
+def count_tokens(text, model):
+    _, encoding = _encoding(model)
+    if encoding is None:
+        # Roughly four characters per token for English text
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+def history_budget(model):
+    """Tokens of earlier turns to send with a question to this model"""
+    context = MODEL_CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT_TOKENS)
+    return min(LLM_CONFIG['HISTORY_MAX_TOKENS'], int(context * LLM_CONFIG['HISTORY_CONTEXT_SHARE']))
+
+def _turn_tokens(cache, encoding_name, message_id, user_msg, bot_reply, model):
+    cached = cache.get(message_id)
+    if cached is not None and cached[0] == encoding_name and cached[1] == user_msg and cached[2] == bot_reply:
+        return cached[3]
+    tokens = count_tokens(user_msg, model) + count_tokens(bot_reply, model) + 2 * MESSAGE_OVERHEAD_TOKENS
+    cache[message_id] = (encoding_name, user_msg, bot_reply, tokens)
+    return tokens
+
+def summary_messages(summary):
+    """The rolling summary as a system message for the prompt, or no messages"""
+    if not summary:
+        return []
+    return [("system", f"Summary of the earlier conversation:\n{summary['text']}")]
+
+def history_messages(state, model, upto, question="", summary=None):
+    """The latest turns before index `upto` that fit the budget, as (role, text) messages oldest first.
+
+    Turns covered by `summary` (message_id < summary["until"]) are skipped.
+    """
+    if "chat_token_counts" not in state:
+        state.chat_token_counts = {}
+    cache = state.chat_token_counts
+    encoding_name, _ = _encoding(model)
+    budget = history_budget(model) - count_tokens(question, model)
+    first = 0
+    if summary:
+        budget -= count_tokens(summary["text"], model) + MESSAGE_OVERHEAD_TOKENS
+        first = max(0, summary["until"] - state.chat_history_offset)
+    selected = []
+    for index in range(upto - 1, first - 1, -1):
+        user_msg, bot_reply = state.chat_history[index]
+        tokens = _turn_tokens(cache, encoding_name, state.chat_history_offset + index, user_msg, bot_reply, model)
+        if tokens > budget:
+            break
+        budget -= tokens
+        selected.append((user_msg, bot_reply))
+
+    if len(cache) > 2 * len(state.chat_history):
+        # Forget turns that are no longer loaded (thread switch, Clear Chat)
+        loaded = range(state.chat_history_offset, state.chat_history_offset + len(state.chat_history))
+        state.chat_token_counts = {i: entry for i, entry in cache.items() if i in loaded}
+
+    messages = []
+    for user_msg, bot_reply in reversed(selected):
+        messages.extend([("human", user_msg), ("ai", bot_reply)])
+    return messages
@@ -0,0 +1,98 @@
+# Rolling summaries of long conversations
+# Once a thread has SUMMARY_TRIGGER_TURNS turns beyond the newest
+# SUMMARY_KEEP_TURNS that are not yet summarized, a cheap model folds them
+# into the thread's stored summary ({text, until, model, updated_at}; turns
+# with message_id < until are covered). The job runs on a daemon thread after
+# the reply is shown, and the summary is stored next to the chat history so
+# later sessions reuse it. Prompts then carry the summary plus the turns after it.
+# A job only saves if the stored summary is still the one it started from, so
+# a job in another process, or a truncation that dropped the summary, wins.
+
+import threading
+from datetime import datetime
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from config import LLM_CONFIG
+from firebase_utils import get_chat_page, get_chat_summary, save_chat_summary
+from llm_chains import get_llm
+from storage_backends import MAIN_THREAD
+
+SUMMARY_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "You maintain a running summary of a conversation between a user and an AI assistant. "
+               "Fold the new turns into the summary so far. Keep names, facts, decisions, preferences and "
+               "open questions the assistant may need later; drop small talk. Answer with the updated "
+               "summary only, in at most {max_words} words."),
+    ("user", "Summary so far:\n{summary}\n\nNew turns:\n{turns}")
+])
+
+# One job per thread at a time
+_thread_locks = {}
+_locks_lock = threading.Lock()
+
+def _thread_lock(username, thread_id):
+    with _locks_lock:
+        return _thread_locks.setdefault((username, thread_id or MAIN_THREAD), threading.Lock())
+
+def summary_model(provider):
+    return LLM_CONFIG['SUMMARY_OPENAI_MODEL'] if provider == "openai" else LLM_CONFIG['SUMMARY_GOOGLE_MODEL']
+
+def pending_range(summary, message_count):
+    """Turns [start, end) to fold into the summary next, or None if the thread is not due"""
+    until = summary["until"] if summary else 0
+    end = message_count - LLM_CONFIG['SUMMARY_KEEP_TURNS']
+    if end - until < LLM_CONFIG['SUMMARY_TRIGGER_TURNS']:
+        return None
+    # Very long threads catch up a batch at a time, oldest first
+    return until, min(end, until + LLM_CONFIG['SUMMARY_BATCH_TURNS'])
+
+def _format_turns(turns):
+    return "\n\n".join(f"User: {turn['user_message']}\nAssistant: {turn['bot_reply']}" for turn in turns)
+
+def update_summary(username, thread_id, message_count, provider, api_key):
+    """Fold due turns into the stored summary; returns the new summary, or None if nothing was due"""
+    previous = summary = get_chat_summary(username, thread_id, refresh=True)
+    due = pending_range(summary, message_count)
+    if due is None:
+        return None
+    start, end = due
+    turns = get_chat_page(username, before=end, limit=end - start, thread_id=thread_id)
+    if [turn["message_id"] for turn in turns] != list(range(start, end)):
+        print(f"⚠️ Skipping summary for {username}: turns {start}-{end - 1} are incomplete")
+        return None
+
+    model = summary_model(provider)
+    chain = SUMMARY_PROMPT | get_llm(provider, model, api_key) | StrOutputParser()
+    text = chain.invoke({
+        "summary": summary["text"] if summary else "(none yet)",
+        "turns": _format_turns(turns),
+        "max_words": LLM_CONFIG['SUMMARY_MAX_WORDS']
+    })
+    summary = {"text": text.strip(), "until": end, "model": model, "updated_at": datetime.now().isoformat()}
+    if get_chat_summary(username, thread_id, refresh=True) != previous:
+        print(f"⚠️ Summary for {username} changed while summarizing; keeping the stored one")
+        return None
+    if not save_chat_summary(username, thread_id, summary):
+        return None
+    print(f"📝 Summarized turns {start}-{end - 1} for {username}")
+    return summary
+
+def schedule_summary(username, thread_id, message_count, provider, api_key):
+    """Update the thread's summary in the background when it has grown enough"""
+    if not LLM_CONFIG['SUMMARY_ENABLED'] or message_count < LLM_CONFIG['SUMMARY_KEEP_TURNS'] + LLM_CONFIG['SUMMARY_TRIGGER_TURNS']:
+        return False
+    lock = _thread_lock(username, thread_id)
+    if not lock.acquire(blocking=False):
+        return False  # a job for this thread is already running
+
+    def run():
+        try:
+            # A long thread catches up one batch per call
+            while update_summary(username, thread_id, message_count, provider, api_key) is not None:
+                pass
+        except Exception as e:
+            print(f"⚠️ Summarization failed for {username}: {e}")
+        finally:
+            lock.release()
+
+    threading.Thread(target=run, name="chat-summary", daemon=True).start()
+    return True
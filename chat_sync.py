@@ -0,0 +1,185 @@
+# Incremental chat history sync
+# Session state keeps a "persisted up to message N" watermark plus the ids of
+# already-persisted turns that were edited since, so a save only writes new or
+# changed turns and every turn keeps the timestamp it was created with.
+# Only a window of the newest turns is held in session state; chat_history[0]
+# is message id chat_history_offset and older pages are prepended on demand.
+# The offset only ever moves to the id of a turn actually loaded: it also
+# sizes the conversation for the next sync, so an empty page sets
+# chat_history_exhausted instead of touching it.
+# Writes go through the write-behind queue unless WRITE_BEHIND_ENABLED is off.
+# The session works on one conversation thread at a time (chat_thread_id).
+
+from datetime import datetime
+from config import STORAGE_CONFIG
+from firebase_utils import save_chat_turns, get_chat_page
+from storage_backends import MAIN_THREAD
+from write_behind import get_write_queue
+
+def _split_turns(turns):
+    return [(t["user_message"], t["bot_reply"]) for t in turns], [t.get("timestamp") for t in turns]
+
+def load_synced_history(state, turns, message_count):
+    """Adopt the newest page of stored turns as the persisted session history"""
+    state.chat_history, state.chat_timestamps = _split_turns(turns)
+    state.chat_history_offset = turns[0]["message_id"] if turns else message_count
+    state.chat_persisted_count = message_count
+    state.chat_history_exhausted = False
+    state.chat_dirty_turns = set()
+
+def load_latest_history(state, username, message_count):
+    """Fetch the newest page of the current thread's turns into session state"""
+    load_synced_history(state, get_chat_page(username, thread_id=state.chat_thread_id), message_count)
+
+def open_thread(state, username, thread_id, message_count):
+    """Switch the session to another thread, loading only that thread's newest page"""
+    state.chat_thread_id = thread_id
+    load_latest_history(state, username, message_count)
+
+def load_older_history(state, username):
+    """Prepend the page of turns just before the loaded window; returns how many were added"""
+    if not has_older_history(state):
+        return 0
+    try:
+        turns = get_chat_page(username, before=state.chat_history_offset, thread_id=state.chat_thread_id, raise_errors=True)
+    except Exception:
+        return 0  # storage error: leave the window as it is so the user can retry
+    # Only keep turns contiguous with the loaded window
+    turns = [t for t in turns if t["message_id"] < state.chat_history_offset]
+    if not turns:
+        # Nothing older is stored (e.g. retention dropped the oldest segments)
+        state.chat_history_exhausted = True
+        return 0
+    history, timestamps = _split_turns(turns)
+    state.chat_history = history + state.chat_history
+    state.chat_timestamps = timestamps + state.chat_timestamps
+    state.chat_history_offset = turns[0]["message_id"]
+    return len(turns)
+
+def has_older_history(state):
+    return state.chat_history_offset > 0 and not state.get("chat_history_exhausted", False)
+
+def ensure_sync_state(state):
+    """Initialize sync bookkeeping for a session that has none yet"""
+    if "chat_history" not in state:
+        state.chat_history = []
+    if "chat_thread_id" not in state:
+        state.chat_thread_id = MAIN_THREAD
+    if "chat_timestamps" not in state:
+        now = datetime.now().isoformat()
+        state.chat_timestamps = [now] * len(state.chat_history)
+    if "chat_history_offset" not in state:
+        state.chat_history_offset = 0
+    if "chat_history_exhausted" not in state:
+        state.chat_history_exhausted = False
+    if "chat_persisted_count" not in state:
+        state.chat_persisted_count = 0
+    if "chat_dirty_turns" not in state:
+        state.chat_dirty_turns = set()
+
+def add_turn(state, user_msg, bot_reply=""):
+    """Append a new turn stamped with its creation time and return its index"""
+    state.chat_history.append((user_msg, bot_reply))
+    state.chat_timestamps.append(datetime.now().isoformat())
+    index = len(state.chat_history) - 1
+    if state.chat_history_offset + index < state.chat_persisted_count:
+        # Reuses a slot that still holds an older stored turn (e.g. after Clear Chat)
+        state.chat_dirty_turns.add(state.chat_history_offset + index)
+    return index
+
+def set_turn(state, index, user_msg, bot_reply):
+    """Replace a turn, marking it dirty if it was already persisted"""
+    state.chat_history[index] = (user_msg, bot_reply)
+    message_id = state.chat_history_offset + index
+    if message_id < state.chat_persisted_count:
+        state.chat_dirty_turns.add(message_id)
+
+def clear_turns(state):
+    """Clear the session history; stored turns are trimmed on the next sync"""
+    state.chat_history = []
+    state.chat_timestamps = []
+    state.chat_history_offset = 0
+    state.chat_history_exhausted = False
+    state.chat_dirty_turns = set()
+
+def total_message_count(state):
+    """Number of turns in the conversation, including pages not loaded"""
+    return state.chat_history_offset + len(state.chat_history)
+
+def session_turns(state):
+    """The turns loaded in session state as turn dicts, oldest first"""
+    return [
+        {
+            "message_id": state.chat_history_offset + i,
+            "user_message": user_msg,
+            "bot_reply": bot_reply,
+            "timestamp": state.chat_timestamps[i] if i < len(state.chat_timestamps) else None
+        }
+        for i, (user_msg, bot_reply) in enumerate(state.chat_history)
+    ]
+
+def has_unsynced_changes(state):
+    return bool(state.chat_dirty_turns) or state.chat_persisted_count != total_message_count(state)
+
+def has_pending_writes(username):
+    """True while queued turns for username have not reached storage yet"""
+    return STORAGE_CONFIG['WRITE_BEHIND_ENABLED'] and get_write_queue().is_pending(username)
+
+def has_failed_writes(state, username):
+    """True if queued turns of the current thread were given up on.
+
+    Rolls the persisted watermark back to what storage holds, so the session
+    counts those turns as unsynced and the next sync resends them.
+    """
+    if not STORAGE_CONFIG['WRITE_BEHIND_ENABLED']:
+        return False
+    stored_count = get_write_queue().failed_writes(username).get(state.chat_thread_id)
+    if stored_count is None:
+        return False
+    if state.chat_persisted_count > stored_count:
+        state.chat_persisted_count = stored_count
+    return True
+
+def flush_chat_history(username):
+    """Block until queued turns for username are written; False if they could not be"""
+    if not STORAGE_CONFIG['WRITE_BEHIND_ENABLED']:
+        return True
+    return get_write_queue().flush(username)
+
+def sync_chat_history(state, username, wait=False):
+    """Persist new or changed turns only; a no-op when nothing changed.
+    
+    With write-behind enabled the turns are queued and this returns at once,
+    unless wait=True, which also flushes the user's queued writes.
+    """
+    ensure_sync_state(state)
+    has_failed_writes(state, username)
+    if not has_unsynced_changes(state):
+        return flush_chat_history(username) if wait else True
+
+    offset = state.chat_history_offset
+    message_count = total_message_count(state)
+    pending = sorted(i for i in state.chat_dirty_turns if offset <= i < message_count)
+    pending.extend(range(max(state.chat_persisted_count, offset), message_count))
+
+    turns = [
+        {
+            "message_id": i,
+            "user_message": state.chat_history[i - offset][0],
+            "bot_reply": state.chat_history[i - offset][1],
+            "timestamp": state.chat_timestamps[i - offset] if i - offset < len(state.chat_timestamps) else None
+        }
+        for i in pending
+    ]
+
+    if STORAGE_CONFIG['WRITE_BEHIND_ENABLED']:
+        get_write_queue().submit(username, turns, message_count, state.chat_persisted_count, state.chat_thread_id)
+        state.chat_persisted_count = message_count
+        state.chat_dirty_turns = set()
+        return flush_chat_history(username) if wait else True
+
+    success = save_chat_turns(username, turns, message_count, state.chat_persisted_count, state.chat_thread_id)
+    if success:
+        state.chat_persisted_count = message_count
+        state.chat_dirty_turns = set()
+    return success
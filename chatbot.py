@@ -1,28 +1,30 @@
 import streamlit as st
-from firebase_utils import save_chat_history, get_user_data
-from langchain_openai import ChatOpenAI
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
+from firebase_utils import get_user_data, list_threads, update_thread, search_chat_history, get_chat_summary
+from chat_sync import (
+    load_latest_history, load_older_history, has_older_history, has_unsynced_changes,
+    has_pending_writes, has_failed_writes, ensure_sync_state, add_turn, set_turn, clear_turns, sync_chat_history,
+    open_thread, total_message_count, session_turns
+)
+from history_export import EXPORT_FORMATS, iter_history_pages, export_history
+from config import STORAGE_CONFIG, LLM_CONFIG, CACHE_CONFIG
+from storage_backends import MAIN_THREAD
+from llm_chains import get_chain
+from chat_memory import history_messages, summary_messages
+from chat_summary import schedule_summary
+from response_cache import get_response_cache, cache_key, context_fingerprint
+from semantic_cache import get_semantic_cache
+from document_index import session_document_index, document_messages
 import time
-import json
 import os
+import uuid
 from datetime import datetime
 
-# --- Enhanced Prompt Templates ---
-def get_prompt_template(personality="helpful"):
-    templates = {
-        "helpful": "You are a helpful, knowledgeable assistant. Provide clear, accurate, and detailed responses.",
-        "creative": "You are a creative assistant with a flair for storytelling and imaginative solutions.",
-        "professional": "You are a professional business assistant. Provide concise, business-focused responses.",
-        "friendly": "You are a friendly, conversational assistant. Be warm, engaging, and personable.",
-        "technical": "You are a technical expert. Provide detailed, accurate technical information and solutions."
-    }
-    
-    return ChatPromptTemplate.from_messages([
-        ("system", templates.get(personality, templates["helpful"])),
-        ("user", "{question}")
-    ])
+NEW_THREAD_TITLE = "New chat"
+MAIN_THREAD_TITLE = "Main chat"
+
+def find_thread(threads, thread_id):
+    """Index entry for thread_id from a list_threads() result, or {}"""
+    return next((thread for thread in threads if thread["thread_id"] == thread_id), {})
 
 # --- Custom CSS for Enhanced UI ---
 def load_custom_css():
@@ -158,35 +160,50 @@ def chatbot_ui():
         st.session_state.message_count = 0
     if "chat_history_loaded" not in st.session_state:
         st.session_state.chat_history_loaded = False
+    if "response_cache_hits" not in st.session_state:
+        st.session_state.response_cache_hits = 0
+        st.session_state.semantic_cache_hits = 0
+        st.session_state.response_cache_misses = 0
+    ensure_sync_state(st.session_state)
     
     # Get user data and load chat history from Firebase
     user_data = get_user_data(st.session_state.current_user)
     display_name = user_data.get("display_name", st.session_state.current_user) if user_data else st.session_state.current_user
     
-    # Load chat history from Firebase
+    # The thread index gives every thread's turn count without reading any turns
+    threads = list_threads(st.session_state.current_user) if user_data else []
+    current_thread = find_thread(threads, st.session_state.chat_thread_id)
+    stored_count = current_thread.get("message_count", 0)
+    
+    # Load the newest page of chat history from Firebase
     if not st.session_state.chat_history_loaded:
-        if user_data and user_data.get("chat_history"):
-            st.session_state.chat_history = user_data.get("chat_history", [])
-            st.session_state.message_count = len(st.session_state.chat_history)
+        if user_data and stored_count:
+            load_latest_history(st.session_state, st.session_state.current_user, stored_count)
+            st.session_state.message_count = stored_count
             st.session_state.chat_history_loaded = True
-            st.success(f"📚 Loaded {len(st.session_state.chat_history)} previous messages!")
+            st.success(f"📚 Loaded {len(st.session_state.chat_history)} of {stored_count} previous messages!")
         elif user_data is None:
             # Firebase not configured or user not found
             st.session_state.chat_history_loaded = True
             st.info("💡 Firebase not configured - chat history will be session-only")
         else:
             # User exists but no chat history
+            load_latest_history(st.session_state, st.session_state.current_user, 0)
             st.session_state.chat_history_loaded = True
             st.info("📭 No previous chat history found for this user")
     
     # Check if we need to refresh chat history (for logout/login scenarios)
-    elif st.session_state.chat_history_loaded and user_data and user_data.get("chat_history"):
-        # Check if the loaded chat history is different from what's in Firebase
-        firebase_chat_history = user_data.get("chat_history", [])
-        if len(firebase_chat_history) != len(st.session_state.chat_history):
-            st.session_state.chat_history = firebase_chat_history
-            st.session_state.message_count = len(firebase_chat_history)
-            st.success(f"📚 Refreshed chat history - {len(firebase_chat_history)} messages loaded!")
+    elif has_failed_writes(st.session_state, st.session_state.current_user):
+        # Checked first: the rolled-back watermark keeps the unsaved turns from being reloaded over
+        st.error("❌ Some messages could not be saved. They will be saved with your next message, or use 💾 Save Chat.")
+    elif st.session_state.chat_history_loaded and user_data and stored_count:
+        # Check if the stored message counter moved on without this session
+        if (stored_count != st.session_state.chat_persisted_count
+                and not has_unsynced_changes(st.session_state)
+                and not has_pending_writes(st.session_state.current_user)):
+            load_latest_history(st.session_state, st.session_state.current_user, stored_count)
+            st.session_state.message_count = stored_count
+            st.success(f"📚 Refreshed chat history - {stored_count} messages stored!")
             st.rerun()
     
     # --- Enhanced Sidebar ---
@@ -198,6 +215,54 @@ def chatbot_ui():
             </div>
         """, unsafe_allow_html=True)
         
+        # Conversation threads
+        st.markdown("### 💬 Conversations")
+        if st.button("➕ New Chat", use_container_width=True):
+            # Persist the open thread before leaving it
+            sync_chat_history(st.session_state, st.session_state.current_user, wait=True)
+            thread_id = uuid.uuid4().hex[:12]
+            update_thread(st.session_state.current_user, thread_id, {
+                "title": NEW_THREAD_TITLE,
+                "model": st.session_state.selected_model,
+                "created_at": datetime.now().isoformat()
+            })
+            open_thread(st.session_state, st.session_state.current_user, thread_id, 0)
+            st.session_state.message_count = 0
+            st.rerun()
+        
+        for thread in threads:
+            is_current = thread["thread_id"] == st.session_state.chat_thread_id
+            title = thread.get("title") or (MAIN_THREAD_TITLE if thread["thread_id"] == MAIN_THREAD else NEW_THREAD_TITLE)
+            label = f"{'▶️' if is_current else '💬'} {title} ({thread.get('message_count', 0)})"
+            if st.button(label, key=f"thread_{thread['thread_id']}", use_container_width=True, disabled=is_current):
+                sync_chat_history(st.session_state, st.session_state.current_user, wait=True)
+                open_thread(st.session_state, st.session_state.current_user, thread["thread_id"], thread.get("message_count", 0))
+                st.session_state.message_count = thread.get("message_count", 0)
+                st.rerun()
+        
+        # Full-text search over every thread, served from the search index
+        st.markdown("### 🔎 Search History")
+        search_query = st.text_input("Search history", key="history_search", placeholder="Find an old message...")
+        if search_query.strip():
+            results = search_chat_history(st.session_state.current_user, search_query) if user_data else []
+            if not results:
+                st.caption("No matching messages found.")
+            for result in results:
+                thread = find_thread(threads, result["thread_id"])
+                title = thread.get("title") or (MAIN_THREAD_TITLE if result["thread_id"] == MAIN_THREAD else NEW_THREAD_TITLE)
+                with st.expander(f"💬 {title} · #{result['message_id'] + 1}"):
+                    st.markdown(f"**You:** {result['user_message']}")
+                    st.markdown(f"**AI:** {result['bot_reply']}")
+                    if result["thread_id"] != st.session_state.chat_thread_id and st.button(
+                        "Open conversation", key=f"search_open_{result['thread_id']}_{result['message_id']}"
+                    ):
+                        sync_chat_history(st.session_state, st.session_state.current_user, wait=True)
+                        open_thread(st.session_state, st.session_state.current_user, result["thread_id"], thread.get("message_count", 0))
+                        st.session_state.message_count = thread.get("message_count", 0)
+                        st.rerun()
+        
+        st.markdown("---")
+        
         st.markdown("### ⚙️ Settings")
         
         # Model Selection
@@ -236,6 +301,12 @@ def chatbot_ui():
         )
         st.session_state.personality = personality_options[selected_personality_name]
         
+        st.checkbox(
+            "🔄 Fresh answer (skip response cache)",
+            key="bypass_response_cache",
+            help="Ask the model even if this or a very similar question was answered before"
+        )
+        
         st.markdown("---")
         
         # File Upload
@@ -247,10 +318,15 @@ def chatbot_ui():
             help="Upload files to provide context for the AI"
         )
         
+        # Removed files must stop reaching the prompt too
+        st.session_state.uploaded_files = uploaded_files or []
         if uploaded_files:
-            st.session_state.uploaded_files = uploaded_files
+            document_index = session_document_index(st.session_state)
             for file in uploaded_files:
-                st.success(f"📄 {file.name}")
+                if file.name in document_index.failed:
+                    st.warning(f"⚠️ {file.name} (could not read its text)")
+                else:
+                    st.success(f"📄 {file.name}")
         
         st.markdown("---")
         
@@ -261,7 +337,8 @@ def chatbot_ui():
                 <strong>Messages:</strong> {st.session_state.message_count}<br>
                 <strong>Model:</strong> {st.session_state.selected_model}<br>
                 <strong>Personality:</strong> {selected_personality_name}<br>
-                <strong>Files:</strong> {len(st.session_state.uploaded_files)}
+                <strong>Files:</strong> {len(st.session_state.uploaded_files)}<br>
+                <strong>Cache:</strong> {st.session_state.response_cache_hits} exact + {st.session_state.semantic_cache_hits} similar hits / {st.session_state.response_cache_misses} misses
             </div>
         """, unsafe_allow_html=True)
         
@@ -270,14 +347,14 @@ def chatbot_ui():
         col1, col2 = st.columns(2)
         with col1:
             if st.button("🗑️ Clear Chat", use_container_width=True):
-                st.session_state.chat_history = []
+                clear_turns(st.session_state)
                 st.session_state.message_count = 0
                 st.rerun()
         
         with col2:
             if st.button("💾 Save Chat", use_container_width=True):
                 if st.session_state.chat_history:
-                    success = save_chat_history(st.session_state.current_user, st.session_state.chat_history)
+                    success = sync_chat_history(st.session_state, st.session_state.current_user, wait=True)
                     if success:
                         st.success("✅ Chat saved to Firebase!")
                     else:
@@ -288,13 +365,14 @@ def chatbot_ui():
         # Load Previous Chat Button
         if st.button("📚 Load Previous Chat", use_container_width=True):
             user_data = get_user_data(st.session_state.current_user)
+            thread_count = find_thread(list_threads(st.session_state.current_user), st.session_state.chat_thread_id).get("message_count", 0) if user_data else 0
             if user_data is None:
                 st.error("❌ Firebase not configured. Please set up Firebase to save chat history.")
-            elif user_data and user_data.get("chat_history"):
-                st.session_state.chat_history = user_data.get("chat_history", [])
-                st.session_state.message_count = len(st.session_state.chat_history)
+            elif thread_count:
+                load_latest_history(st.session_state, st.session_state.current_user, thread_count)
+                st.session_state.message_count = thread_count
                 st.session_state.chat_history_loaded = True
-                st.success(f"📚 Loaded {len(st.session_state.chat_history)} previous messages!")
+                st.success(f"📚 Loaded {len(st.session_state.chat_history)} of {thread_count} previous messages!")
                 st.rerun()
             else:
                 st.info("📭 No previous chat history found for this user.")
@@ -306,8 +384,10 @@ def chatbot_ui():
             st.write(f"Current User: {st.session_state.current_user}")
             st.write(f"User Data Exists: {user_data is not None}")
             if user_data:
-                st.write(f"Chat History in Firebase: {len(user_data.get('chat_history', []))} messages")
-                st.write(f"Current Session Chat History: {len(st.session_state.chat_history)} messages")
+                st.write(f"Current Thread: {st.session_state.chat_thread_id} ({len(threads)} thread(s) in index)")
+                st.write(f"Chat History in Firebase: {stored_count} messages")
+                st.write(f"Current Session Chat History: {len(st.session_state.chat_history)} messages loaded")
+                st.write(f"Oldest Loaded Message ID: {st.session_state.chat_history_offset}")
                 st.write(f"Chat History Loaded Flag: {st.session_state.chat_history_loaded}")
             else:
                 st.write("No user data found in Firebase")
@@ -315,9 +395,9 @@ def chatbot_ui():
         # Logout Button
         st.markdown("### 🚪 Account")
         if st.button("🚪 Logout", use_container_width=True, type="primary"):
-            # Save current chat history before logout
+            # Save current chat history and flush queued writes before logout
             if st.session_state.chat_history:
-                success = save_chat_history(st.session_state.current_user, st.session_state.chat_history)
+                success = sync_chat_history(st.session_state, st.session_state.current_user, wait=True)
                 if success:
                     st.success("💾 Chat history saved before logout!")
                 else:
@@ -474,6 +554,11 @@ def chatbot_ui():
     
     # Display Chat History
     with chat_container:
+        if has_older_history(st.session_state):
+            if st.button(f"⬆️ Load older messages ({st.session_state.chat_history_offset} more)", use_container_width=True):
+                load_older_history(st.session_state, st.session_state.current_user)
+                st.rerun()
+        
         if st.session_state.chat_history:
             for i, (user_msg, bot_reply) in enumerate(st.session_state.chat_history):
                 with st.chat_message("user", avatar="🧑‍💻"):
@@ -508,83 +593,129 @@ def chatbot_ui():
         st.session_state.message_count += 1
         
         # Add user message to history
-        st.session_state.chat_history.append((user_input, ""))
+        turn_index = add_turn(st.session_state, user_input)
         
-        # Generate response with typing animation
+        with st.chat_message("user", avatar="🧑‍💻"):
+            st.markdown(user_input)
+        
+        # Stream the response into the assistant message as it is generated
         with st.chat_message("assistant", avatar="🤖"):
-            with st.spinner("🤔 Thinking..."):
-                try:
-                    # Check if any API key is available
-                    openai_valid = st.session_state.openai_api_key and st.session_state.openai_api_key.startswith("sk-")
-                    google_valid = st.session_state.google_api_key and st.session_state.google_api_key.startswith("AI")
+            try:
+                # Check if any API key is available
+                openai_valid = st.session_state.openai_api_key and st.session_state.openai_api_key.startswith("sk-")
+                google_valid = st.session_state.google_api_key and st.session_state.google_api_key.startswith("AI")
+                chain = None
+                provider = None
+                
+                if not openai_valid and not google_valid:
+                    # Demo response when no API key
+                    demo_responses = {
+                        "hello": "Hello! 👋 I'm your AI assistant. Please enter at least one API key (OpenAI or Google) in the sidebar to enable real AI responses.",
+                        "help": "I can help you with various tasks! Enter an API key in the sidebar to unlock my full potential.",
+                        "what": "I'm an AI chatbot powered by OpenAI and Google Gemini. Enter an API key in the sidebar to start chatting with real AI responses.",
+                        "api": "To get API keys: 1) OpenAI: https://platform.openai.com/api-keys 2) Google: https://makersuite.google.com/app/apikey",
+                    }
                     
-                    if not openai_valid and not google_valid:
-                        # Demo response when no API key
-                        demo_responses = {
-                            "hello": "Hello! 👋 I'm your AI assistant. Please enter at least one API key (OpenAI or Google) in the sidebar to enable real AI responses.",
-                            "help": "I can help you with various tasks! Enter an API key in the sidebar to unlock my full potential.",
-                            "what": "I'm an AI chatbot powered by OpenAI and Google Gemini. Enter an API key in the sidebar to start chatting with real AI responses.",
-                            "api": "To get API keys: 1) OpenAI: https://platform.openai.com/api-keys 2) Google: https://makersuite.google.com/app/apikey",
-                        }
-                        
-                        # Simple keyword matching for demo
-                        user_lower = user_input.lower()
-                        response = "Thanks for your message! 🤖 To get real AI responses, please enter at least one API key in the sidebar. Click 'How to get API keys' for instructions."
-                        
-                        for keyword, demo_response in demo_responses.items():
-                            if keyword in user_lower:
-                                response = demo_response
-                                break
-                    else:
-                        # Determine which model to use based on selection and available API keys
-                        model_name = st.session_state.selected_model
-                        
-                        if model_name.startswith("gpt-"):
-                            # Use OpenAI models
-                            if not openai_valid:
-                                response = "❌ OpenAI API key required for GPT models. Please enter your OpenAI API key in the sidebar."
-                            else:
-                                llm = ChatOpenAI(
-                                    model=model_name,
-                                    api_key=st.session_state.openai_api_key
-                                )
-                                prompt = get_prompt_template(st.session_state.personality)
-                                output_parser = StrOutputParser()
-                                chain = prompt | llm | output_parser
-                                response = chain.invoke({"question": user_input})
-                        
-                        elif model_name.startswith("gemini-"):
-                            # Use Google Gemini models
-                            if not google_valid:
-                                response = "❌ Google API key required for Gemini models. Please enter your Google API key in the sidebar."
-                            else:
-                                llm = ChatGoogleGenerativeAI(
-                                    model=model_name,
-                                    google_api_key=st.session_state.google_api_key
-                                )
-                                prompt = get_prompt_template(st.session_state.personality)
-                                output_parser = StrOutputParser()
-                                chain = prompt | llm | output_parser
-                                response = chain.invoke({"question": user_input})
-                        
+                    # Simple keyword matching for demo
+                    user_lower = user_input.lower()
+                    response = "Thanks for your message! 🤖 To get real AI responses, please enter at least one API key in the sidebar. Click 'How to get API keys' for instructions."
+                    
+                    for keyword, demo_response in demo_responses.items():
+                        if keyword in user_lower:
+                            response = demo_response
+                            break
+                else:
+                    # Determine which model to use based on selection and available API keys
+                    model_name = st.session_state.selected_model
+                    
+                    if model_name.startswith("gpt-"):
+                        # Use OpenAI models
+                        if not openai_valid:
+                            response = "❌ OpenAI API key required for GPT models. Please enter your OpenAI API key in the sidebar."
                         else:
-                            response = "❌ Unknown model selected. Please choose a valid model."
+                            provider, api_key = "openai", st.session_state.openai_api_key
+                            chain = get_chain(provider, model_name, api_key, st.session_state.personality)
                     
-                    # Update the last message in history
-                    st.session_state.chat_history[-1] = (user_input, response)
+                    elif model_name.startswith("gemini-"):
+                        # Use Google Gemini models
+                        if not google_valid:
+                            response = "❌ Google API key required for Gemini models. Please enter your Google API key in the sidebar."
+                        else:
+                            provider, api_key = "google", st.session_state.google_api_key
+                            chain = get_chain(provider, model_name, api_key, st.session_state.personality)
                     
-                    # Save to Firebase
-                    save_chat_history(st.session_state.current_user, st.session_state.chat_history)
-
-                    # Display response
+                    else:
+                        response = "❌ Unknown model selected. Please choose a valid model."
+                
+                if chain is not None:
+                    summary = get_chat_summary(st.session_state.current_user, st.session_state.chat_thread_id) if st.session_state.current_user else None
+                    if summary and summary["until"] > st.session_state.chat_history_offset + turn_index:
+                        summary = None  # left over from before a Clear Chat
+                    documents = []
+                    if LLM_CONFIG['RAG_ENABLED'] and st.session_state.uploaded_files:
+                        documents = document_messages(session_document_index(st.session_state), user_input, model_name)
+                    prompt = {
+                        "question": user_input,
+                        "summary": summary_messages(summary),
+                        "documents": documents,
+                        "history": history_messages(st.session_state, model_name, turn_index, user_input, summary)
+                    }
+                    cache = get_response_cache()
+                    similar_cache = get_semantic_cache()
+                    cache_user = None if CACHE_CONFIG['SEMANTIC_CACHE_SHARED'] else st.session_state.current_user
+                    context = context_fingerprint(prompt["summary"], prompt["documents"], prompt["history"])
+                    key = cache_key(user_input, model_name, st.session_state.personality, context)
+                    response = None
+                    if not st.session_state.get("bypass_response_cache"):
+                        if cache is not None:
+                            response = cache.get(key)
+                            if response is not None:
+                                st.session_state.response_cache_hits += 1
+                        if response is None and similar_cache is not None:
+                            response, _ = similar_cache.get(user_input, model_name, st.session_state.personality, context, cache_user)
+                            if response is not None:
+                                st.session_state.semantic_cache_hits += 1
+                        if response is None and (cache is not None or similar_cache is not None):
+                            st.session_state.response_cache_misses += 1
+                    if response is not None:
+                        st.markdown(response)
+                    else:
+                        # Tokens are rendered as they arrive; write_stream returns the full text
+                        response = st.write_stream(chain.stream(prompt))
+                        if response:
+                            if cache is not None:
+                                cache.put(key, response)
+                            if similar_cache is not None:
+                                similar_cache.put(user_input, model_name, st.session_state.personality, response, context, cache_user)
+                else:
                     st.markdown(response)
-                    
-                except Exception as e:
-                    error_msg = f"Sorry, I encountered an error: {str(e)}"
-                    st.session_state.chat_history[-1] = (user_input, error_msg)
-                    st.error(error_msg)
-        
-        # Rerun to show the new messages
+                
+                # Persist the finished reply once, not per token
+                set_turn(st.session_state, turn_index, user_input, response)
+                
+                # Queue only the unsynced turns for a background save to Firebase
+                sync_chat_history(st.session_state, st.session_state.current_user)
+                
+                # Keep the thread index's title and model current
+                thread_fields = {}
+                if total_message_count(st.session_state) == 1 and current_thread.get("title", NEW_THREAD_TITLE) == NEW_THREAD_TITLE:
+                    thread_fields["title"] = user_input[:40]
+                if current_thread.get("model") != st.session_state.selected_model:
+                    thread_fields["model"] = st.session_state.selected_model
+                if thread_fields:
+                    update_thread(st.session_state.current_user, st.session_state.chat_thread_id, thread_fields)
+                
+                # Fold older turns into the rolling summary once the reply is shown
+                if provider and st.session_state.current_user:
+                    schedule_summary(st.session_state.current_user, st.session_state.chat_thread_id,
+                                     total_message_count(st.session_state), provider, api_key)
+                
+            except Exception as e:
+                error_msg = f"Sorry, I encountered an error: {str(e)}"
+                set_turn(st.session_state, turn_index, user_input, error_msg)
+                st.error(error_msg)
+        
+        # Rerun so the sidebar stats and thread list include the new turn
         st.rerun()
     
     # Download and Export Options
@@ -593,28 +724,47 @@ def chatbot_ui():
         col1, col2, col3 = st.columns(3)
         
         with col1:
-            # Download as text
-            chat_text = "\n\n".join([f"User: {q}\nBot: {a}" for q, a in st.session_state.chat_history])
-            st.download_button(
-                "📥 Download as Text",
-                chat_text,
-                file_name=f"chat_history_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
-                use_container_width=True
+            # Export formats are only built when asked for, never on a plain rerun
+            export_format = st.selectbox(
+                "Export format",
+                options=list(EXPORT_FORMATS.keys()),
+                format_func=lambda fmt: EXPORT_FORMATS[fmt][0],
+                key="export_format",
+                label_visibility="collapsed"
             )
 
         with col2:
-            # Download as JSON
-            chat_json = json.dumps(st.session_state.chat_history, indent=2)
-            st.download_button(
-                "📄 Download as JSON",
-                chat_json,
-                file_name=f"chat_history_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
-                mime="application/json",
-                use_container_width=True
-            )
+            # The export is handed to the download button in the run that built it and
+            # never kept in session state; the next rerun shows Prepare Export again
+            export_slot = st.empty()
+            if export_slot.button("📦 Prepare Export", use_container_width=True):
+                with st.spinner("Exporting chat history..."):
+                    if user_data and sync_chat_history(st.session_state, st.session_state.current_user, wait=True):
+                        # Stream the whole thread from storage, including pages not loaded in this session
+                        pages = iter_history_pages(
+                            st.session_state.current_user, st.session_state.chat_thread_id,
+                            total_message_count(st.session_state), STORAGE_CONFIG['EXPORT_CHUNK_TURNS']
+                        )
+                    else:
+                        pages = [session_turns(st.session_state)]
+                    try:
+                        with export_history(export_format, pages) as out:
+                            label, mime, extension = EXPORT_FORMATS[export_format]
+                            export_slot.download_button(
+                                f"📥 Download {label}",
+                                out.read(),
+                                file_name=f"chat_history_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}",
+                                mime=mime,
+                                on_click="ignore",
+                                use_container_width=True
+                            )
+                    except Exception as e:
+                        st.error(f"❌ Export failed, nothing was downloaded: {e}")
         
         with col3:
             # Export to Firebase
             if st.button("☁️ Save to Cloud", use_container_width=True):
-                save_chat_history(st.session_state.current_user, st.session_state.chat_history)
-                st.success("✅ Chat saved to cloud!")
\ No newline at end of file
+                if sync_chat_history(st.session_state, st.session_state.current_user, wait=True):
+                    st.success("✅ Chat saved to cloud!")
+                else:
+                    st.error("❌ Failed to save chat. Check Firebase configuration.")
\ No newline at end of file
@@ -0,0 +1,64 @@
+# Circuit breaker for remote calls
+# Closed: calls go through and consecutive failures are counted. After
+# failure_threshold failures the breaker opens and callers skip the remote
+# service entirely for reset_timeout seconds. It then goes half-open and lets
+# a single probe call through: success closes it, failure re-opens it.
+
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30, on_close=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_close = on_close
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def allow(self):
+        """True if the caller may try the remote service now"""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = HALF_OPEN
+            if self._state == HALF_OPEN and not self._probing:
+                # Only one probe at a time; everyone else keeps using the fallback
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            recovered = self._state != CLOSED
+            self._state = CLOSED
+            self._failures = 0
+            self._probing = False
+        if recovered:
+            print("✅ Circuit breaker closed, remote storage is reachable again")
+            if self.on_close:
+                self.on_close()
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    print(f"⚠️ Circuit breaker opened after {self._failures} failure(s)")
+                self._state = OPEN
+                self._opened_at = time.monotonic()
@@ -56,6 +56,83 @@ OAUTH_CONFIG = {
     'APPLE_REDIRECT_URI': os.getenv('APPLE_REDIRECT_URI'),
 }
 
+# Storage Configuration
+STORAGE_CONFIG = {
+    'BACKEND': os.getenv('STORAGE_BACKEND', 'auto').lower(),
+    'HISTORY_PAGE_SIZE': int(os.getenv('HISTORY_PAGE_SIZE', '50')),
+    'LOCAL_STORE': os.getenv('LOCAL_STORE', 'sqlite'),
+    'LOCAL_DB_PATH': os.getenv('LOCAL_DB_PATH', 'user_data/chatbot.db'),
+    'LOCAL_JSONL_DIR': os.getenv('LOCAL_JSONL_DIR', 'user_data/logs'),
+    'JSONL_SEGMENT_MAX_BYTES': int(os.getenv('JSONL_SEGMENT_MAX_BYTES', str(4 * 1024 * 1024))),
+    'JSONL_COMPACT_INTERVAL': float(os.getenv('JSONL_COMPACT_INTERVAL', '60')),
+    'WRITE_BEHIND_ENABLED': os.getenv('WRITE_BEHIND_ENABLED', 'true').lower() == 'true',
+    'WRITE_BEHIND_MAX_RETRIES': int(os.getenv('WRITE_BEHIND_MAX_RETRIES', '5')),
+    'WRITE_BEHIND_RETRY_DELAY': float(os.getenv('WRITE_BEHIND_RETRY_DELAY', '0.5')),
+    'FIRESTORE_TIMEOUT': float(os.getenv('FIRESTORE_TIMEOUT', '10')),
+    'FIREBASE_INIT_RETRY_SECONDS': float(os.getenv('FIREBASE_INIT_RETRY_SECONDS', '60')),
+    'CIRCUIT_BREAKER_FAILURE_THRESHOLD': int(os.getenv('CIRCUIT_BREAKER_FAILURE_THRESHOLD', '5')),
+    'CIRCUIT_BREAKER_RESET_TIMEOUT': float(os.getenv('CIRCUIT_BREAKER_RESET_TIMEOUT', '30')),
+    'RECONCILE_JOURNAL_PATH': os.getenv('RECONCILE_JOURNAL_PATH', 'user_data/reconcile.jsonl'),
+    'ARCHIVE_ENABLED': os.getenv('ARCHIVE_ENABLED', 'true').lower() == 'true',
+    'ARCHIVE_HOT_WINDOW': int(os.getenv('ARCHIVE_HOT_WINDOW', '500')),
+    'ARCHIVE_SEGMENT_TURNS': int(os.getenv('ARCHIVE_SEGMENT_TURNS', '200')),
+    'ARCHIVE_SEGMENT_MAX_BYTES': int(os.getenv('ARCHIVE_SEGMENT_MAX_BYTES', '900000')),
+    'ARCHIVE_RETRY_SECONDS': float(os.getenv('ARCHIVE_RETRY_SECONDS', '300')),
+    'ARCHIVE_ZSTD_LEVEL': int(os.getenv('ARCHIVE_ZSTD_LEVEL', '10')),
+    'ARCHIVE_CACHE_SEGMENTS': int(os.getenv('ARCHIVE_CACHE_SEGMENTS', '32')),
+    'SEARCH_ENABLED': os.getenv('SEARCH_ENABLED', 'true').lower() == 'true',
+    'SEARCH_MAX_RESULTS': int(os.getenv('SEARCH_MAX_RESULTS', '10')),
+    'EXPORT_CHUNK_TURNS': int(os.getenv('EXPORT_CHUNK_TURNS', '500')),
+    'TRANSFER_WORKERS': int(os.getenv('TRANSFER_WORKERS', '8')),
+    'RETENTION_ENABLED': os.getenv('RETENTION_ENABLED', 'false').lower() == 'true',
+    'RETENTION_INTERVAL_HOURS': float(os.getenv('RETENTION_INTERVAL_HOURS', '24')),
+    'RETENTION_DEMO_USER_DAYS': float(os.getenv('RETENTION_DEMO_USER_DAYS', '7')),
+    'RETENTION_THREAD_DAYS': float(os.getenv('RETENTION_THREAD_DAYS', '0')),
+    'RETENTION_MAX_TURNS_PER_THREAD': int(os.getenv('RETENTION_MAX_TURNS_PER_THREAD', '0')),
+    'RETENTION_BATCH_SIZE': int(os.getenv('RETENTION_BATCH_SIZE', '100')),
+    'RETENTION_BATCH_PAUSE': float(os.getenv('RETENTION_BATCH_PAUSE', '1.0')),
+}
+
+# Cache Configuration
+CACHE_CONFIG = {
+    'USER_CACHE_TTL_SECONDS': float(os.getenv('USER_CACHE_TTL_SECONDS', '30')),
+    'USER_CACHE_MAX_ENTRIES': int(os.getenv('USER_CACHE_MAX_ENTRIES', '1024')),
+    'LLM_POOL_MAX_ENTRIES': int(os.getenv('LLM_POOL_MAX_ENTRIES', '64')),
+    'LLM_POOL_IDLE_SECONDS': float(os.getenv('LLM_POOL_IDLE_SECONDS', '900')),
+    'RESPONSE_CACHE_ENABLED': os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true',
+    'RESPONSE_CACHE_TTL_SECONDS': float(os.getenv('RESPONSE_CACHE_TTL_SECONDS', '86400')),
+    'RESPONSE_CACHE_MAX_ENTRIES': int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '1024')),
+    'RESPONSE_CACHE_PATH': os.getenv('RESPONSE_CACHE_PATH', 'user_data/response_cache.db'),
+    'RESPONSE_CACHE_DISK_MAX_ENTRIES': int(os.getenv('RESPONSE_CACHE_DISK_MAX_ENTRIES', '10000')),
+    'SEMANTIC_CACHE_ENABLED': os.getenv('SEMANTIC_CACHE_ENABLED', 'false').lower() == 'true',
+    'SEMANTIC_CACHE_SHARED': os.getenv('SEMANTIC_CACHE_SHARED', 'false').lower() == 'true',
+    'SEMANTIC_CACHE_EMBEDDER': os.getenv('SEMANTIC_CACHE_EMBEDDER', 'hashing'),
+    'SEMANTIC_CACHE_DIM': int(os.getenv('SEMANTIC_CACHE_DIM', '1024')),
+    'SEMANTIC_CACHE_MAX_ENTRIES': int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', '2048')),
+    'SEMANTIC_CACHE_TTL_SECONDS': float(os.getenv('SEMANTIC_CACHE_TTL_SECONDS', '86400')),
+    'SEMANTIC_CACHE_THRESHOLD': float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.93')),
+    'SEMANTIC_CACHE_THRESHOLDS': os.getenv('SEMANTIC_CACHE_THRESHOLDS', 'creative=0.97,technical=0.95'),
+}
+
+# LLM Configuration
+LLM_CONFIG = {
+    'HISTORY_MAX_TOKENS': int(os.getenv('HISTORY_MAX_TOKENS', '4000')),
+    'HISTORY_CONTEXT_SHARE': float(os.getenv('HISTORY_CONTEXT_SHARE', '0.5')),
+    'SUMMARY_ENABLED': os.getenv('SUMMARY_ENABLED', 'true').lower() == 'true',
+    'SUMMARY_KEEP_TURNS': int(os.getenv('SUMMARY_KEEP_TURNS', '10')),
+    'SUMMARY_TRIGGER_TURNS': int(os.getenv('SUMMARY_TRIGGER_TURNS', '20')),
+    'SUMMARY_BATCH_TURNS': int(os.getenv('SUMMARY_BATCH_TURNS', '40')),
+    'SUMMARY_MAX_WORDS': int(os.getenv('SUMMARY_MAX_WORDS', '250')),
+    'SUMMARY_OPENAI_MODEL': os.getenv('SUMMARY_OPENAI_MODEL', 'gpt-4o-mini'),
+    'SUMMARY_GOOGLE_MODEL': os.getenv('SUMMARY_GOOGLE_MODEL', 'gemini-1.5-flash'),
+    'RAG_ENABLED': os.getenv('RAG_ENABLED', 'true').lower() == 'true',
+    'RAG_CHUNK_WORDS': int(os.getenv('RAG_CHUNK_WORDS', '200')),
+    'RAG_CHUNK_OVERLAP_WORDS': int(os.getenv('RAG_CHUNK_OVERLAP_WORDS', '40')),
+    'RAG_TOP_K': int(os.getenv('RAG_TOP_K', '4')),
+    'RAG_MAX_TOKENS': int(os.getenv('RAG_MAX_TOKENS', '1500')),
+    'RAG_CONTEXT_SHARE': float(os.getenv('RAG_CONTEXT_SHARE', '0.25')),
+}
+
 # Streamlit Configuration
 STREAMLIT_CONFIG = {
     'SERVER_PORT': int(os.getenv('STREAMLIT_SERVER_PORT', '8501')),
@@ -80,6 +157,9 @@ def get_config():
         'security': SECURITY_CONFIG,
         'firebase': FIREBASE_CONFIG,
         'oauth': OAUTH_CONFIG,
+        'storage': STORAGE_CONFIG,
+        'cache': CACHE_CONFIG,
+        'llm': LLM_CONFIG,
         'streamlit': STREAMLIT_CONFIG,
         'app': APP_CONFIG,
     }
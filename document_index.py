@@ -0,0 +1,146 @@
+# Retrieval over uploaded documents
+# Text is extracted from each uploaded file (txt, md, docx, pdf), split into
+# overlapping word windows and indexed in memory with the same tokenizer and
+# BM25 scoring as the chat history search. For each question the best chunks
+# are added to the prompt, as many of the top RAG_TOP_K as fit its token
+# budget, so a long reference document costs a few hundred tokens per turn
+# instead of its full length. The index lives in the session and is rebuilt
+# only when the set of uploaded files changes.
+
+import io
+import math
+import zipfile
+import xml.etree.ElementTree as ET
+from collections import Counter
+from config import LLM_CONFIG
+from chat_memory import MODEL_CONTEXT_TOKENS, DEFAULT_CONTEXT_TOKENS, MESSAGE_OVERHEAD_TOKENS, count_tokens
+from search_index import tokenize, K1, B, MAX_QUERY_TERMS
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # pragma: no cover - PDFs are skipped without pypdf
+    PdfReader = None
+
+WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+TEXT_EXTENSIONS = ("txt", "md")
+
+def _extract_docx(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        root = ET.fromstring(archive.read("word/document.xml"))
+    paragraphs = []
+    for paragraph in root.iter(f"{WORD_NS}p"):
+        parts = []
+        for node in paragraph.iter():
+            if node.tag == f"{WORD_NS}t":
+                parts.append(node.text or "")
+            elif node.tag in (f"{WORD_NS}tab", f"{WORD_NS}br"):
+                parts.append(" ")
+        paragraphs.append("".join(parts))
+    return "\n".join(paragraphs)
+
+def _extract_pdf(data):
+    if PdfReader is None:
+        raise RuntimeError("pypdf is not installed")
+    return "\n".join(page.extract_text() or "" for page in PdfReader(io.BytesIO(data)).pages)
+
+def extract_text(name, data):
+    """Plain text of an uploaded file, by extension"""
+    extension = name.rsplit(".", 1)[-1].lower() if "." in name else ""
+    if extension == "docx":
+        return _extract_docx(data)
+    if extension == "pdf":
+        return _extract_pdf(data)
+    if extension in TEXT_EXTENSIONS:
+        return data.decode("utf-8-sig", errors="replace")
+    raise ValueError(f"unsupported file type '{extension}'")
+
+def chunk_text(text, chunk_words=200, overlap_words=40):
+    """Windows of chunk_words words, each starting overlap_words before the previous one ended"""
+    words = text.split()
+    step = max(1, chunk_words - overlap_words)
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(" ".join(words[start:start + chunk_words]))
+        if start + chunk_words >= len(words):
+            break
+    return chunks
+
+class DocumentIndex:
+    """BM25 inverted index over the chunks of a set of documents"""
+
+    def __init__(self):
+        self.chunks = []      # (document name, chunk number, text)
+        self.lengths = []
+        self.postings = {}    # term -> [(chunk id, tf)]
+        self.failed = []      # names of files whose text could not be extracted
+
+    def add_document(self, name, text, chunk_words=200, overlap_words=40):
+        for number, chunk in enumerate(chunk_text(text, chunk_words, overlap_words)):
+            counts = Counter(tokenize(chunk))
+            chunk_id = len(self.chunks)
+            self.chunks.append((name, number, chunk))
+            self.lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings.setdefault(term, []).append((chunk_id, tf))
+
+    def search(self, query, limit=4):
+        """Best chunks for a query as (name, number, text, score), best first"""
+        terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+        if not terms or not self.chunks:
+            return []
+        total = len(self.chunks)
+        avg_length = sum(self.lengths) / total or 1
+        scores = Counter()
+        for term in terms:
+            postings = self.postings.get(term, [])
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, tf in postings:
+                scores[chunk_id] += idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * self.lengths[chunk_id] / avg_length))
+        return [(*self.chunks[chunk_id], round(score, 4)) for chunk_id, score in scores.most_common(limit)]
+
+    def __len__(self):
+        return len(self.chunks)
+
+def files_key(files):
+    """Identifies a set of uploaded files, so the index is only rebuilt when it changes"""
+    return tuple((file.name, file.size, getattr(file, "file_id", None)) for file in files)
+
+def build_document_index(files):
+    index = DocumentIndex()
+    for file in files:
+        try:
+            text = extract_text(file.name, file.getvalue())
+        except Exception as e:
+            print(f"⚠️ Could not read {file.name}: {e}")
+            index.failed.append(file.name)
+            continue
+        index.add_document(file.name, text, LLM_CONFIG['RAG_CHUNK_WORDS'], LLM_CONFIG['RAG_CHUNK_OVERLAP_WORDS'])
+    return index
+
+def session_document_index(state):
+    """The session's index over st.session_state.uploaded_files, rebuilt when they change"""
+    key = files_key(state.uploaded_files)
+    if state.get("document_index_key") != key:
+        state.document_index = build_document_index(state.uploaded_files)
+        state.document_index_key = key
+    return state.document_index
+
+def document_budget(model):
+    """Tokens of document excerpts to send with a question to this model"""
+    context = MODEL_CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT_TOKENS)
+    return min(LLM_CONFIG['RAG_MAX_TOKENS'], int(context * LLM_CONFIG['RAG_CONTEXT_SHARE']))
+
+def document_messages(index, question, model):
+    """The best chunks for a question that fit the budget, as one system message (or none)"""
+    budget = document_budget(model) - MESSAGE_OVERHEAD_TOKENS
+    excerpts = []
+    for name, number, text, _ in index.search(question, LLM_CONFIG['RAG_TOP_K']):
+        excerpt = f"[{name}, part {number + 1}]\n{text}"
+        tokens = count_tokens(excerpt, model)
+        if tokens > budget:
+            continue  # a shorter, lower-ranked chunk may still fit
+        budget -= tokens
+        excerpts.append(excerpt)
+    if not excerpts:
+        return []
+    return [("system", "Excerpts from the user's uploaded documents; use them when relevant:\n\n" + "\n\n".join(excerpts))]
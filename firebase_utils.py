@@ -1,17 +1,52 @@
 import firebase_admin
 from firebase_admin import credentials, firestore
-from google.api_core import exceptions as gcp_exceptions
 import os
 import json
-from datetime import datetime
+import threading
+import time
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Firebase with error handling
+from config import CACHE_CONFIG, STORAGE_CONFIG
+from cache_utils import TTLCache
+from sqlite_store import SQLiteStore
+from jsonl_store import JSONLStore
+from circuit_breaker import CircuitBreaker
+from storage_backends import (
+    FirestoreBackend, LocalBackend, InMemoryBackend, FailoverBackend, WriteJournal, profile_fields, history_to_turns,
+    MAIN_THREAD
+)
+from history_archive import read_archived_turns, schedule_archive, truncate_archive, forget_archive_state
+from search_index import index_turns, search_history
+
+# Firebase is initialized once per process, in the background at startup
 db = None
 firebase_initialized = False
+# Monotonic time before which initialize_firebase won't try again after a failure
+_firebase_retry_at = 0.0
+_firebase_lock = threading.Lock()
+_warmup_thread = None
+_readiness_probe = None
+_firebase_readiness = None
+_firebase_ready_event = threading.Event()
+
+# Storage backend, chosen once per process by get_storage_backend()
+_backend = None
+_backend_lock = threading.Lock()
+
+# Process-wide cache of user documents, revalidated against the document's update_time
+_user_cache = TTLCache(
+    max_entries=CACHE_CONFIG['USER_CACHE_MAX_ENTRIES'],
+    ttl=CACHE_CONFIG['USER_CACHE_TTL_SECONDS']
+)
+
+# Rolling summaries by (username, thread_id), wrapped as {"summary": ...} so a missing one is cached too
+_summary_cache = TTLCache(
+    max_entries=CACHE_CONFIG['USER_CACHE_MAX_ENTRIES'],
+    ttl=CACHE_CONFIG['USER_CACHE_TTL_SECONDS']
+)
 
 def get_firebase_credentials():
     """Get Firebase credentials from environment variables or JSON file"""
@@ -61,190 +96,352 @@ def get_firebase_credentials():
     return None
 
 def initialize_firebase():
-    global db, firebase_initialized
+    """Initialize the Firebase app once per process; safe to call from any thread.
+    
+    A failed attempt is retried after FIREBASE_INIT_RETRY_SECONDS, so a transient
+    error at startup doesn't leave Firestore off for the life of the process.
+    Missing credentials are not retried.
+    """
+    global db, firebase_initialized, _firebase_retry_at
     
     if firebase_initialized:
         return True
     
-    try:
-        # Get credentials from environment or file
-        cred_data = get_firebase_credentials()
+    with _firebase_lock:
+        if firebase_initialized or time.monotonic() < _firebase_retry_at:
+            return firebase_initialized
+        _firebase_retry_at = float("inf")
         
-        if cred_data:
-            print(f"🔧 Initializing Firebase with project: {cred_data.get('project_id', 'Unknown')}")
-            
-            # Create temporary file for credentials
-            import tempfile
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as temp_file:
-                json.dump(cred_data, temp_file)
-                temp_file_path = temp_file.name
+        try:
+            # Get credentials from environment or file
+            cred_data = get_firebase_credentials()
             
-            try:
-                cred = credentials.Certificate(temp_file_path)
+            if cred_data:
+                print(f"🔧 Initializing Firebase with project: {cred_data.get('project_id', 'Unknown')}")
+                # Certificate accepts the parsed service-account dict, so no key file is written
+                cred = credentials.Certificate(cred_data)
                 if not firebase_admin._apps:
                     firebase_admin.initialize_app(cred)
                 db = firestore.client()
                 firebase_initialized = True
                 print("✅ Firebase initialized successfully")
-                
-                # Test the connection
-                try:
-                    # Try to read from Firestore to test connection
-                    test_doc = db.collection("test").document("connection_test").get()
-                    print("✅ Firebase connection test successful")
-                except Exception as test_e:
-                    print(f"⚠️ Firebase connection test failed: {test_e}")
-                
-                return True
-            finally:
-                # Clean up temporary file
-                try:
-                    os.unlink(temp_file_path)
-                except:
-                    pass
-        else:
-            print("⚠️ Firebase credentials not found. Using local file storage.")
-            return False
-    except Exception as e:
-        print(f"❌ Firebase initialization failed: {e}. Using local file storage.")
-        import traceback
-        print(f"Full error: {traceback.format_exc()}")
-        return False
+            else:
+                print("⚠️ Firebase credentials not found. Using local file storage.")
+        except Exception as e:
+            print(f"❌ Firebase initialization failed: {e}. Using local file storage.")
+            _firebase_retry_at = time.monotonic() + STORAGE_CONFIG['FIREBASE_INIT_RETRY_SECONDS']
+    
+    if firebase_initialized:
+        _start_readiness_probe()
+    else:
+        _set_readiness(False, "Firebase is not initialized")
+    return firebase_initialized
+
+def _set_readiness(ready, message):
+    global _firebase_readiness
+    _firebase_readiness = (ready, message)
+    _firebase_ready_event.set()
+
+def _start_readiness_probe():
+    """Test the Firestore connection on a background thread"""
+    global _readiness_probe
+    with _firebase_lock:
+        if _readiness_probe is not None:
+            return
+        # Drops the "not initialized" result of an earlier failed attempt
+        _firebase_ready_event.clear()
+        _readiness_probe = threading.Thread(target=_probe_firestore, name="firebase-readiness", daemon=True)
+        _readiness_probe.start()
+
+def _probe_firestore():
+    try:
+        db.collection("test").document("connection_test").get(timeout=STORAGE_CONFIG['FIRESTORE_TIMEOUT'])
+        print("✅ Firebase connection test successful")
+        _set_readiness(True, "Firebase connection successful")
+    except Exception as e:
+        print(f"⚠️ Firebase connection test failed: {e}")
+        _set_readiness(False, f"Firebase connection test failed: {e}")
+
+def firebase_readiness(timeout=0):
+    """(ready, message) from the readiness probe; ready is None while it is still running"""
+    if not _firebase_ready_event.wait(timeout):
+        return None, "Firebase connection test still running"
+    return _firebase_readiness
+
+def start_firebase_warmup():
+    """Initialize Firebase and the storage backend in the background; cheap to call on every rerun"""
+    global _warmup_thread
+    if _warmup_thread is not None:
+        return
+    with _firebase_lock:
+        if _warmup_thread is None:
+            _warmup_thread = threading.Thread(target=get_storage_backend, name="firebase-warmup", daemon=True)
+            _warmup_thread.start()
+
+def _create_local_store():
+    """SQLite or JSONL store backing the local backend"""
+    if STORAGE_CONFIG['LOCAL_STORE'] == 'jsonl':
+        return JSONLStore(
+            STORAGE_CONFIG['LOCAL_JSONL_DIR'],
+            segment_max_bytes=STORAGE_CONFIG['JSONL_SEGMENT_MAX_BYTES'],
+            compact_interval=STORAGE_CONFIG['JSONL_COMPACT_INTERVAL']
+        )
+    return SQLiteStore(STORAGE_CONFIG['LOCAL_DB_PATH'])
+
+def _create_backend(kind):
+    page_size = STORAGE_CONFIG['HISTORY_PAGE_SIZE']
+    if kind == 'memory':
+        return InMemoryBackend(page_size)
+    if kind in ('auto', 'firestore'):
+        if initialize_firebase():
+            # Firestore outages fail over to local storage and are replayed on recovery
+            return FailoverBackend(
+                FirestoreBackend(db, _user_cache, page_size, timeout=STORAGE_CONFIG['FIRESTORE_TIMEOUT']),
+                LocalBackend(_create_local_store(), page_size),
+                CircuitBreaker(
+                    failure_threshold=STORAGE_CONFIG['CIRCUIT_BREAKER_FAILURE_THRESHOLD'],
+                    reset_timeout=STORAGE_CONFIG['CIRCUIT_BREAKER_RESET_TIMEOUT']
+                ),
+                WriteJournal(STORAGE_CONFIG['RECONCILE_JOURNAL_PATH'])
+            )
+        if kind == 'firestore':
+            print("⚠️ STORAGE_BACKEND=firestore but Firebase is unavailable. Using local file storage.")
+    elif kind != 'local':
+        print(f"⚠️ Unknown STORAGE_BACKEND '{kind}'. Using local file storage.")
+    return LocalBackend(_create_local_store(), page_size)
+
+def get_storage_backend():
+    """Process-wide storage backend, selected once from STORAGE_BACKEND"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _create_backend(STORAGE_CONFIG['BACKEND'])
+                print(f"🗄️ Using {_backend.name} storage backend")
+    return _backend
+
+def set_storage_backend(backend):
+    """Replace the process-wide backend (tests, benchmarks); returns the previous one"""
+    global _backend
+    with _backend_lock:
+        previous, _backend = _backend, backend
+    return previous
 
 def store_user_data(username, data):
-    if not initialize_firebase():
-        print(f"⚠️ Firebase not initialized, using local storage for user: {username}")
-        return store_user_data_local(username, data)
-    
+    """Create or replace a user's profile, plus their history if data carries one"""
     try:
-        print(f"💾 Storing user data for: {username}")
-        db.collection("users").document(username).set(data)
-        print(f"✅ User data stored successfully for: {username}")
+        backend = get_storage_backend()
+        # Conversation turns are stored per message, not in the profile
+        backend.put_user(username, profile_fields(data))
+        if data.get("chat_history"):
+            _replace_history(backend, username, data["chat_history"], data.get("chat_timestamps"))
+        print(f"✅ User data stored for: {username}")
         return True
-    except gcp_exceptions.NotFound as e:
-        print(f"❌ Firestore database not found. Using local file storage: {e}")
-        return store_user_data_local(username, data)
     except Exception as e:
-        print(f"❌ Error storing user data for {username}: {e}. Using local file storage.")
-        import traceback
-        print(f"Full error: {traceback.format_exc()}")
-        return store_user_data_local(username, data)
+        print(f"❌ Error storing user data for {username}: {e}")
+        return False
 
 def get_user_data(username):
-    if not initialize_firebase():
-        print(f"⚠️ Firebase not initialized, using local storage for user: {username}")
-        return get_user_data_local(username)
+    """Return the user's profile with its stored message_count, or None.
     
+    Chat turns are not included; use get_chat_page to load them a page at a time.
+    """
     try:
-        print(f"🔍 Getting user data for: {username}")
-        doc = db.collection("users").document(username).get()
-        if doc.exists:
-            data = doc.to_dict()
-            print(f"✅ User data found for: {username}")
-            
-            # Convert Firebase chat history format back to tuple format
-            if "chat_history" in data and isinstance(data["chat_history"], list):
-                firebase_chat_history = data["chat_history"]
-                # Convert back to tuple format for compatibility
-                converted_chat_history = []
-                for msg in firebase_chat_history:
-                    if isinstance(msg, dict) and "user_message" in msg and "bot_reply" in msg:
-                        converted_chat_history.append((msg["user_message"], msg["bot_reply"]))
-                    elif isinstance(msg, (list, tuple)) and len(msg) == 2:
-                        # Handle old format (tuples)
-                        converted_chat_history.append(tuple(msg))
-                
-                data["chat_history"] = converted_chat_history
-            
-            return data
-        else:
-            print(f"ℹ️ No user data found for: {username}")
-            return None
-    except gcp_exceptions.NotFound as e:
-        print(f"❌ Firestore database not found. Using local file storage: {e}")
-        return get_user_data_local(username)
-    except Exception as e:
-        print(f"❌ Error getting user data for {username}: {e}. Using local file storage.")
-        import traceback
-        print(f"Full error: {traceback.format_exc()}")
-        return get_user_data_local(username)
-
-def save_chat_history(username, chat_history):
-    if not initialize_firebase():
-        return save_chat_history_local(username, chat_history)
+        return get_storage_backend().get_user(username)
+    except Exception as e:
+        print(f"❌ Error getting user data for {username}: {e}")
+        return None
+
+def get_user_fields(username, fields, raise_errors=False):
+    """Return only the named profile fields (e.g. ["password"]), or None if the user does not exist.
     
+    Use this on login/signup paths that don't need the rest of the profile.
+    A storage error returns None unless raise_errors is set, for callers that must
+    not mistake an error for a missing user.
+    """
     try:
-        # Convert chat history to Firebase-compatible format
-        # Firebase doesn't support nested arrays, so we convert to a list of objects
-        firebase_chat_history = []
-        for i, (user_msg, bot_reply) in enumerate(chat_history):
-            firebase_chat_history.append({
-                "message_id": i,
-                "user_message": user_msg,
-                "bot_reply": bot_reply,
-                "timestamp": datetime.now().isoformat()
-            })
-        
-        # Use set with merge=True to create document if it doesn't exist
-        db.collection("users").document(username).set({
-            "chat_history": firebase_chat_history,
-            "last_updated": datetime.now().isoformat()
-        }, merge=True)
-        print(f"Chat history saved for user: {username}")
+        return get_storage_backend().get_user_fields(username, fields)
+    except Exception as e:
+        print(f"❌ Error getting user data for {username}: {e}")
+        if raise_errors:
+            raise
+        return None
+
+def update_user_data(username, fields):
+    """Merge fields into an existing profile without rewriting the rest of it"""
+    try:
+        get_storage_backend().update_user(username, fields)
         return True
-    except gcp_exceptions.NotFound as e:
-        print(f"Firestore database not found. Using local file storage: {e}")
-        return save_chat_history_local(username, chat_history)
     except Exception as e:
-        print(f"Error saving chat history: {e}. Using local file storage.")
-        return save_chat_history_local(username, chat_history)
+        print(f"❌ Error updating user data for {username}: {e}")
+        return False
 
-# Local file storage functions
-def store_user_data_local(username, data):
+def list_users(after=None, limit=500):
+    """One page of usernames, sorted, starting after `after`"""
     try:
-        # Create data directory if it doesn't exist
-        os.makedirs("user_data", exist_ok=True)
-        
-        # Save user data to local file
-        file_path = f"user_data/{username}.json"
-        with open(file_path, 'w') as f:
-            json.dump(data, f, indent=2)
-        
-        print(f"✅ User data saved locally for: {username}")
+        return get_storage_backend().list_users(after, limit)
+    except Exception as e:
+        print(f"❌ Error listing users: {e}")
+        return []
+
+def read_chat_page(backend, username, before=None, limit=None, thread_id=None):
+    """get_chat_page against a given backend, raising on storage errors"""
+    limit = limit or STORAGE_CONFIG['HISTORY_PAGE_SIZE']
+    turns = backend.get_page(username, before, limit, thread_id)
+    boundary = turns[0]["message_id"] if turns else before
+    if STORAGE_CONFIG['ARCHIVE_ENABLED'] and len(turns) < limit and boundary:
+        turns = read_archived_turns(backend, username, thread_id, boundary, limit - len(turns)) + turns
+    return turns
+
+def get_chat_page(username, before=None, limit=None, thread_id=None, raise_errors=False):
+    """Return up to `limit` turns older than message_id `before` (newest page when None).
+    
+    Turns are dicts with message_id, user_message, bot_reply and timestamp, oldest first.
+    thread_id None (or "main") is the user's main conversation. Pages that reach
+    past the hot turns are completed from the compressed archive.
+    A storage error returns [] unless raise_errors is set, for callers that must
+    not mistake an error for the start of the history.
+    """
+    try:
+        return read_chat_page(get_storage_backend(), username, before, limit, thread_id)
+    except Exception as e:
+        print(f"❌ Error getting chat history for {username}: {e}")
+        if raise_errors:
+            raise
+        return []
+
+def save_chat_turns(username, turns, message_count, previous_count=0, thread_id=None):
+    """Persist only the given turns and trim stored turns beyond message_count.
+    
+    Each turn is a dict with message_id, user_message, bot_reply and timestamp.
+    The thread's entry in the thread index is updated in the same write.
+    """
+    try:
+        write_chat_turns(get_storage_backend(), username, turns, message_count, previous_count, thread_id)
+        print(f"Saved {len(turns)} chat turn(s) for user: {username}")
         return True
     except Exception as e:
-        print(f"❌ Error saving user data locally: {e}")
+        print(f"❌ Error saving chat turns for {username}: {e}")
         return False
 
-def get_user_data_local(username):
+def write_chat_turns(backend, username, turns, message_count, previous_count=0, thread_id=None):
+    """save_chat_turns against a given backend; raises on error"""
+    backend.save_turns(username, turns, message_count, previous_count, thread_id)
+    _update_search_index(backend, username, thread_id, turns, message_count, previous_count)
+    if message_count < previous_count:
+        # Summarized turns may have been cut or rewritten
+        _drop_summary(backend, username, thread_id)
+    if STORAGE_CONFIG['ARCHIVE_ENABLED']:
+        if message_count < previous_count:
+            truncate_archive(backend, username, thread_id, message_count, [t["message_id"] for t in turns])
+        _schedule_archive(backend, username, thread_id, message_count)
+
+def forget_chat_thread(username, thread_id):
+    """Drop what this process remembers about a thread deleted from storage"""
+    _summary_cache.invalidate((username, thread_id or MAIN_THREAD))
+    forget_archive_state(username, thread_id)
+
+def _update_search_index(backend, username, thread_id, turns, message_count, previous_count):
+    """Index saved turns; a failure here never fails the save itself"""
+    if not STORAGE_CONFIG['SEARCH_ENABLED']:
+        return
     try:
-        file_path = f"user_data/{username}.json"
-        if os.path.exists(file_path):
-            with open(file_path, 'r') as f:
-                data = json.load(f)
-            return data
-        return None
+        index_turns(backend, username, thread_id, turns, message_count, previous_count)
+    except Exception as e:
+        print(f"⚠️ Could not update search index for {username}: {e}")
+
+def _schedule_archive(backend, username, thread_id, message_count):
+    schedule_archive(
+        backend, username, thread_id, message_count,
+        STORAGE_CONFIG['ARCHIVE_HOT_WINDOW'],
+        STORAGE_CONFIG['ARCHIVE_SEGMENT_TURNS'],
+        STORAGE_CONFIG['ARCHIVE_ZSTD_LEVEL']
+    )
+
+def save_chat_history(username, chat_history, timestamps=None):
+    """Replace a user's whole conversation with a list of (user, bot) tuples"""
+    try:
+        _replace_history(get_storage_backend(), username, chat_history, timestamps)
+        return True
+    except Exception as e:
+        print(f"❌ Error saving chat history for {username}: {e}")
+        return False
+
+def _replace_history(backend, username, chat_history, timestamps=None):
+    backend.replace_history(username, chat_history, timestamps)
+    turns = history_to_turns(chat_history, timestamps)
+    _update_search_index(backend, username, None, turns, len(turns), len(turns))
+    _drop_summary(backend, username, None)
+    if STORAGE_CONFIG['ARCHIVE_ENABLED']:
+        # Every turn was rewritten into hot storage, so existing segments are stale
+        truncate_archive(backend, username, None, 0)
+        _schedule_archive(backend, username, None, len(chat_history))
+
+def get_chat_summary(username, thread_id=None, refresh=False):
+    """Rolling summary of a thread's older turns ({text, until, model, updated_at}), or None.
+    
+    refresh=True skips the cache, e.g. to see a summary another process saved.
+    """
+    key = (username, thread_id or MAIN_THREAD)
+    cached, fresh = _summary_cache.lookup(key)
+    if cached is not None and fresh and not refresh:
+        return cached["summary"]
+    try:
+        summary = get_storage_backend().get_summary(username, thread_id)
     except Exception as e:
-        print(f"❌ Error loading user data locally: {e}")
+        print(f"❌ Error getting chat summary for {username}: {e}")
         return None
+    _summary_cache.put(key, {"summary": summary})
+    return summary
 
-def save_chat_history_local(username, chat_history):
+def save_chat_summary(username, thread_id, summary):
+    """Store a thread's rolling summary next to its history"""
     try:
-        # Create data directory if it doesn't exist
-        os.makedirs("user_data", exist_ok=True)
-        
-        # Load existing user data or create new
-        user_data = get_user_data_local(username) or {}
-        user_data["chat_history"] = chat_history
-        user_data["last_updated"] = datetime.now().isoformat()
-        
-        # Save updated data
-        file_path = f"user_data/{username}.json"
-        with open(file_path, 'w') as f:
-            json.dump(user_data, f, indent=2)
-        
-        print(f"✅ Chat history saved locally for: {username}")
+        get_storage_backend().put_summary(username, thread_id, summary)
+        _summary_cache.put((username, thread_id or MAIN_THREAD), {"summary": summary})
         return True
     except Exception as e:
-        print(f"❌ Error saving chat history locally: {e}")
-        return False
\ No newline at end of file
+        print(f"❌ Error saving chat summary for {username}: {e}")
+        return False
+
+def _drop_summary(backend, username, thread_id):
+    backend.put_summary(username, thread_id, None)
+    _summary_cache.put((username, thread_id or MAIN_THREAD), {"summary": None})
+
+def search_chat_history(username, query, limit=None):
+    """Rank a user's turns in all threads against a query using the search index.
+    
+    Results have thread_id, message_id, score and a preview of the turn, best first.
+    """
+    try:
+        backend = get_storage_backend()
+        total_turns = sum(entry.get("message_count", 0) for entry in backend.list_threads(username).values())
+        return search_history(backend, username, query, total_turns, limit or STORAGE_CONFIG['SEARCH_MAX_RESULTS'])
+    except Exception as e:
+        print(f"❌ Error searching chat history for {username}: {e}")
+        return []
+
+def list_threads(username):
+    """Return the user's conversation threads from the thread index, most recent first.
+    
+    Each entry has thread_id, title, model, message_count and last_updated; no turns are read.
+    """
+    try:
+        threads = get_storage_backend().list_threads(username)
+    except Exception as e:
+        print(f"❌ Error listing threads for {username}: {e}")
+        return []
+    return sorted(
+        ({"thread_id": thread_id, **entry} for thread_id, entry in threads.items()),
+        key=lambda thread: thread.get("last_updated") or thread.get("created_at") or "",
+        reverse=True
+    )
+
+def update_thread(username, thread_id, fields):
+    """Create a thread index entry or update its title/model"""
+    try:
+        get_storage_backend().put_thread(username, thread_id, fields)
+        return True
+    except Exception as e:
+        print(f"❌ Error updating thread {thread_id} for {username}: {e}")
+        return False
@@ -12,11 +12,11 @@ from datetime import datetime
 def check_firebase_connection():
     """Check Firebase connection"""
     try:
-        from firebase_utils import initialize_firebase
-        if initialize_firebase():
-            return True, "Firebase connection successful"
-        else:
+        from firebase_utils import initialize_firebase, firebase_readiness
+        if not initialize_firebase():
             return False, "Firebase connection failed"
+        ready, message = firebase_readiness(timeout=15)
+        return bool(ready), message
     except Exception as e:
         return False, f"Firebase error: {str(e)}"
 
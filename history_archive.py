@@ -0,0 +1,185 @@
+# Cold-segment archival for long chat histories
+# Turns older than a hot window are packed into segments of up to a fixed number
+# of turns (fewer when that would exceed a compressed size limit), stored as
+# zstandard-compressed blobs and listed in a small per-thread manifest of
+# {id, start, end, turns, bytes, archived_at}. Hot storage then only holds the
+# newest turns, so everyday reads and writes stay bounded however long the
+# history grows. A segment is decompressed only when someone pages back into
+# it (or exports), and recently decoded segments are kept in an LRU.
+
+import threading
+import time
+import uuid
+from datetime import datetime
+import orjson
+import zstandard
+from config import STORAGE_CONFIG
+from cache_utils import TTLCache
+from storage_backends import MAIN_THREAD
+
+# Decoded segments are immutable (a rewrite gets a new id), so they never go stale
+_segment_cache = TTLCache(max_entries=STORAGE_CONFIG['ARCHIVE_CACHE_SEGMENTS'], ttl=float("inf"))
+
+# Per-thread archive boundary seen by the last job, so most saves skip archival
+# without a manifest read; one lock per thread keeps archival and truncation apart.
+# A job that fails or gets stuck is not restarted before its retry time.
+_known_archived_until = {}
+_retry_at = {}
+_thread_locks = {}
+_jobs_lock = threading.Lock()
+
+def _thread_lock(username, thread_id):
+    with _jobs_lock:
+        return _thread_locks.setdefault((username, thread_id or MAIN_THREAD), threading.Lock())
+
+def encode_segment(turns, level=10):
+    """Compress a list of turn dicts into one blob (one JSON line per turn)"""
+    payload = b"".join(orjson.dumps(turn) + b"\n" for turn in turns)
+    return zstandard.ZstdCompressor(level=level).compress(payload)
+
+def decode_segment(blob):
+    payload = zstandard.ZstdDecompressor().decompress(blob)
+    return [orjson.loads(line) for line in payload.splitlines() if line]
+
+def archived_until(manifest):
+    """First message id still in hot storage"""
+    return manifest[-1]["end"] if manifest else 0
+
+def _load_segment(backend, username, thread_id, segment):
+    key = (username, thread_id or MAIN_THREAD, segment["id"])
+    turns, _ = _segment_cache.lookup(key)
+    if turns is None:
+        blob = backend.get_archive_segment(username, thread_id, segment["start"])
+        turns = decode_segment(blob) if blob else []
+        _segment_cache.put(key, turns)
+    return turns
+
+def read_archived_turns(backend, username, thread_id, before, limit):
+    """Newest `limit` archived turns with message_id < before, oldest first"""
+    manifest = backend.get_archive_manifest(username, thread_id)
+    low = max(0, before - limit)
+    turns = []
+    for segment in manifest:
+        if segment["end"] <= low or segment["start"] >= before:
+            continue
+        turns.extend(
+            dict(turn) for turn in _load_segment(backend, username, thread_id, segment)
+            if low <= turn["message_id"] < before
+        )
+    return sorted(turns, key=lambda turn: turn["message_id"])
+
+def archive_cold_turns(backend, username, thread_id, message_count, hot_window, segment_turns, level=10, max_bytes=None):
+    """Move segments older than the hot window into the archive; returns the new boundary.
+
+    A segment holds segment_turns turns, or fewer if its blob would be larger than
+    max_bytes (ARCHIVE_SEGMENT_MAX_BYTES), which keeps it under Firestore's 1 MiB
+    document limit. A turn too large to archive on its own stops archival there.
+    """
+    max_bytes = max_bytes or STORAGE_CONFIG['ARCHIVE_SEGMENT_MAX_BYTES']
+    boundary = archived_until(backend.get_archive_manifest(username, thread_id))
+    while message_count - boundary >= hot_window + segment_turns:
+        start, end = boundary, boundary + segment_turns
+        turns = backend.get_page(username, before=end, limit=segment_turns, thread_id=thread_id)
+        if [turn["message_id"] for turn in turns] != list(range(start, end)):
+            print(f"⚠️ Skipping archival for {username}: turns {start}-{end - 1} are incomplete")
+            break
+        blob = encode_segment(turns, level)
+        while len(blob) > max_bytes and len(turns) > 1:
+            turns = turns[:len(turns) // 2]
+            blob = encode_segment(turns, level)
+        if len(blob) > max_bytes:
+            print(f"⚠️ Skipping archival for {username}: turn {start} is {len(blob)} bytes compressed")
+            break
+        end = start + len(turns)
+        backend.put_archive_segment(username, thread_id, {
+            "id": uuid.uuid4().hex,
+            "start": start,
+            "end": end,
+            "turns": len(turns),
+            "bytes": len(blob),
+            "archived_at": datetime.now().isoformat()
+        }, blob)
+        boundary = end
+        print(f"🧊 Archived turns {start}-{end - 1} for {username} ({len(blob)} bytes)")
+    return boundary
+
+def schedule_archive(backend, username, thread_id, message_count, hot_window, segment_turns, level=10):
+    """Archive in the background when a thread has outgrown its hot window"""
+    if message_count < hot_window + segment_turns:
+        return False
+    key = (username, thread_id or MAIN_THREAD)
+    with _jobs_lock:
+        known = _known_archived_until.get(key)
+        retry_at = _retry_at.get(key, 0)
+    if known is not None and message_count - known < hot_window + segment_turns:
+        return False
+    if time.monotonic() < retry_at:
+        return False
+    lock = _thread_lock(username, thread_id)
+    if not lock.acquire(blocking=False):
+        return False  # a job for this thread is already running
+
+    def run():
+        boundary = None
+        try:
+            boundary = archive_cold_turns(backend, username, thread_id, message_count, hot_window, segment_turns, level)
+            with _jobs_lock:
+                _known_archived_until[key] = boundary
+        except Exception as e:
+            print(f"⚠️ Archival failed for {username}: {e}")
+        finally:
+            if boundary is None or message_count - boundary >= hot_window + segment_turns:
+                # Failed or stuck short of the hot window; the next saves would hit the same wall
+                with _jobs_lock:
+                    _retry_at[key] = time.monotonic() + STORAGE_CONFIG['ARCHIVE_RETRY_SECONDS']
+            lock.release()
+
+    threading.Thread(target=run, name="history-archive", daemon=True).start()
+    return True
+
+def archive_now(backend, username, thread_id, message_count, hot_window, segment_turns, level=10):
+    """Archive in the calling thread, e.g. from a CLI that exits when it is done"""
+    if message_count < hot_window + segment_turns:
+        return None
+    with _thread_lock(username, thread_id):
+        boundary = archive_cold_turns(backend, username, thread_id, message_count, hot_window, segment_turns, level)
+    with _jobs_lock:
+        _known_archived_until[(username, thread_id or MAIN_THREAD)] = boundary
+    return boundary
+
+def forget_archive_state(username, thread_id):
+    """Drop the remembered boundary, e.g. after a truncation removed segments"""
+    with _jobs_lock:
+        _known_archived_until.pop((username, thread_id or MAIN_THREAD), None)
+        _retry_at.pop((username, thread_id or MAIN_THREAD), None)
+
+def truncate_archive(backend, username, thread_id, message_count, rewritten_ids=()):
+    """Remove archived turns with message_id >= message_count (e.g. after Clear Chat).
+
+    A segment that straddles the new end has its surviving turns moved back
+    into hot storage before it is deleted, except those just rewritten.
+    """
+    rewritten_ids = set(rewritten_ids)
+    with _thread_lock(username, thread_id):
+        for segment in reversed(backend.get_archive_manifest(username, thread_id)):
+            if segment["end"] <= message_count:
+                break
+            if segment["start"] < message_count:
+                survivors = [
+                    turn for turn in _load_segment(backend, username, thread_id, segment)
+                    if turn["message_id"] < message_count and turn["message_id"] not in rewritten_ids
+                ]
+                backend.save_turns(username, survivors, message_count, message_count, thread_id)
+            backend.delete_archive_segment(username, thread_id, segment["start"])
+        forget_archive_state(username, thread_id)
+
+def drop_archived_segments(backend, username, thread_id, before):
+    """Delete whole archived segments that end at or before message id `before`; returns them"""
+    dropped = []
+    with _thread_lock(username, thread_id):
+        for segment in backend.get_archive_manifest(username, thread_id):
+            if segment["end"] > before:
+                break
+            backend.delete_archive_segment(username, thread_id, segment["start"])
+            dropped.append(segment)
+    return dropped
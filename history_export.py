@@ -0,0 +1,93 @@
+# Chat history export
+# Exports are built only when the user asks for one. Turns are read from
+# storage a chunk at a time (archived segments included) and written straight
+# into a spooled temporary file, so the full history is never held as Python
+# objects. Formats: NDJSON, a JSON array, Parquet (via pyarrow) and plain text.
+
+import tempfile
+import orjson
+import pyarrow as pa
+import pyarrow.parquet as pq
+from firebase_utils import get_storage_backend, read_chat_page
+
+# format: (label, mime type, file extension)
+EXPORT_FORMATS = {
+    "ndjson": ("NDJSON", "application/x-ndjson", "ndjson"),
+    "json": ("JSON", "application/json", "json"),
+    "parquet": ("Parquet", "application/vnd.apache.parquet", "parquet"),
+    "text": ("Text", "text/plain", "txt"),
+}
+
+TURN_FIELDS = ("message_id", "user_message", "bot_reply", "timestamp")
+
+PARQUET_SCHEMA = pa.schema([
+    ("message_id", pa.int64()),
+    ("user_message", pa.string()),
+    ("bot_reply", pa.string()),
+    ("timestamp", pa.string()),
+])
+
+# Exports larger than this spill from memory to a temporary file on disk
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+def iter_history_pages(username, thread_id, message_count, chunk_turns=500):
+    """Yield a thread's stored turns oldest first, chunk_turns at a time.
+
+    A storage error is raised, not skipped, so an export is never silently incomplete.
+    """
+    backend = get_storage_backend()
+    for start in range(0, message_count, chunk_turns):
+        end = min(start + chunk_turns, message_count)
+        turns = read_chat_page(backend, username, before=end, limit=end - start, thread_id=thread_id)
+        if turns:
+            yield turns
+
+def _turn_record(turn):
+    return {field: turn.get(field) for field in TURN_FIELDS}
+
+def _write_ndjson(pages, out):
+    for turns in pages:
+        out.write(b"".join(orjson.dumps(_turn_record(turn)) + b"\n" for turn in turns))
+
+def _write_json(pages, out):
+    out.write(b"[")
+    first = True
+    for turns in pages:
+        for turn in turns:
+            out.write((b"\n  " if first else b",\n  ") + orjson.dumps(_turn_record(turn)))
+            first = False
+    out.write(b"\n]\n" if not first else b"]\n")
+
+def _write_parquet(pages, out):
+    # One row group per chunk; the writer never sees more than one chunk at a time
+    with pq.ParquetWriter(out, PARQUET_SCHEMA, compression="zstd") as writer:
+        for turns in pages:
+            columns = {field: [turn.get(field) for turn in turns] for field in TURN_FIELDS}
+            writer.write_table(pa.Table.from_pydict(columns, schema=PARQUET_SCHEMA))
+
+def _write_text(pages, out):
+    first = True
+    for turns in pages:
+        for turn in turns:
+            out.write((b"" if first else b"\n\n") + f"User: {turn['user_message']}\nBot: {turn['bot_reply']}".encode())
+            first = False
+
+WRITERS = {
+    "ndjson": _write_ndjson,
+    "json": _write_json,
+    "parquet": _write_parquet,
+    "text": _write_text,
+}
+
+def write_export(fmt, pages, out):
+    """Write pages of turns to a binary file object in the given format"""
+    if fmt not in WRITERS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    WRITERS[fmt](pages, out)
+
+def export_history(fmt, pages):
+    """Build an export from pages of turns; returns a rewound binary file object"""
+    out = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    write_export(fmt, pages, out)
+    out.seek(0)
+    return out
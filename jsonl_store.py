@@ -0,0 +1,613 @@
+# Append-only JSONL store for the local-storage fallback
+# For deployments that prefer plain files over a database. Each user gets a
+# directory with a small header.json (the profile), one or more append-only
+# seg-NNNNNN.jsonl segments holding one line per turn, and an index.json that
+# records where every live turn sits. Saving a turn is a single append; the
+# index is only rewritten by the background compactor, which merges segments
+# into one and drops records superseded by later edits or truncations.
+# Extra conversation threads get the same layout under threads/<thread_id>/,
+# and threads.json is the user's thread index (title, model, turn count).
+# Cold turns moved out by history_archive sit under archive/<thread_id>/ as
+# one NNNNNNNN.zst blob per segment plus a manifest.json listing them; the
+# log records their removal from the hot turns with a "drop" record.
+# The full-text search index lives under search/: postings are spread over
+# SEARCH_BUCKETS files by term hash and forward entries over files of
+# SEARCH_DOCS_BLOCK turns, so an update rewrites only the files it touches.
+# summaries/<thread_id>.json holds each thread's rolling summary.
+
+import os
+import shutil
+import threading
+import time
+import urllib.parse
+import zlib
+from datetime import datetime
+import orjson
+from storage_backends import MAIN_THREAD, history_to_turns
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+SEGMENT_PREFIX = "seg-"
+SEGMENT_SUFFIX = ".jsonl"
+SEARCH_BUCKETS = 64
+SEARCH_DOCS_BLOCK = 256
+
+def _segment_name(number):
+    return f"{SEGMENT_PREFIX}{number:06d}{SEGMENT_SUFFIX}"
+
+def _segment_number(name):
+    return int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+
+def _write_atomic(path, payload):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class _UserLog:
+    """In-memory view of one user's segments, rebuilt from index.json plus a tail scan"""
+
+    def __init__(self):
+        self.segments = []
+        self.entries = {}
+        self.positions = {}
+        self.message_count = 0
+        self.last_updated = None
+        self.records = 0
+        self.highest_id = -1
+        self.index_mtime = None
+
+    def apply(self, segment, offset, record):
+        self.records += 1
+        if record.get("t") == "turn":
+            self.entries[record["id"]] = (segment, offset)
+            self.highest_id = max(self.highest_id, record["id"])
+        elif record.get("t") == "meta":
+            self.message_count = record["n"]
+            self.last_updated = record.get("ts", self.last_updated)
+            if self.highest_id >= self.message_count:
+                # Truncation (e.g. after Clear Chat) supersedes the tail
+                for message_id in [i for i in self.entries if i >= self.message_count]:
+                    del self.entries[message_id]
+                self.highest_id = self.message_count - 1
+        elif record.get("t") == "drop":
+            # Turns moved to the cold archive
+            for message_id in [i for i in self.entries if record["from"] <= i < record["to"]]:
+                del self.entries[message_id]
+
+    def garbage(self):
+        """Records on disk that no longer describe a live turn"""
+        return max(0, self.records - len(self.entries))
+
+class JSONLStore:
+    def __init__(self, root, segment_max_bytes=4 * 1024 * 1024, compact_interval=60):
+        self.root = root
+        self.segment_max_bytes = segment_max_bytes
+        self.compact_interval = compact_interval
+        self._logs = {}
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._dirty = set()
+        self._compactor = None
+
+    # --- paths and locking ---
+    def _user_dir(self, username):
+        return os.path.join(self.root, urllib.parse.quote(username, safe="@._-"))
+
+    def _log_dir(self, username, thread_id):
+        user_dir = self._user_dir(username)
+        if thread_id is None:
+            return user_dir
+        return os.path.join(user_dir, "threads", urllib.parse.quote(thread_id, safe="@._-"))
+
+    def _lock(self, username):
+        with self._locks_guard:
+            return self._locks.setdefault(username, threading.RLock())
+
+    def _file_lock(self, user_dir):
+        """Exclusive lock shared with other processes writing the same user"""
+        return _FileLock(os.path.join(user_dir, ".lock"))
+
+    # --- log state ---
+    def _list_segments(self, log_dir):
+        if not os.path.isdir(log_dir):
+            return []
+        names = [n for n in os.listdir(log_dir) if n.startswith(SEGMENT_PREFIX) and n.endswith(SEGMENT_SUFFIX)]
+        return sorted(names, key=_segment_number)
+
+    def _load_index(self, log_dir):
+        log = _UserLog()
+        index_path = os.path.join(log_dir, "index.json")
+        if os.path.exists(index_path):
+            with open(index_path, "rb") as f:
+                index = orjson.loads(f.read())
+            log.segments = index["segments"]
+            log.entries = {int(i): tuple(loc) for i, loc in index["entries"].items()}
+            log.positions = index["positions"]
+            log.message_count = index["message_count"]
+            log.last_updated = index.get("last_updated")
+            log.records = len(log.entries)
+            log.highest_id = max(log.entries, default=-1)
+            log.index_mtime = os.stat(index_path).st_mtime_ns
+        return log
+
+    def _refresh(self, username, thread_id=None):
+        """Bring the in-memory log up to date with what is on disk"""
+        log_dir = self._log_dir(username, thread_id)
+        log = self._logs.get((username, thread_id))
+        index_path = os.path.join(log_dir, "index.json")
+        index_mtime = os.stat(index_path).st_mtime_ns if os.path.exists(index_path) else None
+        if log is None or log.index_mtime != index_mtime:
+            # First access, or another process compacted this log
+            log = self._load_index(log_dir)
+            self._logs[(username, thread_id)] = log
+
+        for name in self._list_segments(log_dir):
+            if name not in log.segments:
+                log.segments.append(name)
+            self._scan(log_dir, log, name)
+        return log
+
+    def _scan(self, log_dir, log, segment):
+        path = os.path.join(log_dir, segment)
+        start = log.positions.get(segment, 0)
+        if os.path.getsize(path) <= start:
+            return
+        with open(path, "rb") as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # a write still in progress
+                log.apply(segment, offset, orjson.loads(line))
+                offset += len(line)
+        log.positions[segment] = offset
+
+    def _read_record(self, log_dir, segment, offset, handles):
+        f = handles.get(segment)
+        if f is None:
+            f = handles[segment] = open(os.path.join(log_dir, segment), "rb")
+        f.seek(offset)
+        return orjson.loads(f.readline())
+
+    # --- profile ---
+    def get_user(self, username):
+        user_dir = self._user_dir(username)
+        header_path = os.path.join(user_dir, "header.json")
+        if not os.path.exists(header_path):
+            return None
+        with open(header_path, "rb") as f:
+            data = orjson.loads(f.read())
+        with self._lock(username):
+            log = self._refresh(username)
+            data["message_count"] = log.message_count
+            if log.last_updated:
+                data["last_updated"] = log.last_updated
+        return data
+
+    def put_user(self, username, profile):
+        profile = {k: v for k, v in profile.items() if k not in ("message_count", "last_updated")}
+        user_dir = self._user_dir(username)
+        os.makedirs(user_dir, exist_ok=True)
+        with self._lock(username), self._file_lock(user_dir):
+            _write_atomic(os.path.join(user_dir, "header.json"), orjson.dumps(profile))
+
+    def list_users(self, after=None, limit=500):
+        if not os.path.isdir(self.root):
+            return []
+        usernames = sorted(
+            urllib.parse.unquote(name) for name in os.listdir(self.root)
+            if os.path.exists(os.path.join(self.root, name, "header.json"))
+        )
+        return [u for u in usernames if after is None or u > after][:limit]
+
+    # --- turns ---
+    def save_turns(self, username, turns, message_count, thread_id=None):
+        """Append the given turns plus a meta record carrying the new message_count"""
+        thread_id = None if thread_id == MAIN_THREAD else thread_id
+        now = datetime.now().isoformat()
+        user_dir = self._user_dir(username)
+        log_dir = self._log_dir(username, thread_id)
+        os.makedirs(log_dir, exist_ok=True)
+        lines = [
+            orjson.dumps({
+                "t": "turn",
+                "id": t["message_id"],
+                "u": t["user_message"],
+                "b": t["bot_reply"],
+                "ts": t.get("timestamp") or now
+            }) + b"\n"
+            for t in turns
+        ]
+        lines.append(orjson.dumps({"t": "meta", "n": message_count, "ts": now}) + b"\n")
+        payload = b"".join(lines)
+
+        with self._lock(username), self._file_lock(user_dir):
+            header_path = os.path.join(user_dir, "header.json")
+            if not os.path.exists(header_path):
+                _write_atomic(header_path, orjson.dumps({}))
+            log = self._refresh(username, thread_id)
+            segment = log.segments[-1] if log.segments else _segment_name(1)
+            path = os.path.join(log_dir, segment)
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if size >= self.segment_max_bytes:
+                segment = _segment_name(_segment_number(segment) + 1)
+                path = os.path.join(log_dir, segment)
+                size = 0
+
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            try:
+                os.write(fd, payload)
+            finally:
+                os.close(fd)
+
+            if segment not in log.segments:
+                log.segments.append(segment)
+            offset = size
+            for line in lines:
+                log.apply(segment, offset, orjson.loads(line))
+                offset += len(line)
+            log.positions[segment] = offset
+            self._update_thread_index(user_dir, thread_id or MAIN_THREAD, {
+                "message_count": message_count, "last_updated": now
+            })
+            self._dirty.add((username, thread_id))
+        self._ensure_compactor()
+
+    def replace_history(self, username, chat_history, timestamps=None):
+        turns = history_to_turns(chat_history, timestamps)
+        self.save_turns(username, turns, len(turns))
+
+    def get_page(self, username, before=None, limit=50, thread_id=None):
+        """Newest `limit` turns with message_id < before, oldest first"""
+        thread_id = None if thread_id == MAIN_THREAD else thread_id
+        log_dir = self._log_dir(username, thread_id)
+        with self._lock(username):
+            log = self._refresh(username, thread_id)
+            end = log.message_count if before is None else max(0, min(before, log.message_count))
+            ids = [i for i in range(max(0, end - limit), end) if i in log.entries]
+            handles = {}
+            try:
+                records = [self._read_record(log_dir, *log.entries[i], handles) for i in ids]
+            finally:
+                for f in handles.values():
+                    f.close()
+        return [
+            {"message_id": r["id"], "user_message": r["u"], "bot_reply": r["b"], "timestamp": r.get("ts")}
+            for r in records
+        ]
+
+    # --- thread index ---
+    def _read_thread_index(self, user_dir):
+        path = os.path.join(user_dir, "threads.json")
+        if not os.path.exists(path):
+            return {}
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+
+    def _update_thread_index(self, user_dir, thread_id, fields):
+        """Merge fields into one thread's entry; caller holds the user's locks"""
+        threads = self._read_thread_index(user_dir)
+        threads[thread_id] = {**threads.get(thread_id, {}), **fields}
+        _write_atomic(os.path.join(user_dir, "threads.json"), orjson.dumps(threads))
+
+    def list_threads(self, username):
+        """The user's thread index; the main thread is listed once it has turns"""
+        user_dir = self._user_dir(username)
+        with self._lock(username):
+            threads = self._read_thread_index(user_dir)
+            if MAIN_THREAD not in threads and os.path.isdir(user_dir):
+                log = self._refresh(username)
+                if log.message_count:
+                    threads[MAIN_THREAD] = {"message_count": log.message_count, "last_updated": log.last_updated}
+        return threads
+
+    def put_thread(self, username, thread_id, fields):
+        """Create a thread index entry or update its title/model"""
+        fields = {k: v for k, v in fields.items() if k in ("title", "model", "created_at")}
+        user_dir = self._user_dir(username)
+        os.makedirs(user_dir, exist_ok=True)
+        with self._lock(username), self._file_lock(user_dir):
+            self._update_thread_index(user_dir, thread_id, fields)
+
+    # --- cold archive ---
+    def _archive_dir(self, username, thread_id):
+        return os.path.join(self._user_dir(username), "archive", urllib.parse.quote(thread_id or MAIN_THREAD, safe="@._-"))
+
+    def _read_manifest(self, archive_dir):
+        path = os.path.join(archive_dir, "manifest.json")
+        if not os.path.exists(path):
+            return []
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+
+    def get_archive_manifest(self, username, thread_id=None):
+        with self._lock(username):
+            return self._read_manifest(self._archive_dir(username, thread_id))
+
+    def get_archive_segment(self, username, thread_id, start):
+        path = os.path.join(self._archive_dir(username, thread_id), f"{start:08d}.zst")
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def put_archive_segment(self, username, thread_id, segment, blob):
+        """Write the blob, list it in the manifest, then drop its turns from the log"""
+        thread_id = None if thread_id == MAIN_THREAD else thread_id
+        user_dir = self._user_dir(username)
+        archive_dir = self._archive_dir(username, thread_id)
+        log_dir = self._log_dir(username, thread_id)
+        os.makedirs(archive_dir, exist_ok=True)
+        line = orjson.dumps({"t": "drop", "from": segment["start"], "to": segment["end"]}) + b"\n"
+        with self._lock(username), self._file_lock(user_dir):
+            _write_atomic(os.path.join(archive_dir, f"{segment['start']:08d}.zst"), blob)
+            manifest = [s for s in self._read_manifest(archive_dir) if s["start"] != segment["start"]]
+            manifest = sorted(manifest + [segment], key=lambda s: s["start"])
+            _write_atomic(os.path.join(archive_dir, "manifest.json"), orjson.dumps(manifest))
+
+            log = self._refresh(username, thread_id)
+            segment_name = log.segments[-1] if log.segments else _segment_name(1)
+            path = os.path.join(log_dir, segment_name)
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+            if segment_name not in log.segments:
+                log.segments.append(segment_name)
+            log.apply(segment_name, size, orjson.loads(line))
+            log.positions[segment_name] = size + len(line)
+            self._dirty.add((username, thread_id))
+        self._ensure_compactor()
+
+    def delete_archive_segment(self, username, thread_id, start):
+        archive_dir = self._archive_dir(username, thread_id)
+        with self._lock(username), self._file_lock(self._user_dir(username)):
+            manifest = [s for s in self._read_manifest(archive_dir) if s["start"] != start]
+            _write_atomic(os.path.join(archive_dir, "manifest.json"), orjson.dumps(manifest))
+            try:
+                os.unlink(os.path.join(archive_dir, f"{start:08d}.zst"))
+            except FileNotFoundError:
+                pass
+
+    # --- search index ---
+    def _search_dir(self, username):
+        return os.path.join(self._user_dir(username), "search")
+
+    @staticmethod
+    def _postings_file(term):
+        return f"postings-{zlib.crc32(term.encode()) % SEARCH_BUCKETS:02d}.json"
+
+    @staticmethod
+    def _docs_file(thread_id, message_id):
+        return f"docs-{urllib.parse.quote(thread_id, safe='@._-')}-{message_id // SEARCH_DOCS_BLOCK:06d}.json"
+
+    def _read_json(self, path):
+        if not os.path.exists(path):
+            return {}
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+
+    def get_search_postings(self, username, terms):
+        search_dir = self._search_dir(username)
+        rows = []
+        files = {}
+        with self._lock(username):
+            for term in terms:
+                name = self._postings_file(term)
+                if name not in files:
+                    files[name] = self._read_json(os.path.join(search_dir, name))
+                for key, (tf, length) in files[name].get(term, {}).items():
+                    thread_id, message_id = key.rsplit(":", 1)
+                    rows.append([term, thread_id, int(message_id), tf, length])
+        return rows
+
+    def get_search_docs(self, username, thread_id, message_ids):
+        search_dir = self._search_dir(username)
+        entries = {}
+        files = {}
+        with self._lock(username):
+            for message_id in message_ids:
+                name = self._docs_file(thread_id, message_id)
+                if name not in files:
+                    files[name] = self._read_json(os.path.join(search_dir, name))
+                entry = files[name].get(str(message_id))
+                if entry is not None:
+                    entries[message_id] = entry
+        return entries
+
+    def update_search_index(self, username, thread_id, postings, docs):
+        search_dir = self._search_dir(username)
+        os.makedirs(search_dir, exist_ok=True)
+        with self._lock(username), self._file_lock(self._user_dir(username)):
+            files = {}
+            for term, message_id, tf, length in postings:
+                name = self._postings_file(term)
+                if name not in files:
+                    files[name] = self._read_json(os.path.join(search_dir, name))
+                term_postings = files[name].setdefault(term, {})
+                if tf:
+                    term_postings[f"{thread_id}:{message_id}"] = [tf, length]
+                else:
+                    term_postings.pop(f"{thread_id}:{message_id}", None)
+                    if not term_postings:
+                        del files[name][term]
+            for message_id, entry in docs:
+                name = self._docs_file(thread_id, message_id)
+                if name not in files:
+                    files[name] = self._read_json(os.path.join(search_dir, name))
+                if entry is None:
+                    files[name].pop(str(message_id), None)
+                else:
+                    files[name][str(message_id)] = entry
+            for name, data in files.items():
+                _write_atomic(os.path.join(search_dir, name), orjson.dumps(data))
+
+    # --- summaries ---
+    def _summary_path(self, username, thread_id):
+        return os.path.join(
+            self._user_dir(username), "summaries", f"{urllib.parse.quote(thread_id or MAIN_THREAD, safe='@._-')}.json"
+        )
+
+    def get_summary(self, username, thread_id=None):
+        path = self._summary_path(username, thread_id)
+        with self._lock(username):
+            if not os.path.exists(path):
+                return None
+            with open(path, "rb") as f:
+                return orjson.loads(f.read())
+
+    def put_summary(self, username, thread_id, summary):
+        path = self._summary_path(username, thread_id)
+        with self._lock(username):
+            if summary is None:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                return
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _write_atomic(path, orjson.dumps(summary))
+
+    # --- deletion ---
+    def delete_thread(self, username, thread_id):
+        """Remove a thread's log, archive and search entries, then its index entry"""
+        user_dir = self._user_dir(username)
+        search_dir = self._search_dir(username)
+        docs_prefix = f"docs-{urllib.parse.quote(thread_id, safe='@._-')}-"
+        with self._lock(username), self._file_lock(user_dir):
+            shutil.rmtree(self._log_dir(username, thread_id), ignore_errors=True)
+            shutil.rmtree(self._archive_dir(username, thread_id), ignore_errors=True)
+            try:
+                os.unlink(self._summary_path(username, thread_id))
+            except FileNotFoundError:
+                pass
+            self._logs.pop((username, thread_id), None)
+            self._dirty.discard((username, thread_id))
+            if os.path.isdir(search_dir):
+                for name in os.listdir(search_dir):
+                    path = os.path.join(search_dir, name)
+                    if name.startswith(docs_prefix):
+                        os.unlink(path)
+                    elif name.startswith("postings-") and name.endswith(".json"):
+                        data = self._read_json(path)
+                        for term in list(data):
+                            data[term] = {k: v for k, v in data[term].items() if k.rsplit(":", 1)[0] != thread_id}
+                            if not data[term]:
+                                del data[term]
+                        _write_atomic(path, orjson.dumps(data))
+            threads = self._read_thread_index(user_dir)
+            if threads.pop(thread_id, None) is not None:
+                _write_atomic(os.path.join(user_dir, "threads.json"), orjson.dumps(threads))
+
+    def delete_user(self, username):
+        """Remove the user's whole directory"""
+        user_dir = self._user_dir(username)
+        with self._lock(username):
+            if os.path.isdir(user_dir):
+                with self._file_lock(user_dir):
+                    # header.json goes first so list_users stops returning the user even if rmtree fails part-way
+                    try:
+                        os.unlink(os.path.join(user_dir, "header.json"))
+                    except FileNotFoundError:
+                        pass
+                    shutil.rmtree(user_dir, ignore_errors=True)
+            for key in [key for key in self._logs if key[0] == username]:
+                del self._logs[key]
+            with self._locks_guard:
+                self._dirty = {key for key in self._dirty if key[0] != username}
+
+    # --- compaction ---
+    def needs_compaction(self, log):
+        # Every save appends one meta record, so allow roughly one per live turn
+        return len(log.segments) > 1 or log.garbage() > len(log.entries) + 64
+
+    def compact(self, username, thread_id=None):
+        """Rewrite a log's live turns into one fresh segment and drop the old ones"""
+        user_dir = self._user_dir(username)
+        log_dir = self._log_dir(username, thread_id)
+        with self._lock(username), self._file_lock(user_dir):
+            log = self._refresh(username, thread_id)
+            if not log.segments or not self.needs_compaction(log):
+                return False
+
+            segment = _segment_name(_segment_number(log.segments[-1]) + 1)
+            handles = {}
+            try:
+                lines = [
+                    orjson.dumps(self._read_record(log_dir, *log.entries[i], handles)) + b"\n"
+                    for i in sorted(log.entries)
+                ]
+            finally:
+                for f in handles.values():
+                    f.close()
+            lines.append(orjson.dumps({"t": "meta", "n": log.message_count, "ts": log.last_updated}) + b"\n")
+
+            entries = {}
+            offset = 0
+            for i, line in zip(sorted(log.entries), lines):
+                entries[str(i)] = [segment, offset]
+                offset += len(line)
+            size = offset + len(lines[-1])
+
+            # New segment first, then the index that points at it, then the old segments
+            _write_atomic(os.path.join(log_dir, segment), b"".join(lines))
+            _write_atomic(os.path.join(log_dir, "index.json"), orjson.dumps({
+                "segments": [segment],
+                "entries": entries,
+                "positions": {segment: size},
+                "message_count": log.message_count,
+                "last_updated": log.last_updated
+            }))
+            for old in log.segments:
+                try:
+                    os.unlink(os.path.join(log_dir, old))
+                except FileNotFoundError:
+                    pass
+            self._logs.pop((username, thread_id), None)
+            return True
+
+    def _ensure_compactor(self):
+        if self._compactor is None or not self._compactor.is_alive():
+            with self._locks_guard:
+                if self._compactor is None or not self._compactor.is_alive():
+                    self._compactor = threading.Thread(target=self._compact_loop, name="jsonl-compactor", daemon=True)
+                    self._compactor.start()
+
+    def _compact_loop(self):
+        while True:
+            time.sleep(self.compact_interval)
+            with self._locks_guard:
+                logs, self._dirty = self._dirty, set()
+            for username, thread_id in logs:
+                if not os.path.isdir(self._log_dir(username, thread_id)):
+                    continue  # deleted since it was written
+                try:
+                    self.compact(username, thread_id)
+                except Exception as e:
+                    print(f"⚠️ Compaction failed for {username}: {e}")
+
+class _FileLock:
+    def __init__(self, path):
+        self.path = path
+        self._f = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._f = open(self.path, "a")
+            fcntl.flock(self._f.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._f is not None:
+            fcntl.flock(self._f.fileno(), fcntl.LOCK_UN)
+            self._f.close()
+            self._f = None
+        return False
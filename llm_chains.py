@@ -0,0 +1,75 @@
+# LLM clients and chains, pooled per process
+# Building a ChatOpenAI or ChatGoogleGenerativeAI creates a new HTTP client,
+# so every turn used to pay connection and TLS setup again. Clients are kept
+# per (provider, model, API key) and compiled chains per personality on top
+# of them, in LRU caches whose entries are dropped after an idle timeout.
+# API keys are only ever used as a cache key in hashed form.
+
+import hashlib
+import threading
+from langchain_openai import ChatOpenAI
+from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.output_parsers import StrOutputParser
+from config import CACHE_CONFIG
+from cache_utils import TTLCache
+
+PERSONALITIES = {
+    "helpful": "You are a helpful, knowledgeable assistant. Provide clear, accurate, and detailed responses.",
+    "creative": "You are a creative assistant with a flair for storytelling and imaginative solutions.",
+    "professional": "You are a professional business assistant. Provide concise, business-focused responses.",
+    "friendly": "You are a friendly, conversational assistant. Be warm, engaging, and personable.",
+    "technical": "You are a technical expert. Provide detailed, accurate technical information and solutions."
+}
+
+# The TTL is an idle timeout: every hit marks the entry fresh again
+_clients = TTLCache(max_entries=CACHE_CONFIG['LLM_POOL_MAX_ENTRIES'], ttl=CACHE_CONFIG['LLM_POOL_IDLE_SECONDS'])
+_chains = TTLCache(max_entries=CACHE_CONFIG['LLM_POOL_MAX_ENTRIES'], ttl=CACHE_CONFIG['LLM_POOL_IDLE_SECONDS'])
+_build_lock = threading.RLock()
+
+def get_prompt_template(personality="helpful"):
+    return ChatPromptTemplate.from_messages([
+        ("system", PERSONALITIES.get(personality, PERSONALITIES["helpful"])),
+        # Rolling summary of turns older than the history, from chat_summary
+        MessagesPlaceholder("summary", optional=True),
+        # Excerpts of uploaded documents picked for the question, from document_index
+        MessagesPlaceholder("documents", optional=True),
+        # Earlier turns of the conversation, trimmed to a token budget by chat_memory
+        MessagesPlaceholder("history", optional=True),
+        ("user", "{question}")
+    ])
+
+def _key_hash(api_key):
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+def _create_llm(provider, model, api_key):
+    if provider == "openai":
+        return ChatOpenAI(model=model, api_key=api_key)
+    if provider == "google":
+        return ChatGoogleGenerativeAI(model=model, google_api_key=api_key)
+    raise ValueError(f"Unknown LLM provider: {provider}")
+
+def _pooled(cache, key, build):
+    value, fresh = cache.lookup(key)
+    if value is not None and fresh:
+        cache.touch(key)
+        return value
+    with _build_lock:
+        # Another session may have built it while we waited
+        value, fresh = cache.lookup(key)
+        if value is None or not fresh:
+            value = build()
+            cache.put(key, value)
+        return value
+
+def get_llm(provider, model, api_key):
+    """Shared chat model client for a provider, model and API key"""
+    return _pooled(_clients, (provider, model, _key_hash(api_key)), lambda: _create_llm(provider, model, api_key))
+
+def get_chain(provider, model, api_key, personality="helpful"):
+    """Shared prompt | model | parser chain; safe to use from concurrent sessions"""
+    return _pooled(
+        _chains,
+        (provider, model, _key_hash(api_key), personality),
+        lambda: get_prompt_template(personality) | get_llm(provider, model, api_key) | StrOutputParser()
+    )
@@ -3,7 +3,7 @@ import requests
 import secrets
 import urllib.parse
 import time
-from firebase_utils import store_user_data, get_user_data
+from firebase_utils import store_user_data, get_user_fields, update_user_data
 
 # OAuth Configuration (These should be in environment variables or secrets.toml in production)
 GOOGLE_CLIENT_ID = "YOUR_GOOGLE_CLIENT_ID"
@@ -248,28 +248,27 @@ def authenticate_with_provider(provider, user_info):
         display_name = user_info.get("name", "Apple User")
     
     # Store or update user data
-    existing_user = get_user_data(username)
-    if existing_user:
-        user_data = existing_user
+    login_fields = {
+        "last_login": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "display_name": display_name,
+        "email": user_info.get("email", username)
+    }
+    if get_user_fields(username, []) is not None:
+        # Existing user: only touch the login fields
+        update_user_data(username, login_fields)
     else:
-        user_data = {
+        store_user_data(username, {
             "password": None,  # OAuth users don't have passwords
-            "chat_history": [],
             "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
             "provider": provider,
-            "oauth_user": True
-        }
-    
-    user_data["last_login"] = time.strftime("%Y-%m-%d %H:%M:%S")
-    user_data["display_name"] = display_name
-    user_data["email"] = user_info.get("email", username)
-    
-    store_user_data(username, user_data)
+            "oauth_user": True,
+            **login_fields
+        })
     
     # Set session state
     st.session_state.authenticated = True
     st.session_state.current_user = username
-    st.session_state.chat_history = user_data.get("chat_history", [])
+    st.session_state.chat_history = []  # newest page is loaded by chatbot_ui
     
     return username, display_name
 
@@ -301,34 +300,34 @@ def demo_oauth_login(provider):
     
     try:
         # Store user data
-        existing_user = get_user_data(username)
-        if existing_user:
-            user_data = existing_user
+        login_fields = {
+            "last_login": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "display_name": display_name,
+            "email": email
+        }
+        if get_user_fields(username, []) is not None:
+            stored = update_user_data(username, login_fields)
         else:
-            user_data = {
+            stored = store_user_data(username, {
                 "password": None,
-                "chat_history": [],
                 "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
                 "provider": provider,
-                "oauth_user": True
-            }
-        
-        user_data["last_login"] = time.strftime("%Y-%m-%d %H:%M:%S")
-        user_data["display_name"] = display_name
-        user_data["email"] = email
+                "oauth_user": True,
+                "demo_account": True,  # lets the retention job reclaim it
+                **login_fields
+            })
         
-        # Try to store user data
-        if not store_user_data(username, user_data):
+        if not stored:
             # If Firestore is not available, use session state only
             st.session_state.authenticated = True
             st.session_state.current_user = username
-            st.session_state.chat_history = user_data.get("chat_history", [])
+            st.session_state.chat_history = []  # newest page is loaded by chatbot_ui
             return True, "Logged in (session only - Firestore not configured)"
         
         # Set session state
         st.session_state.authenticated = True
         st.session_state.current_user = username
-        st.session_state.chat_history = user_data.get("chat_history", [])
+        st.session_state.chat_history = []  # newest page is loaded by chatbot_ui
         
         return True, "Success"
         
@@ -0,0 +1,146 @@
+# Exact-match cache of LLM replies
+# Keyed by a hash of the normalized question, model, personality and, when the
+# prompt carries earlier turns or a summary, a fingerprint of that context, so
+# a hit is only served where the model would have seen the same prompt.
+# An LRU in memory sits in front of a SQLite file that survives restarts and
+# is shared by the app's processes; disk hits are promoted into memory. Entries
+# expire RESPONSE_CACHE_TTL_SECONDS after they were stored, in both tiers.
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from config import CACHE_CONFIG
+from cache_utils import TTLCache
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    reply TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    used_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at);
+"""
+
+# Expired and least recently used disk rows are pruned every this many writes
+PRUNE_EVERY_PUTS = 100
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def normalize_question(question):
+    """Case, Unicode form, whitespace and trailing punctuation do not change the answer"""
+    text = unicodedata.normalize("NFKC", question).casefold()
+    return re.sub(r"\s+", " ", text).strip().rstrip("?!. ")
+
+def context_fingerprint(*message_lists):
+    """Hash of the (role, text) messages sent along with the question, or None if there are none"""
+    messages = [list(message) for messages in message_lists for message in messages]
+    if not messages:
+        return None
+    return hashlib.sha256(json.dumps(messages, ensure_ascii=False).encode()).hexdigest()
+
+def cache_key(question, model, personality, context=None):
+    payload = json.dumps([normalize_question(question), model, personality, context], ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+class ResponseCache:
+    """Two-tier reply cache: LRU in memory, then an optional SQLite file"""
+
+    def __init__(self, path=None, max_entries=1024, disk_max_entries=10000, ttl=86400):
+        self.path = path
+        self.ttl = ttl
+        self.disk_max_entries = disk_max_entries
+        # Values are (reply, created_at); expiry follows created_at, not the last promotion
+        self._memory = TTLCache(max_entries=max_entries, ttl=float("inf"))
+        self._local = threading.local()
+        self._puts = 0
+        self._puts_lock = threading.Lock()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """Cached reply for a key, or None on a miss"""
+        now = time.time()
+        entry, _ = self._memory.lookup(key)
+        if entry is not None:
+            if now - entry[1] < self.ttl:
+                return entry[0]
+            self._memory.invalidate(key)
+        if not self.path:
+            return None
+        try:
+            conn = self._connection()
+            row = conn.execute("SELECT reply, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] >= self.ttl:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE responses SET used_at = ? WHERE key = ?", (now, key))
+        except sqlite3.Error as e:
+            print(f"⚠️ Response cache read failed: {e}")
+            return None
+        self._memory.put(key, (row[0], row[1]))
+        return row[0]
+
+    def put(self, key, reply):
+        now = time.time()
+        self._memory.put(key, (reply, now))
+        if not self.path:
+            return
+        try:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, reply, created_at, used_at) VALUES (?, ?, ?, ?)",
+                (key, reply, now, now)
+            )
+            with self._puts_lock:
+                self._puts += 1
+                prune = self._puts % PRUNE_EVERY_PUTS == 0
+            if prune:
+                self._prune(conn, now)
+        except sqlite3.Error as e:
+            print(f"⚠️ Response cache write failed: {e}")
+
+    def _prune(self, conn, now):
+        conn.execute("DELETE FROM responses WHERE created_at <= ?", (now - self.ttl,))
+        conn.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+            (self.disk_max_entries,)
+        )
+
+    def clear(self):
+        self._memory.clear()
+        if self.path:
+            self._connection().execute("DELETE FROM responses")
+
+def get_response_cache():
+    """The process-wide response cache, or None when RESPONSE_CACHE_ENABLED is off"""
+    global _cache
+    if not CACHE_CONFIG['RESPONSE_CACHE_ENABLED']:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(
+                path=CACHE_CONFIG['RESPONSE_CACHE_PATH'] or None,
+                max_entries=CACHE_CONFIG['RESPONSE_CACHE_MAX_ENTRIES'],
+                disk_max_entries=CACHE_CONFIG['RESPONSE_CACHE_DISK_MAX_ENTRIES'],
+                ttl=CACHE_CONFIG['RESPONSE_CACHE_TTL_SECONDS']
+            )
+        return _cache
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Retention policy for stored users and conversations
+
+    python retention.py
+    python retention.py --dry-run
+
+Rules (0 turns a rule off):
+    RETENTION_DEMO_USER_DAYS        delete demo-login accounts idle this long
+    RETENTION_THREAD_DAYS           delete extra threads idle this long and
+                                    clear the main conversation
+    RETENTION_MAX_TURNS_PER_THREAD  drop archived segments that hold turns
+                                    older than a thread's newest N
+
+Users are scanned a page of RETENTION_BATCH_SIZE at a time with a pause of
+RETENTION_BATCH_PAUSE seconds between pages, so a pass never floods the
+backend. Every pass reports what it reclaimed. Clearing a conversation goes
+through the same firebase_utils path as Clear Chat, so the search index,
+archive and cached summary follow. The app runs a pass every
+RETENTION_INTERVAL_HOURS only when RETENTION_ENABLED is set, which should be
+in one replica at most; otherwise schedule this script (e.g. from cron).
+"""
+
+import argparse
+import os
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import STORAGE_CONFIG
+from firebase_utils import get_storage_backend, write_chat_turns, forget_chat_thread
+from history_archive import drop_archived_segments
+from search_index import remove_turns
+from storage_backends import MAIN_THREAD
+
+# Usernames demo_oauth_login generated before demo profiles were flagged with demo_account
+DEMO_USERNAME_RE = re.compile(r"^(google|github|linkedin|apple)_user_[0-9a-f]{8}$")
+
+# The first scheduled pass waits this long, so a restart storm does not start with a scan
+STARTUP_DELAY_SECONDS = 300
+
+REPORT_FIELDS = (
+    "users_scanned", "users_deleted", "threads_deleted", "threads_cleared",
+    "segments_dropped", "turns_reclaimed", "bytes_reclaimed", "failed"
+)
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def is_demo_account(username, profile):
+    if profile.get("demo_account"):
+        return True
+    return bool(profile.get("oauth_user")) and DEMO_USERNAME_RE.match(username) is not None
+
+def _parse_time(value):
+    if isinstance(value, datetime):
+        return value.astimezone().replace(tzinfo=None) if value.tzinfo else value
+    if isinstance(value, str) and value:
+        try:
+            return _parse_time(datetime.fromisoformat(value))
+        except ValueError:
+            return None
+    return None
+
+def last_activity(profile, threads):
+    """Latest login, save or creation time of a user, or None if none is recorded"""
+    times = [_parse_time(profile.get(field)) for field in ("last_login", "last_updated", "created_at")]
+    times.extend(_parse_time(entry.get("last_updated") or entry.get("created_at")) for entry in threads.values())
+    times = [t for t in times if t is not None]
+    return max(times) if times else None
+
+def _idle_days(when, now):
+    return (now - when).total_seconds() / 86400 if when is not None else 0
+
+def _apply_to_user(backend, username, rules, now, dry_run, report):
+    profile = backend.get_user(username)
+    if profile is None:
+        return
+    threads = backend.list_threads(username)
+
+    if rules["demo_user_days"] and is_demo_account(username, profile):
+        if _idle_days(last_activity(profile, threads), now) >= rules["demo_user_days"]:
+            if not dry_run:
+                backend.delete_user(username)
+                for thread_id in threads:
+                    forget_chat_thread(username, thread_id)
+            report["users_deleted"] += 1
+            report["turns_reclaimed"] += sum(entry.get("message_count", 0) for entry in threads.values())
+            return
+
+    for thread_id, entry in threads.items():
+        message_count = entry.get("message_count", 0)
+        updated = _parse_time(entry.get("last_updated") or entry.get("created_at"))
+        if rules["thread_days"] and _idle_days(updated, now) >= rules["thread_days"]:
+            if thread_id != MAIN_THREAD:
+                if not dry_run:
+                    backend.delete_thread(username, thread_id)
+                    forget_chat_thread(username, thread_id)
+                report["threads_deleted"] += 1
+            elif message_count:
+                if not dry_run:
+                    # Same path as Clear Chat: turns, search postings, archived segments, summary
+                    write_chat_turns(backend, username, [], 0, message_count, MAIN_THREAD)
+                report["threads_cleared"] += 1
+            report["turns_reclaimed"] += message_count
+            continue
+
+        if rules["max_turns"] and message_count > rules["max_turns"]:
+            keep_from = message_count - rules["max_turns"]
+            if dry_run:
+                dropped = [s for s in backend.get_archive_manifest(username, thread_id) if s["end"] <= keep_from]
+            else:
+                dropped = drop_archived_segments(backend, username, thread_id, keep_from)
+                for segment in dropped:
+                    remove_turns(backend, username, thread_id, range(segment["start"], segment["end"]))
+            report["segments_dropped"] += len(dropped)
+            report["turns_reclaimed"] += sum(segment["turns"] for segment in dropped)
+            report["bytes_reclaimed"] += sum(segment["bytes"] for segment in dropped)
+
+def apply_retention(backend, demo_user_days=0, thread_days=0, max_turns=0,
+                    batch_size=100, batch_pause=1.0, dry_run=False, now=None):
+    """Apply the retention rules to every user; returns a report of what was (or would be) reclaimed"""
+    rules = {"demo_user_days": demo_user_days, "thread_days": thread_days, "max_turns": max_turns}
+    report = dict.fromkeys(REPORT_FIELDS, 0)
+    now = now or datetime.now()
+    after = None
+    while True:
+        usernames = backend.list_users(after, batch_size)
+        for username in usernames:
+            report["users_scanned"] += 1
+            try:
+                _apply_to_user(backend, username, rules, now, dry_run, report)
+            except Exception as e:
+                print(f"❌ Retention failed for {username}: {e}")
+                report["failed"] += 1
+        if len(usernames) < batch_size:
+            return report
+        # Deleted users drop out of the listing, so paging after the last name seen stays correct
+        after = usernames[-1]
+        time.sleep(batch_pause)
+
+def run_retention(dry_run=False):
+    """One pass with the rules from STORAGE_CONFIG; prints and returns the report"""
+    started = time.monotonic()
+    report = apply_retention(
+        get_storage_backend(),
+        demo_user_days=STORAGE_CONFIG['RETENTION_DEMO_USER_DAYS'],
+        thread_days=STORAGE_CONFIG['RETENTION_THREAD_DAYS'],
+        max_turns=STORAGE_CONFIG['RETENTION_MAX_TURNS_PER_THREAD'],
+        batch_size=STORAGE_CONFIG['RETENTION_BATCH_SIZE'],
+        batch_pause=STORAGE_CONFIG['RETENTION_BATCH_PAUSE'],
+        dry_run=dry_run
+    )
+    print(f"{'🔍 Retention dry run' if dry_run else '🧹 Retention pass'} over {report['users_scanned']} users "
+          f"in {time.monotonic() - started:.1f}s: {report['users_deleted']} users deleted, "
+          f"{report['threads_deleted']} threads deleted, {report['threads_cleared']} cleared, "
+          f"{report['segments_dropped']} archived segments dropped ({report['bytes_reclaimed']} bytes), "
+          f"{report['turns_reclaimed']} turns reclaimed" + (f", {report['failed']} failed" if report['failed'] else ""))
+    return report
+
+def start_retention_scheduler():
+    """Run a retention pass every RETENTION_INTERVAL_HOURS on a daemon thread; cheap to call on every rerun"""
+    global _scheduler
+    if _scheduler is not None or not STORAGE_CONFIG['RETENTION_ENABLED']:
+        return
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = threading.Thread(target=_retention_loop, name="retention", daemon=True)
+            _scheduler.start()
+
+def _retention_loop():
+    time.sleep(STARTUP_DELAY_SECONDS)
+    while True:
+        try:
+            run_retention()
+        except Exception as e:
+            print(f"⚠️ Retention pass failed: {e}")
+        time.sleep(STORAGE_CONFIG['RETENTION_INTERVAL_HOURS'] * 3600)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply the retention policy to stored users and conversations")
+    parser.add_argument("--dry-run", action="store_true", help="report what would be reclaimed without deleting")
+    args = parser.parse_args(argv)
+    return 1 if run_retention(args.dry_run)["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
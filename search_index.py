@@ -0,0 +1,129 @@
+# Full-text search over chat history
+# Each user has an inverted index: for every term, postings of
+# (thread_id, message_id, tf, dl) with the term's frequency in the turn and
+# the turn's length. Each indexed turn also has a forward entry (its term
+# counts plus a short preview), so an edit or truncation removes exactly the
+# postings it invalidates. The index is updated incrementally as turns are
+# saved; a query reads only the postings of its own terms and ranks the
+# matching turns with BM25, without touching the history itself.
+
+import math
+import re
+from collections import Counter
+from storage_backends import MAIN_THREAD
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+MAX_TERM_LENGTH = 64
+MAX_QUERY_TERMS = 30
+PREVIEW_CHARS = 200
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have i if in is it its me my no not of on or so
+that the this to was we were what when which who will with you your
+""".split())
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+def tokenize(text):
+    """Lower-cased word terms of a text, without stopwords"""
+    return [
+        term for term in TOKEN_RE.findall((text or "").lower())
+        if term not in STOPWORDS and len(term) <= MAX_TERM_LENGTH
+    ]
+
+def _preview(text):
+    text = text or ""
+    return text if len(text) <= PREVIEW_CHARS else text[:PREVIEW_CHARS].rstrip() + "…"
+
+def index_turns(backend, username, thread_id, turns, message_count, previous_count=0):
+    """Bring the index in line with a save_turns call.
+
+    Turns below previous_count may already be indexed and have their old
+    postings replaced; turns from message_count to previous_count were
+    truncated and are removed from the index.
+    """
+    thread_id = thread_id or MAIN_THREAD
+    truncated = range(message_count, previous_count)
+    stale_ids = [turn["message_id"] for turn in turns if turn["message_id"] < previous_count] + list(truncated)
+    old_entries = backend.get_search_docs(username, thread_id, stale_ids) if stale_ids else {}
+
+    postings = []
+    docs = []
+    new_terms = {}
+    for turn in turns:
+        counts = Counter(tokenize(turn["user_message"]) + tokenize(turn["bot_reply"]))
+        length = sum(counts.values())
+        new_terms[turn["message_id"]] = counts
+        postings.extend([term, turn["message_id"], tf, length] for term, tf in counts.items())
+        docs.append([turn["message_id"], {
+            "terms": dict(counts),
+            "user_message": _preview(turn["user_message"]),
+            "bot_reply": _preview(turn["bot_reply"]),
+            "timestamp": turn.get("timestamp")
+        }])
+
+    for message_id, entry in old_entries.items():
+        current = new_terms.get(message_id, {})
+        # tf 0 removes the posting
+        postings.extend([term, message_id, 0, 0] for term in entry.get("terms", {}) if term not in current)
+    docs.extend([message_id, None] for message_id in truncated if message_id in old_entries)
+
+    if postings or docs:
+        backend.update_search_index(username, thread_id, postings, docs)
+
+def remove_turns(backend, username, thread_id, message_ids):
+    """Drop turns from the index, e.g. when retention deletes them from storage"""
+    thread_id = thread_id or MAIN_THREAD
+    entries = backend.get_search_docs(username, thread_id, list(message_ids))
+    if entries:
+        backend.update_search_index(
+            username, thread_id,
+            [[term, message_id, 0, 0] for message_id, entry in entries.items() for term in entry.get("terms", {})],
+            [[message_id, None] for message_id in entries]
+        )
+
+def search_history(backend, username, query, total_turns, limit=10):
+    """Best-matching turns for a query across all of a user's threads, best first.
+
+    Each result has thread_id, message_id, score and the turn's preview.
+    total_turns (all threads) sizes the BM25 idf.
+    """
+    terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    if not terms:
+        return []
+    rows = backend.get_search_postings(username, terms)
+    if not rows:
+        return []
+
+    doc_freq = Counter(term for term, *_ in rows)
+    lengths = {(thread_id, message_id): length for _, thread_id, message_id, _, length in rows}
+    # Average length of the matching turns stands in for the collection average
+    avg_length = sum(lengths.values()) / len(lengths) or 1
+    total_turns = max(total_turns, len(lengths))
+
+    scores = Counter()
+    for term, thread_id, message_id, tf, length in rows:
+        idf = math.log(1 + (total_turns - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+        scores[(thread_id, message_id)] += idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / avg_length))
+
+    best = scores.most_common(limit)
+    by_thread = {}
+    for thread_id, message_id in (key for key, _ in best):
+        by_thread.setdefault(thread_id, []).append(message_id)
+    entries = {
+        (thread_id, message_id): entry
+        for thread_id, message_ids in by_thread.items()
+        for message_id, entry in backend.get_search_docs(username, thread_id, message_ids).items()
+    }
+    return [
+        {
+            "thread_id": thread_id,
+            "message_id": message_id,
+            "score": round(score, 4),
+            "user_message": entries.get((thread_id, message_id), {}).get("user_message", ""),
+            "bot_reply": entries.get((thread_id, message_id), {}).get("bot_reply", ""),
+            "timestamp": entries.get((thread_id, message_id), {}).get("timestamp")
+        }
+        for (thread_id, message_id), score in best
+    ]
@@ -0,0 +1,203 @@
+# Similarity cache of LLM replies
+# Catches paraphrases the exact-match response cache misses. Questions are
+# embedded into unit vectors kept in one contiguous float32 matrix, so a
+# lookup is a single matrix-vector product. A stored reply is only reused for
+# the same model, personality and prompt context (see response_cache), and only
+# when the cosine similarity reaches the personality's threshold. Entries
+# expire after SEMANTIC_CACHE_TTL_SECONDS; when the matrix is full the least
+# recently used entry makes room.
+#
+# Similar wording does not mean a similar question: "more than $20" and
+# "fewer than $20", or Windows and macOS, embed close together. A hit is
+# refused unless both questions carry the same numbers, negations and
+# comparatives, and the same capitalized names. Entries are kept per user
+# unless SEMANTIC_CACHE_SHARED is set, and the cache is off by default.
+#
+# Embedders are pluggable: any object with a `dim` attribute and an
+# embed(texts) method returning L2-normalized float32 rows. The default
+# hashing embedder works offline; others are added to EMBEDDERS.
+
+import hashlib
+import re
+import threading
+import time
+import numpy as np
+from config import CACHE_CONFIG
+from response_cache import normalize_question
+
+WORD_RE = re.compile(r"\w+")
+
+class HashingEmbedder:
+    """Feature-hashed bag of words, word pairs and character trigrams"""
+
+    def __init__(self, dim=1024):
+        self.dim = dim
+
+    def _features(self, text):
+        words = WORD_RE.findall(normalize_question(text))
+        for word in words:
+            yield word, 1.0
+            padded = f"#{word}#"
+            # Trigrams let "openai" and "api" or "keys" and "key" overlap
+            for i in range(len(padded) - 2):
+                yield "3:" + padded[i:i + 3], 0.5
+        for first, second in zip(words, words[1:]):
+            yield f"2:{first} {second}", 1.0
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, weight in self._features(text):
+                digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+                # The top bit picks a sign so colliding features tend to cancel out
+                vectors[row, digest % self.dim] += weight if digest >> 63 else -weight
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+# Words that flip or pin down the answer when they differ between two questions
+NUMBER_WORDS = frozenset("""
+zero one two three four five six seven eight nine ten eleven twelve twenty thirty forty fifty
+hundred thousand million billion half dozen first second third next last previous
+""".split())
+POLARITY_WORDS = frozenset("""
+not no never none nothing nor without cannot dont doesnt didnt isnt arent wasnt werent wont cant
+shouldnt couldnt wouldnt more less fewer most least greater smaller larger bigger higher lower
+above below before after over under minimum maximum min max
+""".split())
+
+def question_signature(text):
+    """Numbers, negations and comparatives, and capitalized names in a question"""
+    plain = text.replace("'", "").replace("\u2019", "")
+    words = WORD_RE.findall(plain)
+    lowered = [word.casefold() for word in words]
+    numbers = frozenset(w for w in lowered if w.isdigit() or w in NUMBER_WORDS)
+    polarity = frozenset(w for w in lowered if w in POLARITY_WORDS)
+    # Any capital letter past the first word marks a name ("Windows", "macOS", "API")
+    names = frozenset(
+        w.casefold() for w in words[1:]
+        if w != "I" and any(c.isupper() for c in w) and w.casefold() not in POLARITY_WORDS
+    )
+    return numbers, polarity, names
+
+EMBEDDERS = {
+    "hashing": HashingEmbedder,
+}
+
+def parse_thresholds(spec):
+    """'creative=0.95,technical=0.9' -> {"creative": 0.95, "technical": 0.9}"""
+    thresholds = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.partition("=")
+        thresholds[name.strip()] = float(value)
+    return thresholds
+
+class SemanticCache:
+    """Replies indexed by question embedding, scoped by user, model, personality and context"""
+
+    def __init__(self, embedder, capacity=2048, ttl=86400, threshold=0.93, thresholds=None):
+        self.embedder = embedder
+        self.capacity = capacity
+        self.ttl = ttl
+        self.threshold = threshold
+        self.thresholds = thresholds or {}
+        self._vectors = np.zeros((capacity, embedder.dim), dtype=np.float32)
+        # Per-row metadata, parallel to the first _size rows of the matrix
+        self._scopes = np.zeros(capacity, dtype=np.int64)
+        self._created = np.zeros(capacity, dtype=np.float64)
+        self._used = np.zeros(capacity, dtype=np.float64)
+        self._replies = [None] * capacity
+        self._signatures = [None] * capacity
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _scope(model, personality, context, user):
+        digest = hashlib.blake2b(f"{user or ''}\0{model}\0{personality}\0{context or ''}".encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "little", signed=True)
+
+    def threshold_for(self, personality):
+        return self.thresholds.get(personality, self.threshold)
+
+    def get(self, question, model, personality, context=None, user=None):
+        """(reply, similarity) of the closest matching cached question, or (None, best similarity).
+
+        user None looks in the shared scope; pass the username to keep replies per user.
+        """
+        vector = self.embedder.embed([question])[0]
+        signature = question_signature(question)
+        now = time.time()
+        with self._lock:
+            if not self._size:
+                return None, 0.0
+            n = self._size
+            scores = self._vectors[:n] @ vector
+            scores[self._scopes[:n] != self._scope(model, personality, context, user)] = -1.0
+            scores[now - self._created[:n] >= self.ttl] = -1.0
+            best_similarity = max(float(scores.max()), 0.0)
+            candidates = np.flatnonzero(scores >= self.threshold_for(personality))
+            for row in candidates[np.argsort(-scores[candidates])]:
+                if self._signatures[row] == signature:
+                    self._used[row] = now
+                    return self._replies[row], float(scores[row])
+            return None, best_similarity
+
+    def put(self, question, model, personality, reply, context=None, user=None):
+        vector = self.embedder.embed([question])[0]
+        now = time.time()
+        with self._lock:
+            self._drop_expired(now)
+            if self._size < self.capacity:
+                row = self._size
+                self._size += 1
+            else:
+                row = int(np.argmin(self._used[:self._size]))
+            self._vectors[row] = vector
+            self._scopes[row] = self._scope(model, personality, context, user)
+            self._created[row] = now
+            self._used[row] = now
+            self._replies[row] = reply
+            self._signatures[row] = question_signature(question)
+
+    def _drop_expired(self, now):
+        n = self._size
+        keep = np.flatnonzero(now - self._created[:n] < self.ttl)
+        if len(keep) == n:
+            return
+        # Compact the live rows to the front so the matrix stays contiguous
+        k = len(keep)
+        self._vectors[:k] = self._vectors[keep]
+        self._scopes[:k] = self._scopes[keep]
+        self._created[:k] = self._created[keep]
+        self._used[:k] = self._used[keep]
+        self._replies = [self._replies[i] for i in keep] + [None] * (self.capacity - k)
+        self._signatures = [self._signatures[i] for i in keep] + [None] * (self.capacity - k)
+        self._size = k
+
+    def clear(self):
+        with self._lock:
+            self._replies = [None] * self.capacity
+            self._signatures = [None] * self.capacity
+            self._size = 0
+
+    def __len__(self):
+        return self._size
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_semantic_cache():
+    """The process-wide similarity cache, or None when SEMANTIC_CACHE_ENABLED is off"""
+    global _cache
+    if not CACHE_CONFIG['SEMANTIC_CACHE_ENABLED']:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            embedder = EMBEDDERS[CACHE_CONFIG['SEMANTIC_CACHE_EMBEDDER']](CACHE_CONFIG['SEMANTIC_CACHE_DIM'])
+            _cache = SemanticCache(
+                embedder,
+                capacity=CACHE_CONFIG['SEMANTIC_CACHE_MAX_ENTRIES'],
+                ttl=CACHE_CONFIG['SEMANTIC_CACHE_TTL_SECONDS'],
+                threshold=CACHE_CONFIG['SEMANTIC_CACHE_THRESHOLD'],
+                thresholds=parse_thresholds(CACHE_CONFIG['SEMANTIC_CACHE_THRESHOLDS'])
+            )
+        return _cache
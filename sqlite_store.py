@@ -0,0 +1,362 @@
+# SQLite (WAL) store for the local-storage fallback
+# One users table holding each profile as JSON plus its message counter, and a
+# messages table keyed by (username, message_id), so a turn is a single INSERT
+# and a history page is an indexed range query. WAL mode lets many sessions
+# read while one writes, instead of clobbering whole per-user JSON files.
+# Extra conversation threads keep their turns in thread_messages; the threads
+# table is the per-user index (title, model, turn count, last update).
+# Cold turns moved out by history_archive live in archive_segments as one
+# compressed blob per segment; the other columns form the segment manifest.
+# search_postings is the full-text inverted index (one row per term and turn)
+# and search_docs its forward index (term counts and a preview per turn).
+# summaries holds each thread's rolling summary of its older turns.
+
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from storage_backends import MAIN_THREAD, is_main_thread, history_to_turns
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    last_updated TEXT
+);
+CREATE TABLE IF NOT EXISTS messages (
+    username TEXT NOT NULL,
+    message_id INTEGER NOT NULL,
+    user_message TEXT,
+    bot_reply TEXT,
+    timestamp TEXT,
+    PRIMARY KEY (username, message_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS threads (
+    username TEXT NOT NULL,
+    thread_id TEXT NOT NULL,
+    title TEXT,
+    model TEXT,
+    created_at TEXT,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    last_updated TEXT,
+    PRIMARY KEY (username, thread_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS thread_messages (
+    username TEXT NOT NULL,
+    thread_id TEXT NOT NULL,
+    message_id INTEGER NOT NULL,
+    user_message TEXT,
+    bot_reply TEXT,
+    timestamp TEXT,
+    PRIMARY KEY (username, thread_id, message_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS archive_segments (
+    username TEXT NOT NULL,
+    thread_id TEXT NOT NULL,
+    start_id INTEGER NOT NULL,
+    end_id INTEGER NOT NULL,
+    meta TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (username, thread_id, start_id)
+);
+CREATE TABLE IF NOT EXISTS search_postings (
+    username TEXT NOT NULL,
+    term TEXT NOT NULL,
+    thread_id TEXT NOT NULL,
+    message_id INTEGER NOT NULL,
+    tf INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    PRIMARY KEY (username, term, thread_id, message_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS summaries (
+    username TEXT NOT NULL,
+    thread_id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (username, thread_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS search_docs (
+    username TEXT NOT NULL,
+    thread_id TEXT NOT NULL,
+    message_id INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (username, thread_id, message_id)
+) WITHOUT ROWID;
+"""
+
+THREAD_FIELDS = ("title", "model", "created_at", "message_count", "last_updated")
+
+class SQLiteStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connection(self):
+        """One connection per thread; Streamlit sessions run on separate threads"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            with self._schema_lock:
+                if not self._schema_ready:
+                    conn.executescript(SCHEMA)
+                    self._schema_ready = True
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        conn = self._connection()
+        return _Transaction(conn)
+
+    def get_user(self, username):
+        row = self._connection().execute(
+            "SELECT data, message_count, last_updated FROM users WHERE username = ?", (username,)
+        ).fetchone()
+        if row is None:
+            return None
+        data = json.loads(row["data"])
+        data["message_count"] = row["message_count"]
+        if row["last_updated"]:
+            data["last_updated"] = row["last_updated"]
+        return data
+
+    def put_user(self, username, profile):
+        """Create or replace a profile, keeping the stored message counter"""
+        profile = {k: v for k, v in profile.items() if k not in ("message_count", "last_updated")}
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO users (username, data) VALUES (?, ?) "
+                "ON CONFLICT(username) DO UPDATE SET data = excluded.data",
+                (username, json.dumps(profile))
+            )
+
+    def list_users(self, after=None, limit=500):
+        rows = self._connection().execute(
+            "SELECT username FROM users WHERE username > ? ORDER BY username LIMIT ?", (after or "", limit)
+        ).fetchall()
+        return [row["username"] for row in rows]
+
+    def save_turns(self, username, turns, message_count, thread_id=None):
+        """Upsert the given turns and drop any stored beyond message_count"""
+        thread_id = None if thread_id == MAIN_THREAD else thread_id
+        now = datetime.now().isoformat()
+        with self._transaction() as conn:
+            if thread_id is None:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO messages (username, message_id, user_message, bot_reply, timestamp) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (username, t["message_id"], t["user_message"], t["bot_reply"], t.get("timestamp") or now)
+                        for t in turns
+                    ]
+                )
+                conn.execute(
+                    "DELETE FROM messages WHERE username = ? AND message_id >= ?", (username, message_count)
+                )
+                conn.execute(
+                    "INSERT INTO users (username, data, message_count, last_updated) VALUES (?, '{}', ?, ?) "
+                    "ON CONFLICT(username) DO UPDATE SET "
+                    "message_count = excluded.message_count, last_updated = excluded.last_updated",
+                    (username, message_count, now)
+                )
+            else:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO thread_messages "
+                    "(username, thread_id, message_id, user_message, bot_reply, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (username, thread_id, t["message_id"], t["user_message"], t["bot_reply"], t.get("timestamp") or now)
+                        for t in turns
+                    ]
+                )
+                conn.execute(
+                    "DELETE FROM thread_messages WHERE username = ? AND thread_id = ? AND message_id >= ?",
+                    (username, thread_id, message_count)
+                )
+            conn.execute(
+                "INSERT INTO threads (username, thread_id, message_count, last_updated) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(username, thread_id) DO UPDATE SET "
+                "message_count = excluded.message_count, last_updated = excluded.last_updated",
+                (username, thread_id or MAIN_THREAD, message_count, now)
+            )
+
+    def replace_history(self, username, chat_history, timestamps=None):
+        turns = history_to_turns(chat_history, timestamps)
+        self.save_turns(username, turns, len(turns))
+
+    def get_page(self, username, before=None, limit=50, thread_id=None):
+        """Newest `limit` turns with message_id < before, oldest first"""
+        if is_main_thread(thread_id):
+            table, where, params = "messages", "username = ?", [username]
+        else:
+            table, where, params = "thread_messages", "username = ? AND thread_id = ?", [username, thread_id]
+        if before is not None:
+            where += " AND message_id < ?"
+            params.append(before)
+        rows = self._connection().execute(
+            f"SELECT message_id, user_message, bot_reply, timestamp FROM {table} "
+            f"WHERE {where} ORDER BY message_id DESC LIMIT ?", (*params, limit)
+        ).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def list_threads(self, username):
+        """The user's thread index; the main thread is listed once it has turns"""
+        rows = self._connection().execute(
+            "SELECT thread_id, title, model, created_at, message_count, last_updated FROM threads "
+            "WHERE username = ?", (username,)
+        ).fetchall()
+        threads = {row["thread_id"]: {k: row[k] for k in THREAD_FIELDS if row[k] is not None} for row in rows}
+        if MAIN_THREAD not in threads:
+            user = self._connection().execute(
+                "SELECT message_count, last_updated FROM users WHERE username = ?", (username,)
+            ).fetchone()
+            if user is not None and user["message_count"]:
+                threads[MAIN_THREAD] = {"message_count": user["message_count"], "last_updated": user["last_updated"]}
+        return threads
+
+    def put_thread(self, username, thread_id, fields):
+        """Create a thread index entry or update its title/model"""
+        fields = {k: v for k, v in fields.items() if k in ("title", "model", "created_at")}
+        columns = ", ".join(fields)
+        updates = ", ".join(f"{k} = excluded.{k}" for k in fields) or "thread_id = thread_id"
+        placeholders = ", ".join("?" for _ in fields)
+        with self._transaction() as conn:
+            conn.execute(
+                f"INSERT INTO threads (username, thread_id{', ' + columns if fields else ''}) "
+                f"VALUES (?, ?{', ' + placeholders if fields else ''}) "
+                f"ON CONFLICT(username, thread_id) DO UPDATE SET {updates}",
+                (username, thread_id, *fields.values())
+            )
+
+    def get_archive_manifest(self, username, thread_id=None):
+        rows = self._connection().execute(
+            "SELECT meta FROM archive_segments WHERE username = ? AND thread_id = ? ORDER BY start_id",
+            (username, thread_id or MAIN_THREAD)
+        ).fetchall()
+        return [json.loads(row["meta"]) for row in rows]
+
+    def get_archive_segment(self, username, thread_id, start):
+        row = self._connection().execute(
+            "SELECT data FROM archive_segments WHERE username = ? AND thread_id = ? AND start_id = ?",
+            (username, thread_id or MAIN_THREAD, start)
+        ).fetchone()
+        return bytes(row["data"]) if row else None
+
+    def put_archive_segment(self, username, thread_id, segment, blob):
+        """Store a segment and drop its turns from the hot tables in one transaction"""
+        thread_id = thread_id or MAIN_THREAD
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO archive_segments (username, thread_id, start_id, end_id, meta, data) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (username, thread_id, segment["start"], segment["end"], json.dumps(segment), blob)
+            )
+            if thread_id == MAIN_THREAD:
+                conn.execute(
+                    "DELETE FROM messages WHERE username = ? AND message_id >= ? AND message_id < ?",
+                    (username, segment["start"], segment["end"])
+                )
+            else:
+                conn.execute(
+                    "DELETE FROM thread_messages WHERE username = ? AND thread_id = ? "
+                    "AND message_id >= ? AND message_id < ?",
+                    (username, thread_id, segment["start"], segment["end"])
+                )
+
+    def delete_archive_segment(self, username, thread_id, start):
+        with self._transaction() as conn:
+            conn.execute(
+                "DELETE FROM archive_segments WHERE username = ? AND thread_id = ? AND start_id = ?",
+                (username, thread_id or MAIN_THREAD, start)
+            )
+
+    def get_search_postings(self, username, terms):
+        terms = list(terms)
+        if not terms:
+            return []
+        rows = self._connection().execute(
+            f"SELECT term, thread_id, message_id, tf, length FROM search_postings "
+            f"WHERE username = ? AND term IN ({', '.join('?' for _ in terms)})", (username, *terms)
+        ).fetchall()
+        return [list(row) for row in rows]
+
+    def get_search_docs(self, username, thread_id, message_ids):
+        message_ids = list(message_ids)
+        entries = {}
+        for start in range(0, len(message_ids), 500):
+            chunk = message_ids[start:start + 500]
+            rows = self._connection().execute(
+                f"SELECT message_id, data FROM search_docs WHERE username = ? AND thread_id = ? "
+                f"AND message_id IN ({', '.join('?' for _ in chunk)})", (username, thread_id, *chunk)
+            ).fetchall()
+            entries.update((row["message_id"], json.loads(row["data"])) for row in rows)
+        return entries
+
+    def update_search_index(self, username, thread_id, postings, docs):
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO search_postings (username, term, thread_id, message_id, tf, length) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(username, term, thread_id, i, tf, length) for term, i, tf, length in postings if tf]
+            )
+            conn.executemany(
+                "DELETE FROM search_postings WHERE username = ? AND term = ? AND thread_id = ? AND message_id = ?",
+                [(username, term, thread_id, i) for term, i, tf, _ in postings if not tf]
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO search_docs (username, thread_id, message_id, data) VALUES (?, ?, ?, ?)",
+                [(username, thread_id, i, json.dumps(entry)) for i, entry in docs if entry is not None]
+            )
+            conn.executemany(
+                "DELETE FROM search_docs WHERE username = ? AND thread_id = ? AND message_id = ?",
+                [(username, thread_id, i) for i, entry in docs if entry is None]
+            )
+
+    def get_summary(self, username, thread_id=None):
+        row = self._connection().execute(
+            "SELECT data FROM summaries WHERE username = ? AND thread_id = ?", (username, thread_id or MAIN_THREAD)
+        ).fetchone()
+        return json.loads(row["data"]) if row else None
+
+    def put_summary(self, username, thread_id, summary):
+        with self._transaction() as conn:
+            if summary is None:
+                conn.execute(
+                    "DELETE FROM summaries WHERE username = ? AND thread_id = ?", (username, thread_id or MAIN_THREAD)
+                )
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO summaries (username, thread_id, data) VALUES (?, ?, ?)",
+                    (username, thread_id or MAIN_THREAD, json.dumps(summary))
+                )
+
+    def delete_thread(self, username, thread_id):
+        with self._transaction() as conn:
+            for table in ("thread_messages", "threads", "archive_segments", "summaries", "search_postings", "search_docs"):
+                conn.execute(f"DELETE FROM {table} WHERE username = ? AND thread_id = ?", (username, thread_id))
+
+    def delete_user(self, username):
+        with self._transaction() as conn:
+            for table in ("users", "messages", "threads", "thread_messages",
+                          "archive_segments", "summaries", "search_postings", "search_docs"):
+                conn.execute(f"DELETE FROM {table} WHERE username = ?", (username,))
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK on an autocommit connection"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
@@ -0,0 +1,1122 @@
+# Storage backends
+# Every backend stores a profile document per user (with a message_count
+# counter) and the conversation as individually addressable turns. Turns are
+# dicts with message_id, user_message, bot_reply and timestamp. A backend is
+# picked once per process by firebase_utils.get_storage_backend().
+# Besides the main conversation a user can have extra threads; each thread's
+# title, model, turn count and last update live in a small per-user index so
+# listing threads never touches the turns themselves.
+# Turns older than a hot window can be moved into compressed archive segments
+# (see history_archive); backends store the blobs and a per-thread manifest.
+# Backends also hold each user's full-text search index (see search_index):
+# postings grouped by term (in buckets by term hash), and one forward entry
+# per indexed turn.
+
+import json
+import os
+import threading
+import zlib
+from datetime import datetime
+from firebase_admin import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+from circuit_breaker import CLOSED
+
+# Each chat turn is stored as its own document in users/{username}/messages
+# (main thread) or users/{username}/threads/{thread_id}/messages
+MESSAGES_COLLECTION = "messages"
+THREADS_COLLECTION = "threads"
+# users/{username}/archives/{thread_id} holds the segment manifest, and its
+# segments subcollection one compressed blob per segment
+ARCHIVES_COLLECTION = "archives"
+ARCHIVE_SEGMENTS_COLLECTION = "segments"
+# Search postings: one document per (thread, term-hash bucket, block of
+# message ids) holding a terms.{term}.{message_id} map, so saving a turn
+# writes at most SEARCH_POSTINGS_BUCKETS posting documents however many terms
+# it has, and no document outgrows Firestore's size or field limits
+SEARCH_POSTINGS_COLLECTION = "search_postings"
+SEARCH_DOCS_COLLECTION = "search_docs"
+SUMMARIES_COLLECTION = "summaries"
+SEARCH_POSTINGS_BUCKETS = 8
+SEARCH_POSTINGS_BLOCK = 250
+FIRESTORE_IN_LIMIT = 30
+# Thread id of the main conversation; the other modules import it from here
+MAIN_THREAD = "main"
+THREAD_INDEX_FIELDS = ("title", "model", "created_at")
+FIRESTORE_BATCH_LIMIT = 500
+
+# Where the pre-SQLite local store kept one JSON file per user
+LEGACY_LOCAL_DIR = "user_data"
+
+PROFILE_EXCLUDED_FIELDS = ("chat_history", "chat_timestamps")
+
+# Version of the stored conversation layout. Documents at this version keep
+# every turn as a per-message record; older Firestore documents may still carry
+# an inline chat_history array of dicts or (user, bot) pairs. Run
+# `admin_transfer.py migrate` to bring every user up to date.
+SCHEMA_VERSION = 2
+
+def profile_fields(data):
+    """Strip conversation data from a user document"""
+    return {k: v for k, v in data.items() if k not in PROFILE_EXCLUDED_FIELDS}
+
+def history_to_turns(chat_history, timestamps=None):
+    timestamps = list(timestamps or [])
+    return [
+        {
+            "message_id": i,
+            "user_message": user_msg,
+            "bot_reply": bot_reply,
+            "timestamp": timestamps[i] if i < len(timestamps) else None
+        }
+        for i, (user_msg, bot_reply) in enumerate(chat_history)
+    ]
+
+def convert_legacy_chat_history(chat_history):
+    """Convert an inline chat_history array back to tuple format"""
+    converted_chat_history = []
+    for msg in chat_history:
+        if isinstance(msg, dict) and "user_message" in msg and "bot_reply" in msg:
+            converted_chat_history.append((msg["user_message"], msg["bot_reply"]))
+        elif isinstance(msg, (list, tuple)) and len(msg) == 2:
+            # Handle old format (tuples)
+            converted_chat_history.append(tuple(msg))
+    return converted_chat_history
+
+def is_main_thread(thread_id):
+    return thread_id in (None, MAIN_THREAD)
+
+def slice_chat_page(turns, before, limit):
+    """Newest `limit` turns with message_id < before from a full, ordered turn list"""
+    end = len(turns) if before is None else max(0, min(before, len(turns)))
+    return [dict(turn) for turn in turns[max(0, end - limit):end]]
+
+class StorageBackend:
+    """Interface shared by the Firestore, local-file and in-memory backends"""
+
+    name = "base"
+
+    def get_user(self, username):
+        """Profile dict including message_count, or None if the user does not exist"""
+        raise NotImplementedError
+
+    def get_user_fields(self, username, fields):
+        """Only the named profile fields, or None if the user does not exist"""
+        profile = self.get_user(username)
+        if profile is None:
+            return None
+        return {k: profile[k] for k in fields if k in profile}
+
+    def put_user(self, username, profile):
+        """Create or replace a user's profile; stored turns are left untouched"""
+        raise NotImplementedError
+
+    def update_user(self, username, fields):
+        """Merge fields into an existing profile"""
+        profile = self.get_user(username) or {}
+        profile.update(fields)
+        self.put_user(username, profile)
+
+    def list_users(self, after=None, limit=500):
+        """Up to `limit` usernames sorted after `after`, for paging through every user"""
+        raise NotImplementedError
+
+    def migrate_user(self, username):
+        """Rewrite a user's stored history into the current schema; returns migrated, current or missing"""
+        return "current" if self.get_user(username) is not None else "missing"
+
+    def save_turns(self, username, turns, message_count, previous_count=0, thread_id=None):
+        """Upsert turns and drop stored turns with message_id >= message_count"""
+        raise NotImplementedError
+
+    def replace_history(self, username, chat_history, timestamps=None):
+        """Overwrite the whole conversation with a list of (user, bot) tuples"""
+        raise NotImplementedError
+
+    def get_page(self, username, before=None, limit=50, thread_id=None):
+        """Newest `limit` turns with message_id < before, oldest first"""
+        raise NotImplementedError
+
+    def list_threads(self, username):
+        """Thread index: {thread_id: {title, model, created_at, message_count, last_updated}}"""
+        raise NotImplementedError
+
+    def put_thread(self, username, thread_id, fields):
+        """Create a thread index entry or update its title/model"""
+        raise NotImplementedError
+
+    def get_archive_manifest(self, username, thread_id=None):
+        """Archived segments of a thread as [{id, start, end, turns, bytes, archived_at}], oldest first"""
+        raise NotImplementedError
+
+    def get_archive_segment(self, username, thread_id, start):
+        """Compressed blob of the segment starting at message id `start`, or None"""
+        raise NotImplementedError
+
+    def put_archive_segment(self, username, thread_id, segment, blob):
+        """Store a segment and its manifest entry, then drop its turns from hot storage"""
+        raise NotImplementedError
+
+    def delete_archive_segment(self, username, thread_id, start):
+        raise NotImplementedError
+
+    def get_search_postings(self, username, terms):
+        """Postings of the given terms as [term, thread_id, message_id, tf, length] rows"""
+        raise NotImplementedError
+
+    def get_search_docs(self, username, thread_id, message_ids):
+        """Forward index entries {message_id: entry} of the given turns that are indexed"""
+        raise NotImplementedError
+
+    def update_search_index(self, username, thread_id, postings, docs):
+        """Apply [term, message_id, tf, length] postings (tf 0 removes) and [message_id, entry|None] docs"""
+        raise NotImplementedError
+
+    def get_summary(self, username, thread_id=None):
+        """Rolling summary of a thread's older turns as {text, until, model, updated_at}, or None"""
+        raise NotImplementedError
+
+    def put_summary(self, username, thread_id, summary):
+        """Store a thread's rolling summary; None deletes it"""
+        raise NotImplementedError
+
+    def delete_thread(self, username, thread_id):
+        """Delete a non-main thread: its turns, archive, summary, search index entries and index entry"""
+        raise NotImplementedError
+
+    def delete_user(self, username):
+        """Delete a user's profile and everything stored under it"""
+        raise NotImplementedError
+
+class FirestoreBackend(StorageBackend):
+    name = "firestore"
+
+    def __init__(self, db, cache, page_size, timeout=None):
+        self.db = db
+        self.cache = cache
+        self.page_size = page_size
+        # Per-call deadline, so a slow Firestore fails fast instead of hanging the caller
+        self.timeout = timeout
+
+    def _user_ref(self, username):
+        return self.db.collection("users").document(username)
+
+    def _messages_ref(self, username, thread_id=None):
+        """Per-message subcollection of the main thread or of another thread"""
+        if is_main_thread(thread_id):
+            return self._user_ref(username).collection(MESSAGES_COLLECTION)
+        return (self._user_ref(username).collection(THREADS_COLLECTION)
+                .document(thread_id).collection(MESSAGES_COLLECTION))
+
+    @staticmethod
+    def _message_doc_id(message_id):
+        """Zero-padded document id so lexical order matches message order"""
+        return f"{message_id:08d}"
+
+    @staticmethod
+    def _message_record(turn):
+        # Firebase doesn't support nested arrays, so each turn is stored as an object
+        return {
+            "message_id": turn["message_id"],
+            "user_message": turn["user_message"],
+            "bot_reply": turn["bot_reply"],
+            "timestamp": turn.get("timestamp") or datetime.now().isoformat()
+        }
+
+    def get_user(self, username):
+        cached, fresh = self.cache.lookup(username)
+        if cached is not None and fresh:
+            return dict(cached["data"])
+
+        doc = self._user_ref(username).get(timeout=self.timeout)
+        if not doc.exists:
+            self.cache.invalidate(username)
+            return None
+        if cached is not None and cached["update_time"] == doc.update_time:
+            # Unchanged since we cached it - keep the cached recent turns too
+            self.cache.touch(username)
+            return dict(cached["data"])
+
+        data = doc.to_dict()
+        if data.get("schema_version", 0) < SCHEMA_VERSION:
+            legacy_history = data.pop("chat_history", None)
+            if "message_count" not in data:
+                # Legacy documents still carry the whole history inline
+                data["message_count"] = len(legacy_history) if isinstance(legacy_history, list) else 0
+        data.setdefault("message_count", 0)
+
+        self.cache.put(username, {"data": data, "update_time": doc.update_time, "recent": None})
+        return dict(data)
+
+    def get_user_fields(self, username, fields):
+        cached, fresh = self.cache.lookup(username)
+        if cached is not None and fresh:
+            return {k: cached["data"][k] for k in fields if k in cached["data"]}
+        # Field mask: the server sends only these fields, however large the document
+        doc = self._user_ref(username).get(field_paths=list(fields), timeout=self.timeout)
+        if not doc.exists:
+            return None
+        data = doc.to_dict() or {}
+        return {k: data[k] for k in fields if k in data}
+
+    def put_user(self, username, profile):
+        # A replaced document holds no inline history, so it is current by construction
+        self._user_ref(username).set(dict(profile_fields(profile), schema_version=SCHEMA_VERSION), timeout=self.timeout)
+        self.cache.invalidate(username)
+
+    def update_user(self, username, fields):
+        self._user_ref(username).set(profile_fields(fields), merge=True, timeout=self.timeout)
+        self.cache.invalidate(username)
+
+    def list_users(self, after=None, limit=500):
+        # Document ids only: an empty projection skips every field of the profiles
+        query = self.db.collection("users").order_by("__name__").select([])
+        if after is not None:
+            query = query.start_after({"__name__": self._user_ref(after)})
+        return [doc.id for doc in query.limit(limit).stream(timeout=self.timeout)]
+
+    def get_page(self, username, before=None, limit=None, thread_id=None):
+        limit = limit or self.page_size
+        if not is_main_thread(thread_id):
+            return self._query_page(username, before, limit, thread_id)
+
+        if before is None:
+            cached, fresh = self.cache.lookup(username)
+            if cached is not None and fresh and cached["recent"] is not None:
+                recent = cached["recent"]
+                if len(recent) >= limit or len(recent) == cached["data"].get("message_count", 0):
+                    return [dict(turn) for turn in recent[-limit:]]
+
+        turns = self._query_page(username, before, limit)
+        if not turns and self._may_be_legacy(username):
+            turns = self._get_legacy_page(username, before, limit)
+
+        if before is None:
+            self.cache.update(username, lambda entry: dict(entry, recent=[dict(turn) for turn in turns]))
+        return turns
+
+    def _query_page(self, username, before, limit, thread_id=None):
+        query = self._messages_ref(username, thread_id).order_by("message_id", direction=firestore.Query.DESCENDING)
+        if before is not None:
+            query = query.where("message_id", "<", before)
+        turns = [msg.to_dict() for msg in query.limit(limit).stream(timeout=self.timeout)]
+        turns.reverse()
+        return turns
+
+    def _may_be_legacy(self, username):
+        """False once the user's cached document is known to be at the current schema"""
+        cached, _ = self.cache.lookup(username)
+        return cached is None or cached["data"].get("schema_version", 0) < SCHEMA_VERSION
+
+    def migrate_user(self, username):
+        doc = self._user_ref(username).get(timeout=self.timeout)
+        if not doc.exists:
+            return "missing"
+        data = doc.to_dict() or {}
+        if data.get("schema_version", 0) >= SCHEMA_VERSION:
+            return "current"
+        legacy_history = data.get("chat_history")
+        if "message_count" not in data and isinstance(legacy_history, list) and legacy_history:
+            # Move the inline array into per-message documents (save_turns drops chat_history)
+            history = convert_legacy_chat_history(legacy_history)
+            self.save_turns(username, history_to_turns(history, data.get("chat_timestamps")), len(history))
+        self._user_ref(username).set({
+            "schema_version": SCHEMA_VERSION,
+            "chat_history": firestore.DELETE_FIELD,
+            "chat_timestamps": firestore.DELETE_FIELD
+        }, merge=True, timeout=self.timeout)
+        self.cache.invalidate(username)
+        return "migrated"
+
+    def _get_legacy_page(self, username, before, limit):
+        """Page through a legacy inline chat_history array"""
+        doc = self._user_ref(username).get(field_paths=["chat_history"], timeout=self.timeout)
+        legacy_history = (doc.to_dict() or {}).get("chat_history") if doc.exists else None
+        if not isinstance(legacy_history, list):
+            return []
+        return slice_chat_page(history_to_turns(convert_legacy_chat_history(legacy_history)), before, limit)
+
+    def save_turns(self, username, turns, message_count, previous_count=0, thread_id=None):
+        messages_ref = self._messages_ref(username, thread_id)
+        turns = [self._message_record(turn) for turn in turns]
+        writes = [
+            ("set", messages_ref.document(self._message_doc_id(turn["message_id"])), turn)
+            for turn in turns
+        ]
+        # Drop turns that no longer exist (e.g. after Clear Chat)
+        writes.extend(
+            ("delete", messages_ref.document(self._message_doc_id(i)), None)
+            for i in range(message_count, previous_count)
+        )
+        self._commit_in_batches(writes)
+
+        # Use set with merge=True to create document if it doesn't exist
+        last_updated = datetime.now().isoformat()
+        thread_entry = {"message_count": message_count, "last_updated": last_updated}
+        update = {"threads": {thread_id or MAIN_THREAD: thread_entry}}
+        if is_main_thread(thread_id):
+            update.update({
+                "chat_history": firestore.DELETE_FIELD,
+                "message_count": message_count,
+                "last_updated": last_updated,
+                "schema_version": SCHEMA_VERSION
+            })
+        write_result = self._user_ref(username).set(update, merge=True, timeout=self.timeout)
+
+        if is_main_thread(thread_id):
+            self.cache.update(
+                username,
+                self._apply_turns_to_cached_user(turns, message_count, last_updated, write_result.update_time)
+            )
+        else:
+            self.cache.update(
+                username,
+                self._apply_thread_to_cached_user(thread_id, thread_entry, write_result.update_time)
+            )
+
+    def list_threads(self, username):
+        # Served from the cached user document when fresh, else a single document read
+        profile = self.get_user(username) or {}
+        threads = {tid: dict(entry) for tid, entry in (profile.get("threads") or {}).items()}
+        if MAIN_THREAD not in threads and profile.get("message_count"):
+            threads[MAIN_THREAD] = {"message_count": profile["message_count"], "last_updated": profile.get("last_updated")}
+        return threads
+
+    def put_thread(self, username, thread_id, fields):
+        fields = {k: v for k, v in fields.items() if k in THREAD_INDEX_FIELDS}
+        write_result = self._user_ref(username).set({"threads": {thread_id: fields}}, merge=True, timeout=self.timeout)
+        self.cache.update(username, self._apply_thread_to_cached_user(thread_id, fields, write_result.update_time))
+
+    def _archive_ref(self, username, thread_id):
+        return self._user_ref(username).collection(ARCHIVES_COLLECTION).document(thread_id or MAIN_THREAD)
+
+    def get_archive_manifest(self, username, thread_id=None):
+        doc = self._archive_ref(username, thread_id).get(timeout=self.timeout)
+        segments = (doc.to_dict() or {}).get("segments", {}) if doc.exists else {}
+        return sorted(segments.values(), key=lambda segment: segment["start"])
+
+    def get_archive_segment(self, username, thread_id, start):
+        doc = (self._archive_ref(username, thread_id).collection(ARCHIVE_SEGMENTS_COLLECTION)
+               .document(self._message_doc_id(start)).get(timeout=self.timeout))
+        return (doc.to_dict() or {}).get("data") if doc.exists else None
+
+    def put_archive_segment(self, username, thread_id, segment, blob):
+        # Blob, then manifest, then the hot turns: a crash part-way leaves duplicates, never gaps
+        archive_ref = self._archive_ref(username, thread_id)
+        key = self._message_doc_id(segment["start"])
+        archive_ref.collection(ARCHIVE_SEGMENTS_COLLECTION).document(key).set(
+            {"data": blob, "start": segment["start"], "end": segment["end"]}, timeout=self.timeout
+        )
+        archive_ref.set({"segments": {key: segment}}, merge=True, timeout=self.timeout)
+        messages_ref = self._messages_ref(username, thread_id)
+        self._commit_in_batches([
+            ("delete", messages_ref.document(self._message_doc_id(i)), None)
+            for i in range(segment["start"], segment["end"])
+        ])
+
+    def delete_archive_segment(self, username, thread_id, start):
+        archive_ref = self._archive_ref(username, thread_id)
+        key = self._message_doc_id(start)
+        archive_ref.set({"segments": {key: firestore.DELETE_FIELD}}, merge=True, timeout=self.timeout)
+        archive_ref.collection(ARCHIVE_SEGMENTS_COLLECTION).document(key).delete(timeout=self.timeout)
+
+    def _search_doc_ref(self, username, thread_id, message_id):
+        return self._user_ref(username).collection(SEARCH_DOCS_COLLECTION).document(
+            f"{thread_id}~{self._message_doc_id(message_id)}"
+        )
+
+    @staticmethod
+    def _search_bucket(term):
+        return zlib.crc32(term.encode()) % SEARCH_POSTINGS_BUCKETS
+
+    def get_search_postings(self, username, terms):
+        postings_ref = self._user_ref(username).collection(SEARCH_POSTINGS_COLLECTION)
+        wanted = set(terms)
+        buckets = sorted({self._search_bucket(term) for term in wanted})
+        # Field mask: only the queried terms' postings come back, not whole buckets
+        field_paths = [FieldPath("terms", term).to_api_repr() for term in terms]
+        rows = []
+        # SEARCH_POSTINGS_BUCKETS is below FIRESTORE_IN_LIMIT, so one query covers every bucket
+        query = postings_ref.where("bucket", "in", buckets).select(["thread_id", *field_paths])
+        for doc in query.stream(timeout=self.timeout):
+            data = doc.to_dict()
+            for term, postings in (data.get("terms") or {}).items():
+                if term not in wanted:
+                    continue  # another term of the same bucket, if the mask was not applied
+                rows.extend(
+                    [term, data["thread_id"], int(message_id), tf, length]
+                    for message_id, (tf, length) in postings.items()
+                )
+        return rows
+
+    def get_search_docs(self, username, thread_id, message_ids):
+        refs = [self._search_doc_ref(username, thread_id, message_id) for message_id in message_ids]
+        entries = {}
+        for start in range(0, len(refs), FIRESTORE_BATCH_LIMIT):
+            for doc in self.db.get_all(refs[start:start + FIRESTORE_BATCH_LIMIT], timeout=self.timeout):
+                if doc.exists:
+                    entry = doc.to_dict()
+                    entries[entry.pop("message_id")] = entry
+        return entries
+
+    def update_search_index(self, username, thread_id, postings, docs):
+        postings_ref = self._user_ref(username).collection(SEARCH_POSTINGS_COLLECTION)
+        by_doc = {}
+        for term, message_id, tf, length in postings:
+            key = (self._search_bucket(term), message_id // SEARCH_POSTINGS_BLOCK)
+            terms = by_doc.setdefault(key, {})
+            terms.setdefault(term, {})[str(message_id)] = [tf, length] if tf else firestore.DELETE_FIELD
+        writes = [
+            ("merge", postings_ref.document(f"{thread_id}~{bucket:02d}~{block}"),
+             {"bucket": bucket, "thread_id": thread_id, "terms": terms})
+            for (bucket, block), terms in by_doc.items()
+        ]
+        writes.extend(
+            ("delete", self._search_doc_ref(username, thread_id, message_id), None) if entry is None
+            else ("set", self._search_doc_ref(username, thread_id, message_id), dict(entry, message_id=message_id))
+            for message_id, entry in docs
+        )
+        self._commit_in_batches(writes)
+
+    def _summary_ref(self, username, thread_id):
+        return self._user_ref(username).collection(SUMMARIES_COLLECTION).document(thread_id or MAIN_THREAD)
+
+    def get_summary(self, username, thread_id=None):
+        doc = self._summary_ref(username, thread_id).get(timeout=self.timeout)
+        return doc.to_dict() if doc.exists else None
+
+    def put_summary(self, username, thread_id, summary):
+        if summary is None:
+            self._summary_ref(username, thread_id).delete(timeout=self.timeout)
+        else:
+            self._summary_ref(username, thread_id).set(summary, timeout=self.timeout)
+
+    def delete_thread(self, username, thread_id):
+        if is_main_thread(thread_id):
+            raise ValueError("The main thread cannot be deleted")
+        message_count = self.list_threads(username).get(thread_id, {}).get("message_count", 0)
+        self._delete_thread_data(username, thread_id)
+        user_ref = self._user_ref(username)
+        self._delete_query(user_ref.collection(SEARCH_POSTINGS_COLLECTION).where("thread_id", "==", thread_id))
+        self._commit_in_batches([
+            ("delete", self._search_doc_ref(username, thread_id, i), None) for i in range(message_count)
+        ])
+        # Index entry last, so an interrupted delete is retried by the next pass
+        user_ref.set({"threads": {thread_id: firestore.DELETE_FIELD}}, merge=True, timeout=self.timeout)
+        self.cache.invalidate(username)
+
+    def delete_user(self, username):
+        # Firestore does not cascade deletes, so every subcollection is cleared before the profile
+        user_ref = self._user_ref(username)
+        for thread_id in set(self.list_threads(username)) | {MAIN_THREAD}:
+            self._delete_thread_data(username, thread_id)
+        for name in (SEARCH_POSTINGS_COLLECTION, SEARCH_DOCS_COLLECTION, SUMMARIES_COLLECTION):
+            self._delete_query(user_ref.collection(name))
+        user_ref.delete(timeout=self.timeout)
+        self.cache.invalidate(username)
+
+    def _delete_thread_data(self, username, thread_id):
+        archive_ref = self._archive_ref(username, thread_id)
+        self._delete_query(self._messages_ref(username, thread_id))
+        self._delete_query(archive_ref.collection(ARCHIVE_SEGMENTS_COLLECTION))
+        archive_ref.delete(timeout=self.timeout)
+        self._summary_ref(username, thread_id).delete(timeout=self.timeout)
+
+    def _delete_query(self, query):
+        """Delete every document a query matches, one page of batch size at a time"""
+        while True:
+            docs = list(query.select([]).limit(FIRESTORE_BATCH_LIMIT).stream(timeout=self.timeout))
+            if not docs:
+                return
+            self._commit_in_batches([("delete", doc.reference, None) for doc in docs])
+
+    def replace_history(self, username, chat_history, timestamps=None):
+        snapshot = self._user_ref(username).get(field_paths=["message_count"], timeout=self.timeout)
+        stored_count = (snapshot.to_dict() or {}).get("message_count", 0) if snapshot.exists else 0
+        self.save_turns(username, history_to_turns(chat_history, timestamps), len(chat_history), stored_count)
+
+    def _commit_in_batches(self, writes):
+        """Commit (op, ref, data) writes using Firestore's 500-operation batch limit"""
+        for start in range(0, len(writes), FIRESTORE_BATCH_LIMIT):
+            batch = self.db.batch()
+            for op, ref, data in writes[start:start + FIRESTORE_BATCH_LIMIT]:
+                if op == "delete":
+                    batch.delete(ref)
+                elif op == "merge":
+                    batch.set(ref, data, merge=True)
+                else:
+                    batch.set(ref, data)
+            batch.commit(timeout=self.timeout)
+
+    @staticmethod
+    def _apply_thread_to_cached_user(thread_id, fields, update_time):
+        """Write-through update of one thread index entry in a cached user"""
+        def apply(entry):
+            threads = dict(entry["data"].get("threads") or {})
+            threads[thread_id] = {**threads.get(thread_id, {}), **fields}
+            return dict(entry, data=dict(entry["data"], threads=threads), update_time=update_time)
+        return apply
+
+    def _apply_turns_to_cached_user(self, turns, message_count, last_updated, update_time):
+        """Write-through update of a cached user entry after save_turns on the main thread"""
+        page_size = self.page_size
+        update_thread = self._apply_thread_to_cached_user(
+            MAIN_THREAD, {"message_count": message_count, "last_updated": last_updated}, update_time
+        )
+
+        def apply(entry):
+            entry = update_thread(entry)
+            data = dict(entry["data"], message_count=message_count, last_updated=last_updated, schema_version=SCHEMA_VERSION)
+            recent = entry["recent"]
+            if recent is not None:
+                by_id = {turn["message_id"]: turn for turn in recent if turn["message_id"] < message_count}
+                by_id.update((turn["message_id"], dict(turn)) for turn in turns)
+                ids = sorted(by_id)
+                if message_count == 0:
+                    recent = []
+                elif not ids or ids[-1] != message_count - 1:
+                    # The newest turn is not cached, so the page must be reloaded
+                    recent = None
+                else:
+                    # Keep the contiguous run that ends at the newest stored turn
+                    start = len(ids) - 1
+                    while start > 0 and ids[start - 1] == ids[start] - 1:
+                        start -= 1
+                    recent = [by_id[i] for i in ids[start:]][-page_size:]
+            return {"data": data, "update_time": update_time, "recent": recent}
+        return apply
+
+class LocalBackend(StorageBackend):
+    """Local-file backend over an SQLiteStore or JSONLStore"""
+
+    name = "local"
+
+    def __init__(self, store, page_size, legacy_dir=LEGACY_LOCAL_DIR):
+        self.store = store
+        self.page_size = page_size
+        self.legacy_dir = legacy_dir
+
+    def _import_legacy_user(self, username):
+        """Move a pre-SQLite user_data/{username}.json file into the local store once"""
+        file_path = os.path.join(self.legacy_dir, f"{username}.json")
+        if not os.path.exists(file_path):
+            return
+        with open(file_path, 'r') as f:
+            data = json.load(f)
+        chat_history = data.pop("chat_history", None) or []
+        timestamps = data.pop("chat_timestamps", None)
+        self.store.put_user(username, data)
+        self.store.replace_history(username, chat_history, timestamps)
+        os.replace(file_path, file_path + ".imported")
+        print(f"📦 Imported legacy local data for: {username}")
+
+    def get_user(self, username):
+        self._import_legacy_user(username)
+        return self.store.get_user(username)
+
+    def put_user(self, username, profile):
+        self._import_legacy_user(username)
+        self.store.put_user(username, profile_fields(profile))
+
+    def migrate_user(self, username):
+        # The local stores only ever held per-message records; legacy JSON files are imported
+        legacy = os.path.exists(os.path.join(self.legacy_dir, f"{username}.json"))
+        if self.get_user(username) is None:
+            return "missing"
+        return "migrated" if legacy or self._legacy_import_unindexed(username) else "current"
+
+    def _legacy_import_unindexed(self, username):
+        """True if a legacy file was imported on an earlier read and its turns are not in the search index"""
+        if not os.path.exists(os.path.join(self.legacy_dir, f"{username}.json.imported")):
+            return False
+        message_count = self.store.list_threads(username).get(MAIN_THREAD, {}).get("message_count", 0)
+        return message_count > 0 and not self.store.get_search_docs(username, MAIN_THREAD, [message_count - 1])
+
+    def list_users(self, after=None, limit=500):
+        usernames = set(self.store.list_users(after, limit))
+        if os.path.isdir(self.legacy_dir):
+            # Legacy per-user files that have not been imported yet
+            usernames.update(
+                name[:-len(".json")] for name in os.listdir(self.legacy_dir)
+                if name.endswith(".json") and (after is None or name[:-len(".json")] > after)
+            )
+        return sorted(usernames)[:limit]
+
+    def get_page(self, username, before=None, limit=None, thread_id=None):
+        self._import_legacy_user(username)
+        return self.store.get_page(username, before, limit or self.page_size, thread_id=thread_id)
+
+    def save_turns(self, username, turns, message_count, previous_count=0, thread_id=None):
+        self._import_legacy_user(username)
+        self.store.save_turns(username, turns, message_count, thread_id=thread_id)
+
+    def list_threads(self, username):
+        self._import_legacy_user(username)
+        return self.store.list_threads(username)
+
+    def put_thread(self, username, thread_id, fields):
+        self.store.put_thread(username, thread_id, fields)
+
+    def get_archive_manifest(self, username, thread_id=None):
+        return self.store.get_archive_manifest(username, thread_id)
+
+    def get_archive_segment(self, username, thread_id, start):
+        return self.store.get_archive_segment(username, thread_id, start)
+
+    def put_archive_segment(self, username, thread_id, segment, blob):
+        self.store.put_archive_segment(username, thread_id, segment, blob)
+
+    def delete_archive_segment(self, username, thread_id, start):
+        self.store.delete_archive_segment(username, thread_id, start)
+
+    def get_search_postings(self, username, terms):
+        return self.store.get_search_postings(username, terms)
+
+    def get_search_docs(self, username, thread_id, message_ids):
+        return self.store.get_search_docs(username, thread_id, message_ids)
+
+    def update_search_index(self, username, thread_id, postings, docs):
+        self.store.update_search_index(username, thread_id, postings, docs)
+
+    def get_summary(self, username, thread_id=None):
+        return self.store.get_summary(username, thread_id)
+
+    def put_summary(self, username, thread_id, summary):
+        self.store.put_summary(username, thread_id, summary)
+
+    def delete_thread(self, username, thread_id):
+        if is_main_thread(thread_id):
+            raise ValueError("The main thread cannot be deleted")
+        self.store.delete_thread(username, thread_id)
+
+    def delete_user(self, username):
+        self.store.delete_user(username)
+        # Legacy per-user files, imported or not
+        for suffix in (".json", ".json.imported"):
+            try:
+                os.unlink(os.path.join(self.legacy_dir, f"{username}{suffix}"))
+            except FileNotFoundError:
+                pass
+
+    def replace_history(self, username, chat_history, timestamps=None):
+        self._import_legacy_user(username)
+        self.store.replace_history(username, chat_history, timestamps)
+
+class InMemoryBackend(StorageBackend):
+    """Process-local backend for tests, benchmarks and offline development"""
+
+    name = "memory"
+
+    def __init__(self, page_size=50):
+        self.page_size = page_size
+        self._users = {}
+        self._messages = {}
+        self._threads = {}
+        self._archives = {}
+        self._search_postings = {}
+        self._search_docs = {}
+        self._summaries = {}
+        self._lock = threading.Lock()
+
+    def get_user(self, username):
+        with self._lock:
+            profile = self._users.get(username)
+            if profile is None:
+                return None
+            return dict(profile["data"], message_count=profile["message_count"], **(
+                {"last_updated": profile["last_updated"]} if profile["last_updated"] else {}
+            ))
+
+    def put_user(self, username, profile):
+        profile = {k: v for k, v in profile_fields(profile).items() if k not in ("message_count", "last_updated")}
+        with self._lock:
+            existing = self._users.get(username)
+            self._users[username] = {
+                "data": dict(profile),
+                "message_count": existing["message_count"] if existing else 0,
+                "last_updated": existing["last_updated"] if existing else None
+            }
+
+    def list_users(self, after=None, limit=500):
+        with self._lock:
+            return sorted(u for u in self._users if after is None or u > after)[:limit]
+
+    def get_page(self, username, before=None, limit=None, thread_id=None):
+        with self._lock:
+            messages = self._messages.get((username, thread_id or MAIN_THREAD), {})
+            # Select by message_id: archived turns leave a gap at the start
+            ordered = [dict(messages[i]) for i in sorted(messages) if before is None or i < before]
+        return ordered[-(limit or self.page_size):]
+
+    def save_turns(self, username, turns, message_count, previous_count=0, thread_id=None):
+        now = datetime.now().isoformat()
+        thread_id = thread_id or MAIN_THREAD
+        with self._lock:
+            messages = self._messages.setdefault((username, thread_id), {})
+            for turn in turns:
+                messages[turn["message_id"]] = dict(turn, timestamp=turn.get("timestamp") or now)
+            for message_id in [i for i in messages if i >= message_count]:
+                del messages[message_id]
+            profile = self._users.setdefault(username, {"data": {}, "message_count": 0, "last_updated": None})
+            if thread_id == MAIN_THREAD:
+                profile["message_count"] = message_count
+                profile["last_updated"] = now
+            entry = self._threads.setdefault(username, {}).setdefault(thread_id, {})
+            entry.update(message_count=message_count, last_updated=now)
+
+    def replace_history(self, username, chat_history, timestamps=None):
+        with self._lock:
+            self._messages[(username, MAIN_THREAD)] = {}
+        self.save_turns(username, history_to_turns(chat_history, timestamps), len(chat_history))
+
+    def list_threads(self, username):
+        with self._lock:
+            return {tid: dict(entry) for tid, entry in self._threads.get(username, {}).items()}
+
+    def put_thread(self, username, thread_id, fields):
+        with self._lock:
+            entry = self._threads.setdefault(username, {}).setdefault(thread_id, {})
+            entry.update((k, v) for k, v in fields.items() if k in THREAD_INDEX_FIELDS)
+
+    def get_archive_manifest(self, username, thread_id=None):
+        with self._lock:
+            segments = self._archives.get((username, thread_id or MAIN_THREAD), {})
+            return [dict(segments[start][0]) for start in sorted(segments)]
+
+    def get_archive_segment(self, username, thread_id, start):
+        with self._lock:
+            stored = self._archives.get((username, thread_id or MAIN_THREAD), {}).get(start)
+            return stored[1] if stored else None
+
+    def put_archive_segment(self, username, thread_id, segment, blob):
+        thread_id = thread_id or MAIN_THREAD
+        with self._lock:
+            self._archives.setdefault((username, thread_id), {})[segment["start"]] = (dict(segment), blob)
+            messages = self._messages.get((username, thread_id), {})
+            for message_id in range(segment["start"], segment["end"]):
+                messages.pop(message_id, None)
+
+    def delete_archive_segment(self, username, thread_id, start):
+        with self._lock:
+            self._archives.get((username, thread_id or MAIN_THREAD), {}).pop(start, None)
+
+    def get_search_postings(self, username, terms):
+        with self._lock:
+            index = self._search_postings.get(username, {})
+            return [
+                [term, thread_id, message_id, tf, length]
+                for term in terms
+                for (thread_id, message_id), (tf, length) in index.get(term, {}).items()
+            ]
+
+    def get_search_docs(self, username, thread_id, message_ids):
+        with self._lock:
+            entries = self._search_docs.get((username, thread_id), {})
+            return {i: dict(entries[i]) for i in message_ids if i in entries}
+
+    def update_search_index(self, username, thread_id, postings, docs):
+        with self._lock:
+            index = self._search_postings.setdefault(username, {})
+            for term, message_id, tf, length in postings:
+                if tf:
+                    index.setdefault(term, {})[(thread_id, message_id)] = (tf, length)
+                else:
+                    index.get(term, {}).pop((thread_id, message_id), None)
+            entries = self._search_docs.setdefault((username, thread_id), {})
+            for message_id, entry in docs:
+                if entry is None:
+                    entries.pop(message_id, None)
+                else:
+                    entries[message_id] = dict(entry)
+
+    def get_summary(self, username, thread_id=None):
+        with self._lock:
+            summary = self._summaries.get((username, thread_id or MAIN_THREAD))
+            return dict(summary) if summary else None
+
+    def put_summary(self, username, thread_id, summary):
+        with self._lock:
+            if summary is None:
+                self._summaries.pop((username, thread_id or MAIN_THREAD), None)
+            else:
+                self._summaries[(username, thread_id or MAIN_THREAD)] = dict(summary)
+
+    def delete_thread(self, username, thread_id):
+        if is_main_thread(thread_id):
+            raise ValueError("The main thread cannot be deleted")
+        with self._lock:
+            self._drop_thread(username, thread_id)
+            self._threads.get(username, {}).pop(thread_id, None)
+            for postings in self._search_postings.get(username, {}).values():
+                for key in [key for key in postings if key[0] == thread_id]:
+                    del postings[key]
+
+    def delete_user(self, username):
+        with self._lock:
+            for thread_id in set(self._threads.get(username, {})) | {MAIN_THREAD}:
+                self._drop_thread(username, thread_id)
+            self._users.pop(username, None)
+            self._threads.pop(username, None)
+            self._search_postings.pop(username, None)
+
+    def _drop_thread(self, username, thread_id):
+        for store in (self._messages, self._archives, self._search_docs, self._summaries):
+            store.pop((username, thread_id), None)
+
+class WriteJournal:
+    """Append-only log of writes that went to the fallback backend.
+
+    Each line is {"op", "username", "args"}; the file survives restarts so
+    writes made during an outage are replayed even after a redeploy.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conflicts_path = f"{os.path.splitext(path)[0]}.conflicts.jsonl"
+        self._lock = threading.Lock()
+        self._pending_users = {entry["username"] for entry in self._read()}
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'r') as f:
+            # A torn last line (crash mid-append) is dropped
+            lines = [line for line in f if line.endswith("\n")]
+        return [json.loads(line) for line in lines]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._read())
+
+    def has_pending(self, username):
+        with self._lock:
+            return username in self._pending_users
+
+    def append(self, op, username, args):
+        line = json.dumps({"op": op, "username": username, "args": list(args)}) + "\n"
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, 'a') as f:
+                f.write(line)
+            self._pending_users.add(username)
+
+    def snapshot(self):
+        """All journaled writes, oldest first"""
+        with self._lock:
+            return self._read()
+
+    def set_aside(self, entries):
+        """Keep writes that must not be replayed in a conflicts file for review"""
+        if not entries:
+            return
+        with self._lock:
+            with open(self.conflicts_path, 'a') as f:
+                f.writelines(json.dumps(entry) + "\n" for entry in entries)
+
+    def discard(self, count):
+        """Drop the first `count` entries once they have been replayed"""
+        with self._lock:
+            remaining = self._read()[count:]
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.writelines(json.dumps(entry) + "\n" for entry in remaining)
+            os.replace(tmp_path, self.path)
+            self._pending_users = {entry["username"] for entry in remaining}
+
+class FailoverBackend(StorageBackend):
+    """Primary backend guarded by a circuit breaker, with a fallback for outages.
+
+    Reads and writes go to the fallback while the breaker is open. Writes that
+    land on the fallback are journaled and replayed into the primary once the
+    breaker closes; until a user's journal entries are replayed, that user's
+    writes keep going through the journal so they are applied in order.
+    Profiles are never created in the fallback: it cannot tell whether a
+    username is taken, and replaying the profile would overwrite the owner's.
+    """
+
+    def __init__(self, primary, fallback, breaker, journal):
+        self.primary = primary
+        self.fallback = fallback
+        self.breaker = breaker
+        self.journal = journal
+        self.name = primary.name
+        self._reconcile_lock = threading.Lock()
+        self._reconciler_lock = threading.Lock()
+        self._reconciler = None
+        self._reconcile_requested = False
+        self.breaker.on_close = self.reconcile_async
+        if len(self.journal):
+            self.reconcile_async()
+
+    def _call_primary(self, method, *args):
+        """(True, result) if the primary handled the call, (False, None) otherwise"""
+        if not self.breaker.allow():
+            return False, None
+        try:
+            result = getattr(self.primary, method)(*args)
+        except Exception as e:
+            print(f"⚠️ {self.primary.name} {method} failed: {e}. Using {self.fallback.name} storage.")
+            self.breaker.record_failure()
+            return False, None
+        self.breaker.record_success()
+        return True, result
+
+    def _read(self, method, *args):
+        handled, result = self._call_primary(method, *args)
+        return result if handled else getattr(self.fallback, method)(*args)
+
+    def _write(self, method, username, *args):
+        if not self.journal.has_pending(username):
+            handled, _ = self._call_primary(method, username, *args)
+            if handled:
+                return
+        getattr(self.fallback, method)(username, *args)
+        self.journal.append(method, username, args)
+        if self.breaker.state == CLOSED:
+            # The primary is healthy; this user is only waiting on older journal entries
+            self.reconcile_async()
+
+    def get_user(self, username):
+        return self._read("get_user", username)
+
+    def get_user_fields(self, username, fields):
+        return self._read("get_user_fields", username, fields)
+
+    def list_users(self, after=None, limit=500):
+        return self._read("list_users", after, limit)
+
+    def migrate_user(self, username):
+        handled, result = self._call_primary("migrate_user", username)
+        if not handled:
+            raise RuntimeError(f"{self.primary.name} storage is unavailable")
+        return result
+
+    def get_page(self, username, before=None, limit=None, thread_id=None):
+        return self._read("get_page", username, before, limit, thread_id)
+
+    def list_threads(self, username):
+        return self._read("list_threads", username)
+
+    def put_thread(self, username, thread_id, fields):
+        self._write("put_thread", username, thread_id, fields)
+
+    def get_archive_manifest(self, username, thread_id=None):
+        return self._read("get_archive_manifest", username, thread_id)
+
+    def get_archive_segment(self, username, thread_id, start):
+        return self._read("get_archive_segment", username, thread_id, start)
+
+    def _primary_write(self, method, username, *args):
+        # Archiving and deletes only ever run against the primary: segments are binary
+        # and not journaled, and the fallback may not hold the data being changed
+        if self.journal.has_pending(username):
+            raise RuntimeError(f"{username} has writes waiting to be replayed")
+        handled, _ = self._call_primary(method, username, *args)
+        if not handled:
+            raise RuntimeError(f"{self.primary.name} storage is unavailable")
+
+    def get_summary(self, username, thread_id=None):
+        return self._read("get_summary", username, thread_id)
+
+    def put_summary(self, username, thread_id, summary):
+        self._write("put_summary", username, thread_id, summary)
+
+    def get_search_postings(self, username, terms):
+        return self._read("get_search_postings", username, terms)
+
+    def get_search_docs(self, username, thread_id, message_ids):
+        return self._read("get_search_docs", username, thread_id, message_ids)
+
+    def update_search_index(self, username, thread_id, postings, docs):
+        self._write("update_search_index", username, thread_id, postings, docs)
+
+    def put_archive_segment(self, username, thread_id, segment, blob):
+        self._primary_write("put_archive_segment", username, thread_id, segment, blob)
+
+    def delete_archive_segment(self, username, thread_id, start):
+        self._primary_write("delete_archive_segment", username, thread_id, start)
+
+    def delete_thread(self, username, thread_id):
+        if is_main_thread(thread_id):
+            # Checked here so a caller error does not count as a primary failure
+            raise ValueError("The main thread cannot be deleted")
+        self._primary_write("delete_thread", username, thread_id)
+        self._delete_from_fallback("delete_thread", username, thread_id)
+
+    def delete_user(self, username):
+        self._primary_write("delete_user", username)
+        self._delete_from_fallback("delete_user", username)
+
+    def _delete_from_fallback(self, method, username, *args):
+        # Writes replayed after an outage leave copies behind in the fallback
+        try:
+            getattr(self.fallback, method)(username, *args)
+        except Exception as e:
+            print(f"⚠️ Could not {method.replace('_', ' ')} {username} in {self.fallback.name} storage: {e}")
+
+    def put_user(self, username, profile):
+        self._primary_write("put_user", username, profile)
+
+    def update_user(self, username, fields):
+        self._write("update_user", username, fields)
+
+    def save_turns(self, username, turns, message_count, previous_count=0, thread_id=None):
+        self._write("save_turns", username, turns, message_count, previous_count, thread_id)
+
+    def replace_history(self, username, chat_history, timestamps=None):
+        self._write("replace_history", username, chat_history, timestamps)
+
+    def reconcile(self):
+        """Replay journaled writes into the primary; returns how many were applied"""
+        applied = 0
+        conflicted = set()
+        with self._reconcile_lock:
+            while True:
+                entries = self.journal.snapshot()
+                if not entries:
+                    break
+                done = 0
+                try:
+                    for entry in entries:
+                        if self._conflicts(entry, conflicted):
+                            self.journal.set_aside([entry])
+                        else:
+                            getattr(self.primary, entry["op"])(entry["username"], *entry["args"])
+                        done += 1
+                except Exception as e:
+                    print(f"⚠️ Reconciliation stopped after {applied + done} write(s): {e}")
+                    self.breaker.record_failure()
+                    self.journal.discard(done)
+                    return applied + done
+                self.journal.discard(done)
+                applied += done
+        if applied:
+            print(f"🔄 Replayed {applied} write(s) from {self.fallback.name} storage into {self.primary.name}")
+        return applied
+
+    def _conflicts(self, entry, conflicted):
+        # Profiles journaled by older versions are replayed create-only: an existing
+        # user in the primary belongs to someone else, and so do that name's later writes
+        username = entry["username"]
+        if username not in conflicted and entry["op"] == "put_user" \
+                and self.primary.get_user_fields(username, []) is not None:
+            print(f"⚠️ {username} already exists in {self.primary.name}; "
+                  f"setting its journaled writes aside in {self.journal.conflicts_path}")
+            conflicted.add(username)
+        return username in conflicted
+
+    def reconcile_async(self):
+        """Run reconcile() on a background thread, once more if one is already running"""
+        with self._reconciler_lock:
+            self._reconcile_requested = True
+            if self._reconciler is None:
+                self._reconciler = threading.Thread(target=self._reconcile_loop, name="storage-reconcile", daemon=True)
+                self._reconciler.start()
+
+    def _reconcile_loop(self):
+        while True:
+            with self._reconciler_lock:
+                if not self._reconcile_requested:
+                    self._reconciler = None
+                    return
+                self._reconcile_requested = False
+            self.reconcile()
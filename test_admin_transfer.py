@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Test script to verify bulk export/import skips broken users and finishes its own indexing
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import STORAGE_CONFIG
+from storage_backends import InMemoryBackend, LocalBackend
+from sqlite_store import SQLiteStore
+from firebase_utils import set_storage_backend
+from admin_transfer import export_all, import_all, import_user, migrate_user
+from search_index import search_history
+
+class BrokenUserBackend(InMemoryBackend):
+    """In-memory backend that cannot read one user's profile"""
+
+    broken = "bob"
+
+    def get_user(self, username):
+        if username == self.broken:
+            raise ConnectionError("service unavailable")
+        return super().get_user(username)
+
+def _turns(count):
+    return [{"message_id": i, "user_message": f"question {i} about bread", "bot_reply": f"a{i}"} for i in range(count)]
+
+def test_export_and_import():
+    print("🧪 Testing bulk export and import...")
+    source = BrokenUserBackend()
+    for username in ("alice", "bob", "carol"):
+        source.put_user(username, {"display_name": username.title()})
+    source.save_turns("alice", _turns(30), 30)
+    source.save_turns("carol", _turns(2), 2, thread_id="work")
+
+    previous = set_storage_backend(source)
+    settings = {key: STORAGE_CONFIG[key] for key in ("ARCHIVE_ENABLED", "ARCHIVE_HOT_WINDOW", "ARCHIVE_SEGMENT_TURNS", "SEARCH_ENABLED")}
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for fmt in ("ndjson", "parquet"):
+                path = os.path.join(tmp, f"backup.{fmt}")
+                # One unreadable user is reported, not fatal to the export
+                users, turns, failed = export_all(path, fmt, workers=2, page_size=2, chunk_turns=7)
+                assert (users, turns, failed) == (2, 32, ["bob"])
+
+                STORAGE_CONFIG.update(ARCHIVE_ENABLED=True, ARCHIVE_HOT_WINDOW=5, ARCHIVE_SEGMENT_TURNS=8, SEARCH_ENABLED=True)
+                target = InMemoryBackend()
+                set_storage_backend(target)
+                assert import_all(path, fmt, workers=2) == (2, 32, 0)
+                # Indexed and archived before import_all returned
+                assert [s["start"] for s in target.get_archive_manifest("alice", None)] == [0, 8, 16]
+                assert len(search_history(target, "alice", "bread", total_turns=30)) > 0
+                assert target.get_user("carol")["display_name"] == "Carol"
+                assert [t["message_id"] for t in target.get_page("carol", thread_id="work")] == [0, 1]
+                STORAGE_CONFIG.update(settings)
+                set_storage_backend(source)
+    finally:
+        STORAGE_CONFIG.update(settings)
+        set_storage_backend(previous)
+    print("✅ Export/import test successful!")
+
+def test_import_replaces_existing_thread():
+    print("🧪 Testing import over an existing user...")
+    target = InMemoryBackend()
+    target.put_user("alice", {"password": "secret"})
+    target.save_turns("alice", [{"message_id": i, "user_message": f"cheese {i}", "bot_reply": "b"} for i in range(40)], 40)
+    records = [{"record_type": "user", "username": "alice", "data": {"password": "secret"}}] + [
+        {"record_type": "turn", "username": "alice", "thread_id": "main", **turn} for turn in _turns(30)
+    ]
+
+    previous = set_storage_backend(target)
+    search = STORAGE_CONFIG['SEARCH_ENABLED']
+    STORAGE_CONFIG['SEARCH_ENABLED'] = True
+    try:
+        assert import_user(target, "alice", records) == 30
+        # No stored turn or search hit survives past the imported ones
+        assert [t["message_id"] for t in target.get_page("alice", limit=100)] == list(range(30))
+        assert target.list_threads("alice")["main"]["message_count"] == 30
+        assert search_history(target, "alice", "cheese", total_turns=30) == []
+
+        # Without a profile record the target's profile is left alone
+        try:
+            import_user(target, "alice", records[1:])
+            assert False, "imported a user without a profile record"
+        except RuntimeError:
+            pass
+        assert target.get_user("alice")["password"] == "secret"
+    finally:
+        STORAGE_CONFIG['SEARCH_ENABLED'] = search
+        set_storage_backend(previous)
+    print("✅ Import replacement test successful!")
+
+def test_migrate_indexes_legacy_import():
+    print("🧪 Testing migration indexes legacy files imported on an earlier read...")
+    search = STORAGE_CONFIG['SEARCH_ENABLED']
+    STORAGE_CONFIG['SEARCH_ENABLED'] = True
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, "dave.json"), "w") as f:
+                json.dump({"password": "secret", "chat_history": [["bread recipe?", "flour and water"], ["thanks", "welcome"]]}, f)
+            backend = LocalBackend(SQLiteStore(os.path.join(tmp, "chatbot.db")), 50, legacy_dir=tmp)
+            # A login reads the user first, which imports the file without indexing it
+            assert backend.get_user("dave")["password"] == "secret"
+            assert search_history(backend, "dave", "bread", total_turns=2) == []
+            assert migrate_user(backend, "dave", chunk_turns=1) == "migrated"
+            assert [hit["message_id"] for hit in search_history(backend, "dave", "bread", total_turns=2)] == [0]
+            assert migrate_user(backend, "dave", chunk_turns=1) == "current"
+    finally:
+        STORAGE_CONFIG['SEARCH_ENABLED'] = search
+    print("✅ Legacy migration test successful!")
+
+if __name__ == "__main__":
+    test_export_and_import()
+    test_import_replaces_existing_thread()
+    test_migrate_indexes_legacy_import()
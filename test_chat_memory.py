@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the prompt history stays within each model's token budget
+"""
+
+import os
+import sys
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import LLM_CONFIG
+from chat_memory import history_budget, history_messages, count_tokens, MESSAGE_OVERHEAD_TOKENS
+
+class SessionState(dict):
+    """Dict with attribute access, like st.session_state"""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+def _session(turns, offset=0):
+    state = SessionState()
+    state.chat_history = [(f"question {i} " * 10, f"answer {i} " * 10) for i in range(offset, offset + turns)]
+    state.chat_history_offset = offset
+    return state
+
+def _turn_cost(state, index, model):
+    user_msg, bot_reply = state.chat_history[index]
+    return count_tokens(user_msg, model) + count_tokens(bot_reply, model) + 2 * MESSAGE_OVERHEAD_TOKENS
+
+def test_budget():
+    print("🧪 Testing history token budgets...")
+    settings = dict(LLM_CONFIG)
+    try:
+        LLM_CONFIG.update(HISTORY_MAX_TOKENS=100000, HISTORY_CONTEXT_SHARE=0.5)
+        # The budget follows each model's context window
+        assert history_budget("gpt-4") == 4096
+        assert history_budget("gpt-4-turbo-preview") == 64000
+        assert history_budget("unknown-model") == 4096
+        LLM_CONFIG.update(HISTORY_MAX_TOKENS=400)
+        assert history_budget("gpt-4-turbo-preview") == 400
+
+        for model in ("gpt-4", "gemini-pro"):
+            state = _session(40, offset=100)
+            messages = history_messages(state, model, upto=40, question="next question")
+            kept = len(messages) // 2
+            assert 0 < kept < 40
+            # The newest turns are kept, oldest first, and the next older one would not fit
+            assert messages[-2:] == [("human", state.chat_history[39][0]), ("ai", state.chat_history[39][1])]
+            assert messages[0] == ("human", state.chat_history[40 - kept][0])
+            budget = history_budget(model) - count_tokens("next question", model)
+            used = sum(_turn_cost(state, i, model) for i in range(40 - kept, 40))
+            assert used <= budget < used + _turn_cost(state, 39 - kept, model)
+
+            # Turns a summary covers are left out
+            summary = {"text": "Earlier questions.", "until": 138}
+            messages = history_messages(state, model, upto=40, summary=summary)
+            assert len(messages) == 4 and messages[0][1] == state.chat_history[38][0]
+    finally:
+        LLM_CONFIG.clear()
+        LLM_CONFIG.update(settings)
+    print("✅ Budget test successful!")
+
+def test_edited_turn_is_recounted():
+    print("🧪 Testing token count cache invalidation...")
+    settings = dict(LLM_CONFIG)
+    try:
+        LLM_CONFIG.update(HISTORY_MAX_TOKENS=400, HISTORY_CONTEXT_SHARE=0.5)
+        state = _session(10)
+        before = len(history_messages(state, "gpt-4", upto=10)) // 2
+        assert state.chat_token_counts[9][3] == _turn_cost(state, 9, "gpt-4")
+
+        # A long edit of the newest turn is recounted, not served from the cache
+        state.chat_history[9] = ("edited " * 400, "reply")
+        assert history_messages(state, "gpt-4", upto=10) == []
+        assert state.chat_token_counts[9][1] == "edited " * 400
+        assert state.chat_token_counts[9][3] == _turn_cost(state, 9, "gpt-4")
+
+        state.chat_history[9] = ("short", "reply")
+        assert len(history_messages(state, "gpt-4", upto=10)) // 2 >= before
+    finally:
+        LLM_CONFIG.clear()
+        LLM_CONFIG.update(settings)
+    print("✅ Cache invalidation test successful!")
+
+if __name__ == "__main__":
+    test_budget()
+    test_edited_turn_is_recounted()
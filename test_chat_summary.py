@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Test script to verify rolling summaries are dropped on truncation and never regress
+"""
+
+import os
+import sys
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from langchain_core.runnables import RunnableLambda
+from config import LLM_CONFIG
+from storage_backends import InMemoryBackend
+from firebase_utils import set_storage_backend, get_chat_summary, save_chat_summary, save_chat_turns
+import chat_summary
+from chat_summary import pending_range, update_summary, schedule_summary, _thread_lock
+
+SETTINGS = {"SUMMARY_KEEP_TURNS": 2, "SUMMARY_TRIGGER_TURNS": 3, "SUMMARY_BATCH_TURNS": 4}
+
+def _fake_llm(during_call=None):
+    """Stand-in for get_llm whose model answers with the prompt size"""
+    def respond(prompt):
+        if during_call:
+            during_call()
+        return f"summary of {len(prompt.to_string())} chars"
+    return lambda provider, model, api_key: RunnableLambda(respond)
+
+def _setup(turns):
+    backend = InMemoryBackend(page_size=50)
+    set_storage_backend(backend)
+    save_chat_turns("alice", [
+        {"message_id": i, "user_message": f"q{i}", "bot_reply": f"a{i}"} for i in range(turns)
+    ], turns)
+    return backend
+
+def _run(test):
+    previous = set_storage_backend(InMemoryBackend())
+    settings = {key: LLM_CONFIG[key] for key in SETTINGS}
+    get_llm = chat_summary.get_llm
+    LLM_CONFIG.update(SETTINGS)
+    try:
+        test()
+    finally:
+        chat_summary.get_llm = get_llm
+        LLM_CONFIG.update(settings)
+        set_storage_backend(previous)
+
+def test_pending_range():
+    print("🧪 Testing which turns are due for summarizing...")
+    def check():
+        assert pending_range(None, 4) is None
+        assert pending_range(None, 5) == (0, 3)
+        # Catch up a batch at a time
+        assert pending_range(None, 20) == (0, 4)
+        assert pending_range({"until": 4}, 20) == (4, 8)
+        assert pending_range({"until": 16}, 20) is None
+    _run(check)
+    print("✅ Pending range test successful!")
+
+def test_summary_dropped_on_truncation():
+    print("🧪 Testing summary drop on truncation...")
+    def check():
+        backend = _setup(10)
+        chat_summary.get_llm = _fake_llm()
+        summary = update_summary("alice", None, 10, "openai", "sk-test")
+        assert summary["until"] == 4 and get_chat_summary("alice") == summary
+        assert backend.get_summary("alice")["until"] == 4
+
+        # Appending keeps the summary; cutting turns (Clear Chat, edits) drops it
+        assert save_chat_turns("alice", [{"message_id": 10, "user_message": "q", "bot_reply": "a"}], 11, 10)
+        assert get_chat_summary("alice") == summary
+        assert save_chat_turns("alice", [], 3, 11)
+        assert get_chat_summary("alice") is None and backend.get_summary("alice") is None
+    _run(check)
+    print("✅ Truncation test successful!")
+
+def test_concurrent_job_does_not_regress():
+    print("🧪 Testing that a slower job never overwrites a newer summary...")
+    def check():
+        backend = _setup(20)
+        newer = {"text": "Newer summary.", "until": 16, "model": "other", "updated_at": "later"}
+        # Another process saves a newer summary while this job waits on its model
+        chat_summary.get_llm = _fake_llm(lambda: backend.put_summary("alice", None, newer))
+        assert get_chat_summary("alice") is None
+        assert update_summary("alice", None, 20, "openai", "sk-test") is None
+        assert backend.get_summary("alice") == newer
+        assert get_chat_summary("alice") == newer
+
+        # A truncation that drops the summary mid-job wins as well
+        save_chat_summary("alice", None, {"text": "Old.", "until": 4, "model": "m", "updated_at": "earlier"})
+        chat_summary.get_llm = _fake_llm(lambda: save_chat_turns("alice", [], 5, 20))
+        assert update_summary("alice", None, 20, "openai", "sk-test") is None
+        assert get_chat_summary("alice") is None
+
+        # One job per thread at a time in this process
+        lock = _thread_lock("alice", None)
+        with lock:
+            assert not schedule_summary("alice", None, 20, "openai", "sk-test")
+    _run(check)
+    print("✅ Concurrency test successful!")
+
+if __name__ == "__main__":
+    test_pending_range()
+    test_summary_dropped_on_truncation()
+    test_concurrent_job_does_not_regress()
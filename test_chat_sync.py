@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Test script to verify incremental chat sync against an in-memory backend
+"""
+
+import os
+import sys
+import tempfile
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import STORAGE_CONFIG
+from storage_backends import InMemoryBackend, LocalBackend
+from sqlite_store import SQLiteStore
+from jsonl_store import JSONLStore
+from history_archive import archive_cold_turns
+from firebase_utils import set_storage_backend
+import write_behind
+from write_behind import WriteBehindQueue, get_write_queue
+from chat_sync import (
+    ensure_sync_state, load_latest_history, load_older_history, has_older_history, open_thread,
+    add_turn, set_turn, clear_turns, sync_chat_history, has_failed_writes, has_unsynced_changes
+)
+
+class SessionState(dict):
+    """Dict with attribute access, like st.session_state"""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+class PagingBackend(InMemoryBackend):
+    """In-memory backend whose older pages fail or come back empty"""
+
+    older_pages = "ok"
+
+    def get_page(self, username, before=None, limit=None, thread_id=None):
+        if before is not None and self.older_pages == "error":
+            raise ConnectionError("service unavailable")
+        if before is not None and self.older_pages == "empty":
+            return []
+        return super().get_page(username, before, limit, thread_id)
+
+class RecordingBackend(InMemoryBackend):
+    """In-memory backend that records the turn ids of every save"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.saves = []
+
+    def save_turns(self, username, turns, message_count, previous_count=0, thread_id=None):
+        self.saves.append(([t["message_id"] for t in turns], message_count, previous_count))
+        return super().save_turns(username, turns, message_count, previous_count, thread_id)
+
+class OutageBackend(InMemoryBackend):
+    """In-memory backend whose saves fail while down is set"""
+
+    down = False
+
+    def save_turns(self, *args, **kwargs):
+        if self.down:
+            raise ConnectionError("service unavailable")
+        return super().save_turns(*args, **kwargs)
+
+def _stored_ids(backend, username):
+    return [t["message_id"] for t in backend.get_page(username, limit=1000)]
+
+def _synced_session(backend, username, stored):
+    backend.save_turns(username, [
+        {"message_id": i, "user_message": f"q{i}", "bot_reply": f"a{i}"} for i in range(stored)
+    ], stored)
+    state = SessionState()
+    ensure_sync_state(state)
+    load_latest_history(state, username, stored)
+    return state
+
+def test_paging_past_stored_start():
+    print("🧪 Testing older-history paging against failing and empty pages...")
+    previous = set_storage_backend(PagingBackend(page_size=50))
+    write_behind = STORAGE_CONFIG['WRITE_BEHIND_ENABLED']
+    STORAGE_CONFIG['WRITE_BEHIND_ENABLED'] = False
+    try:
+        for mode in ("error", "empty"):
+            backend = PagingBackend(page_size=50)
+            set_storage_backend(backend)
+            state = _synced_session(backend, "alice", 60)
+            assert state.chat_history_offset == 10 and has_older_history(state)
+
+            backend.older_pages = mode
+            assert load_older_history(state, "alice") == 0
+            assert state.chat_history_offset == 10
+            # A storage error can be retried; an empty page means nothing older is left
+            assert has_older_history(state) == (mode == "error")
+
+            index = add_turn(state, "new")
+            set_turn(state, index, "new", "reply")
+            assert sync_chat_history(state, "alice")
+            backend.older_pages = "ok"
+            assert _stored_ids(backend, "alice") == list(range(61))
+            assert backend.get_page("alice", before=11, limit=1)[0]["user_message"] == "q10"
+    finally:
+        STORAGE_CONFIG['WRITE_BEHIND_ENABLED'] = write_behind
+        set_storage_backend(previous)
+    print("✅ Paging test successful!")
+
+def test_cursor_pagination():
+    print("🧪 Testing newest-first paging with a message_id cursor...")
+    settings = {key: STORAGE_CONFIG[key] for key in ("HISTORY_PAGE_SIZE", "ARCHIVE_ENABLED")}
+    STORAGE_CONFIG.update(HISTORY_PAGE_SIZE=50, ARCHIVE_ENABLED=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = [
+            InMemoryBackend(page_size=50),
+            LocalBackend(SQLiteStore(os.path.join(tmp, "chatbot.db")), 50, legacy_dir=tmp),
+            LocalBackend(JSONLStore(os.path.join(tmp, "logs")), 50, legacy_dir=tmp),
+        ]
+        previous = set_storage_backend(backends[0])
+        try:
+            for backend in backends:
+                set_storage_backend(backend)
+                state = _synced_session(backend, "alice", 120)
+                backend.save_turns("alice", [{"message_id": 0, "user_message": "w0", "bot_reply": "x"}], 1, thread_id="work")
+                # The oldest turns come from archive segments, the rest from hot storage
+                archive_cold_turns(backend, "alice", None, 120, hot_window=30, segment_turns=40)
+
+                assert state.chat_history_offset == 70 and len(state.chat_history) == 50
+                assert [load_older_history(state, "alice") for _ in range(3)] == [50, 20, 0]
+                assert state.chat_history_offset == 0 and not has_older_history(state)
+                assert [user_msg for user_msg, _ in state.chat_history] == [f"q{i}" for i in range(120)]
+                assert len(state.chat_timestamps) == 120
+
+                # Another thread pages on its own
+                open_thread(state, "alice", "work", 1)
+                assert state.chat_history == [("w0", "x")] and not has_older_history(state)
+        finally:
+            STORAGE_CONFIG.update(settings)
+            set_storage_backend(previous)
+    print("✅ Pagination test successful!")
+
+def test_only_unsaved_turns_are_written():
+    print("🧪 Testing that a sync writes only new and edited turns...")
+    backend = RecordingBackend(page_size=50)
+    previous = set_storage_backend(backend)
+    write_behind = STORAGE_CONFIG['WRITE_BEHIND_ENABLED']
+    STORAGE_CONFIG['WRITE_BEHIND_ENABLED'] = False
+    try:
+        backend.put_user("alice", {"display_name": "Alice"})
+        state = _synced_session(backend, "alice", 3)
+        backend.saves = []
+        assert not has_unsynced_changes(state) and sync_chat_history(state, "alice")
+        assert backend.saves == []
+
+        # New turns only; an edited stored turn is rewritten on its own
+        index = add_turn(state, "q3")
+        set_turn(state, index, "q3", "a3")
+        assert sync_chat_history(state, "alice")
+        set_turn(state, 1, "q1", "edited")
+        assert sync_chat_history(state, "alice")
+        assert backend.saves == [([3], 4, 3), ([1], 4, 4)]
+
+        # Each turn is its own record; the profile carries no inline history
+        stored = backend.get_page("alice", limit=10)
+        assert [t["bot_reply"] for t in stored] == ["a0", "edited", "a2", "a3"]
+        assert all(set(t) >= {"message_id", "user_message", "bot_reply", "timestamp"} for t in stored)
+        profile = backend.get_user("alice")
+        assert profile["message_count"] == 4 and "chat_history" not in profile
+
+        # Clear Chat then a new turn: that slot is rewritten and the rest trimmed
+        clear_turns(state)
+        index = add_turn(state, "fresh")
+        set_turn(state, index, "fresh", "start")
+        assert sync_chat_history(state, "alice")
+        assert backend.saves[-1] == ([0], 1, 4)
+        assert [t["user_message"] for t in backend.get_page("alice", limit=10)] == ["fresh"]
+    finally:
+        STORAGE_CONFIG['WRITE_BEHIND_ENABLED'] = write_behind
+        set_storage_backend(previous)
+    print("✅ Incremental sync test successful!")
+
+def test_failed_write_behind_is_resent():
+    print("🧪 Testing that turns of a given-up write-behind save are not lost...")
+    backend = OutageBackend(page_size=50)
+    previous = set_storage_backend(backend)
+    previous_queue = write_behind._queue
+    write_behind._queue = WriteBehindQueue(write_behind.save_chat_turns, max_retries=1, retry_delay=0.01)
+    write_behind_enabled = STORAGE_CONFIG['WRITE_BEHIND_ENABLED']
+    STORAGE_CONFIG['WRITE_BEHIND_ENABLED'] = True
+    try:
+        state = _synced_session(backend, "alice", 60)
+        backend.down = True
+        for text in ("one", "two"):
+            index = add_turn(state, text)
+            set_turn(state, index, text, "reply")
+            assert sync_chat_history(state, "alice", wait=True) is False
+
+        # The watermark goes back to what storage holds, so the turns count as unsynced
+        assert has_failed_writes(state, "alice")
+        assert state.chat_persisted_count == 60 and has_unsynced_changes(state)
+
+        backend.down = False
+        assert sync_chat_history(state, "alice", wait=True)
+        assert not has_failed_writes(state, "alice")
+        assert state.chat_persisted_count == 62
+        assert _stored_ids(backend, "alice") == list(range(62))
+        get_write_queue().shutdown()
+    finally:
+        STORAGE_CONFIG['WRITE_BEHIND_ENABLED'] = write_behind_enabled
+        write_behind._queue = previous_queue
+        set_storage_backend(previous)
+    print("✅ Write-behind failure test successful!")
+
+if __name__ == "__main__":
+    test_paging_past_stored_start()
+    test_cursor_pagination()
+    test_only_unsaved_turns_are_written()
+    test_failed_write_behind_is_resent()
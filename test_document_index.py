@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Test script to verify document chunking, ranking and the prompt budget for uploads
+"""
+
+import io
+import os
+import sys
+import zipfile
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import LLM_CONFIG
+from chat_memory import count_tokens
+from document_index import (
+    WORD_NS, chunk_text, extract_text, DocumentIndex, build_document_index, document_budget, document_messages
+)
+
+class Upload:
+    """Stand-in for a Streamlit UploadedFile"""
+
+    def __init__(self, name, data):
+        self.name = name
+        self.size = len(data)
+        self._data = data
+
+    def getvalue(self):
+        return self._data
+
+def _docx(*paragraphs):
+    ns = WORD_NS.strip("{}")
+    body = "".join(f"<w:p><w:r><w:t>{text}</w:t><w:tab/><w:t>end</w:t></w:r></w:p>" for text in paragraphs)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("word/document.xml", f'<w:document xmlns:w="{ns}"><w:body>{body}</w:body></w:document>')
+    return buffer.getvalue()
+
+def test_chunking():
+    print("🧪 Testing document chunking...")
+    words = [f"w{i}" for i in range(25)]
+    chunks = chunk_text(" ".join(words), chunk_words=10, overlap_words=3)
+    # Each chunk starts 3 words before the previous one ended; the last one reaches the end
+    assert [chunk.split()[0] for chunk in chunks] == ["w0", "w7", "w14", "w21"]
+    assert chunks[0].split()[-3:] == chunks[1].split()[:3]
+    assert chunks[-1].split() == words[21:]
+    assert chunk_text(" ".join(words[:10]), 10, 3) == [" ".join(words[:10])]
+    assert chunk_text("", 10, 3) == [] and chunk_text("   \n ", 10, 3) == []
+    # An overlap as large as the chunk still moves forward
+    assert len(chunk_text(" ".join(words), 5, 5)) == 21
+    print("✅ Chunking test successful!")
+
+def test_extraction():
+    print("🧪 Testing text extraction...")
+    assert extract_text("notes.TXT", "﻿hello\nworld".encode()) == "hello\nworld"
+    assert extract_text("readme.md", b"# Title") == "# Title"
+    assert extract_text("report.docx", _docx("First part", "Second")) == "First part end\nSecond end"
+
+    files = [
+        Upload("empty.txt", b""),
+        Upload("notes.txt", b"sourdough starter feeding schedule"),
+        Upload("broken.docx", b"not a zip file"),
+        Upload("scan.pdf", b"%PDF-1.4 not really"),
+        Upload("image.png", b"\x89PNG"),
+    ]
+    index = build_document_index(files)
+    # Unreadable or unsupported files are reported, not indexed; an empty one just adds nothing
+    assert index.failed == ["broken.docx", "scan.pdf", "image.png"]
+    assert len(index) == 1 and index.chunks[0][0] == "notes.txt"
+    print("✅ Extraction test successful!")
+
+def test_ranking():
+    print("🧪 Testing BM25 ranking of chunks...")
+    index = DocumentIndex()
+    index.add_document("bread.txt", "Sourdough bread needs a lively starter. Bake the bread with steam.")
+    index.add_document("python.txt", "A Python decorator wraps a function in another function.")
+    index.add_document("mixed.txt", "Python scripts can time a bread bake.")
+    results = index.search("how to bake bread")
+    assert [r[0] for r in results] == ["bread.txt", "mixed.txt"]
+    assert results[0][3] > results[1][3] > 0
+    assert index.search("python decorator", limit=1)[0][0] == "python.txt"
+    assert index.search("the and of") == [] and DocumentIndex().search("bread") == []
+    print("✅ Ranking test successful!")
+
+def test_prompt_budget():
+    print("🧪 Testing the document prompt budget...")
+    settings = {key: LLM_CONFIG[key] for key in ("RAG_MAX_TOKENS", "RAG_CONTEXT_SHARE", "RAG_TOP_K")}
+    try:
+        LLM_CONFIG.update(RAG_MAX_TOKENS=100000, RAG_CONTEXT_SHARE=0.25, RAG_TOP_K=4)
+        assert document_budget("gpt-4") == 2048 and document_budget("gpt-4-turbo-preview") == 32000
+
+        index = DocumentIndex()
+        index.add_document("long.txt", " ".join(["bread"] + ["crumb"] * 400), chunk_words=500)
+        index.add_document("short.txt", "bread rises overnight", chunk_words=500)
+        LLM_CONFIG.update(RAG_MAX_TOKENS=200)
+        # The long chunk ranks but does not fit; the shorter one still goes in
+        messages = document_messages(index, "bread", "gpt-4")
+        assert len(messages) == 1 and messages[0][0] == "system"
+        assert "[short.txt, part 1]" in messages[0][1] and "long.txt" not in messages[0][1]
+        # Only the short header line is outside the excerpt budget
+        assert count_tokens(messages[0][1], "gpt-4") <= 200 + 20
+
+        LLM_CONFIG.update(RAG_MAX_TOKENS=5)
+        assert document_messages(index, "bread", "gpt-4") == []
+        assert document_messages(index, "unrelated words", "gpt-4") == []
+    finally:
+        LLM_CONFIG.update(settings)
+    print("✅ Prompt budget test successful!")
+
+if __name__ == "__main__":
+    test_chunking()
+    test_extraction()
+    test_ranking()
+    test_prompt_budget()
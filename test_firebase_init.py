@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Test script to verify Firebase is initialized once per process and readiness is reported
+"""
+
+import os
+import sys
+import threading
+import types
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import firebase_utils
+from health_check import check_firebase_connection
+
+STATE = ("db", "firebase_initialized", "_firebase_retry_at", "_readiness_probe", "_firebase_readiness",
+         "_firebase_ready_event", "firebase_admin", "credentials", "firestore", "get_firebase_credentials")
+
+class FakeDocument:
+    def __init__(self, probe):
+        self.probe = probe
+
+    def get(self, timeout=None):
+        self.probe["started"].set()
+        self.probe["release"].wait(5)
+        if self.probe["error"]:
+            raise ConnectionError(self.probe["error"])
+
+def _install_fakes(cred_data, probe_error=None, init_error=None):
+    """Reset the module's init state and stand in for firebase_admin; returns call counts and the probe"""
+    calls = {"credentials": 0, "certificates": [], "initialize_app": 0}
+    probe = {"started": threading.Event(), "release": threading.Event(), "error": probe_error}
+
+    def get_credentials():
+        calls["credentials"] += 1
+        return cred_data
+
+    def certificate(data):
+        calls["certificates"].append(data)
+        return object()
+
+    def initialize_app(cred):
+        calls["initialize_app"] += 1
+        if init_error and calls["initialize_app"] == 1:
+            raise ConnectionError(init_error)
+
+    fake_db = types.SimpleNamespace(collection=lambda name: types.SimpleNamespace(document=lambda doc_id: FakeDocument(probe)))
+    firebase_utils.db = None
+    firebase_utils.firebase_initialized = False
+    firebase_utils._firebase_retry_at = 0.0
+    firebase_utils._readiness_probe = None
+    firebase_utils._firebase_readiness = None
+    firebase_utils._firebase_ready_event = threading.Event()
+    firebase_utils.get_firebase_credentials = get_credentials
+    firebase_utils.credentials = types.SimpleNamespace(Certificate=certificate)
+    firebase_utils.firebase_admin = types.SimpleNamespace(_apps={}, initialize_app=initialize_app)
+    firebase_utils.firestore = types.SimpleNamespace(client=lambda: fake_db)
+    return calls, probe
+
+def _run(test):
+    saved = {name: getattr(firebase_utils, name) for name in STATE}
+    try:
+        test()
+    finally:
+        for name, value in saved.items():
+            setattr(firebase_utils, name, value)
+
+def test_initialized_once():
+    print("🧪 Testing one Firebase initialization across threads...")
+    def check():
+        cred_data = {"project_id": "demo", "private_key": "key"}
+        calls, probe = _install_fakes(cred_data)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(firebase_utils.initialize_firebase())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == [True] * 8
+        # Credentials are read and the app created once, from the in-memory dict
+        assert calls["credentials"] == 1 and calls["initialize_app"] == 1
+        assert calls["certificates"] == [cred_data]
+
+        # The readiness probe runs in the background and is reported when done
+        assert probe["started"].wait(5)
+        assert firebase_utils.firebase_readiness() == (None, "Firebase connection test still running")
+        probe["release"].set()
+        assert firebase_utils.firebase_readiness(timeout=5) == (True, "Firebase connection successful")
+        assert check_firebase_connection() == (True, "Firebase connection successful")
+    _run(check)
+    print("✅ Initialization test successful!")
+
+def test_readiness_failures():
+    print("🧪 Testing readiness when Firebase is unavailable...")
+    def check():
+        calls, probe = _install_fakes(None)
+        assert firebase_utils.initialize_firebase() is False
+        # Missing credentials are not retried
+        assert firebase_utils.initialize_firebase() is False and calls["credentials"] == 1
+        assert firebase_utils.firebase_readiness() == (False, "Firebase is not initialized")
+        assert check_firebase_connection() == (False, "Firebase connection failed")
+
+        calls, probe = _install_fakes({"project_id": "demo"}, probe_error="deadline exceeded")
+        probe["release"].set()
+        assert firebase_utils.initialize_firebase()
+        ready, message = firebase_utils.firebase_readiness(timeout=5)
+        assert ready is False and "deadline exceeded" in message
+        assert check_firebase_connection() == (False, message)
+
+        # A failed initialization is retried once the backoff has passed, not on every call
+        calls, probe = _install_fakes({"project_id": "demo"}, init_error="name resolution failed")
+        probe["release"].set()
+        assert firebase_utils.initialize_firebase() is False
+        assert firebase_utils.initialize_firebase() is False and calls["initialize_app"] == 1
+        firebase_utils._firebase_retry_at = 0.0
+        assert firebase_utils.initialize_firebase() and calls["initialize_app"] == 2
+        assert firebase_utils.firebase_readiness(timeout=5) == (True, "Firebase connection successful")
+    _run(check)
+    print("✅ Readiness failure test successful!")
+
+if __name__ == "__main__":
+    test_initialized_once()
+    test_readiness_failures()
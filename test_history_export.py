@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Test script to verify chat exports in every format round-trip the stored turns
+"""
+
+import io
+import json
+import os
+import sys
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import orjson
+import pyarrow.parquet as pq
+from config import STORAGE_CONFIG
+from storage_backends import InMemoryBackend
+from firebase_utils import set_storage_backend
+from history_archive import archive_cold_turns
+from history_export import EXPORT_FORMATS, iter_history_pages, export_history, write_export, TURN_FIELDS
+
+class FlakyBackend(InMemoryBackend):
+    """In-memory backend whose page reads fail for one cursor"""
+
+    failing_before = None
+
+    def get_page(self, username, before=None, limit=None, thread_id=None):
+        if before == self.failing_before:
+            raise ConnectionError("service unavailable")
+        return super().get_page(username, before, limit, thread_id)
+
+def _turns(count):
+    # Quotes, newlines and non-ASCII text must survive every format
+    return [
+        {"message_id": i, "user_message": f'q{i} "quoted"\nnext line', "bot_reply": f"a{i} ✅ café", "timestamp": f"2024-01-01T00:00:{i:02d}"}
+        for i in range(count)
+    ]
+
+def _read(fmt, data):
+    if fmt == "ndjson":
+        return [orjson.loads(line) for line in data.splitlines()]
+    if fmt == "json":
+        return json.loads(data)
+    return pq.read_table(io.BytesIO(data)).to_pylist()
+
+def test_formats():
+    print("🧪 Testing export formats...")
+    turns = _turns(7)
+    pages = [turns[:3], turns[3:6], turns[6:]]
+    for fmt in ("ndjson", "json", "parquet"):
+        with export_history(fmt, iter(pages)) as out:
+            assert _read(fmt, out.read()) == [{f: t[f] for f in TURN_FIELDS} for t in turns], fmt
+        # An empty history is still a valid file
+        with export_history(fmt, iter([])) as out:
+            assert _read(fmt, out.read()) == [], fmt
+    with export_history("text", iter(pages)) as out:
+        text = out.read().decode()
+    assert text.startswith('User: q0 "quoted"\nnext line\nBot: a0 ✅ café\n\nUser: q1') and text.count("User: ") == 7
+    assert set(EXPORT_FORMATS) == {"ndjson", "json", "parquet", "text"}
+    try:
+        write_export("xml", iter(pages), io.BytesIO())
+        assert False, "unknown format accepted"
+    except ValueError:
+        pass
+    print("✅ Format test successful!")
+
+def test_streamed_from_storage():
+    print("🧪 Testing exports streamed from storage...")
+    backend = InMemoryBackend(page_size=50)
+    previous = set_storage_backend(backend)
+    archive = STORAGE_CONFIG['ARCHIVE_ENABLED']
+    STORAGE_CONFIG['ARCHIVE_ENABLED'] = True
+    try:
+        backend.save_turns("alice", _turns(25), 25, thread_id="work")
+        archive_cold_turns(backend, "alice", "work", 25, hot_window=5, segment_turns=8)
+        pages = list(iter_history_pages("alice", "work", 25, chunk_turns=10))
+        # Chunks in order, archived turns included
+        assert [len(page) for page in pages] == [10, 10, 5]
+        assert [t["message_id"] for page in pages for t in page] == list(range(25))
+        with export_history("parquet", iter_history_pages("alice", "work", 25, chunk_turns=10)) as out:
+            table = pq.read_table(io.BytesIO(out.read()))
+        assert table.num_rows == 25 and table.column("message_id").to_pylist() == list(range(25))
+        assert list(iter_history_pages("alice", "missing", 0)) == []
+
+        # A failed read aborts the export instead of leaving a chunk out
+        flaky = FlakyBackend(page_size=50)
+        set_storage_backend(flaky)
+        flaky.save_turns("alice", _turns(25), 25)
+        flaky.failing_before = 20
+        try:
+            export_history("ndjson", iter_history_pages("alice", None, 25, chunk_turns=10))
+            assert False, "export with a failed read completed"
+        except ConnectionError:
+            pass
+    finally:
+        STORAGE_CONFIG['ARCHIVE_ENABLED'] = archive
+        set_storage_backend(previous)
+    print("✅ Streaming export test successful!")
+
+if __name__ == "__main__":
+    test_formats()
+    test_streamed_from_storage()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the exact-match response cache keys, expiry and disk tier
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import response_cache
+from response_cache import ResponseCache, normalize_question, context_fingerprint, cache_key
+
+def test_keys():
+    print("🧪 Testing response cache keys...")
+    assert normalize_question("  What IS   Python?? ") == "what is python"
+    assert normalize_question("ｗｈａｔ\tis python.") == "what is python"
+    assert cache_key("What is Python?", "gpt-4", "helpful") == cache_key("what is python", "gpt-4", "helpful")
+
+    # A different model, personality or prompt context must miss
+    key = cache_key("What is Python?", "gpt-4", "helpful")
+    assert key != cache_key("What is Python?", "gpt-3.5-turbo", "helpful")
+    assert key != cache_key("What is Python?", "gpt-4", "creative")
+    history = [("human", "I mean the snake"), ("ai", "Noted.")]
+    assert context_fingerprint([], []) is None
+    assert context_fingerprint(history) == context_fingerprint(history[:1], history[1:])
+    assert context_fingerprint(history) != context_fingerprint([("human", "I mean the language"), ("ai", "Noted.")])
+    assert key != cache_key("What is Python?", "gpt-4", "helpful", context_fingerprint(history))
+    print("✅ Key test successful!")
+
+def test_ttl():
+    print("🧪 Testing response cache expiry...")
+    with tempfile.TemporaryDirectory() as tmp:
+        for path in (None, os.path.join(tmp, "cache.db")):
+            cache = ResponseCache(path=path, ttl=0.05)
+            cache.put("k", "reply")
+            assert cache.get("k") == "reply"
+            time.sleep(0.06)
+            assert cache.get("k") is None
+    print("✅ Expiry test successful!")
+
+def test_disk_tier():
+    print("🧪 Testing response cache persistence and pruning...")
+    prune_every = response_cache.PRUNE_EVERY_PUTS
+    response_cache.PRUNE_EVERY_PUTS = 5
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cache", "responses.db")
+            cache = ResponseCache(path=path, max_entries=2, disk_max_entries=3)
+            cache.put("a", "reply a")
+            # A new process (empty memory tier) still finds it on disk
+            restarted = ResponseCache(path=path, max_entries=2, disk_max_entries=3)
+            assert restarted.get("a") == "reply a"
+            assert restarted.get("missing") is None
+
+            # The fifth put prunes the disk down to the most recently used rows
+            for key in ("b", "c", "d"):
+                cache.put(key, f"reply {key}")
+                time.sleep(0.01)
+            # A disk hit marks the row as recently used
+            assert ResponseCache(path=path).get("a") == "reply a"
+            cache.put("e", "reply e")
+            rows = sqlite3.connect(path).execute("SELECT key FROM responses ORDER BY key").fetchall()
+            assert [row[0] for row in rows] == ["a", "d", "e"]
+    finally:
+        response_cache.PRUNE_EVERY_PUTS = prune_every
+    print("✅ Disk tier test successful!")
+
+if __name__ == "__main__":
+    test_keys()
+    test_ttl()
+    test_disk_tier()
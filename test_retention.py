@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Test script to verify which users and threads the retention rules reclaim
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import STORAGE_CONFIG
+from storage_backends import InMemoryBackend
+from firebase_utils import set_storage_backend, get_chat_summary, save_chat_summary
+from retention import is_demo_account, last_activity, apply_retention
+from search_index import index_turns, search_history
+
+def test_demo_accounts():
+    print("🧪 Testing demo account detection...")
+    assert is_demo_account("anyone", {"demo_account": True})
+    assert is_demo_account("github_user_0a1b2c3d", {"oauth_user": True})
+    # Generated-looking names only count for OAuth demo profiles
+    assert not is_demo_account("github_user_0a1b2c3d", {})
+    assert not is_demo_account("github_user_alice", {"oauth_user": True})
+    assert not is_demo_account("google_user_0A1B2C3D", {"oauth_user": True})
+    print("✅ Demo account test successful!")
+
+def test_last_activity():
+    print("🧪 Testing last activity...")
+    profile = {"created_at": "2024-01-01T00:00:00", "last_login": "2024-03-01 12:00:00", "last_updated": "garbage"}
+    threads = {"work": {"created_at": "2024-02-01T00:00:00"}, "main": {"last_updated": "2024-04-01T00:00:00+00:00"}}
+    assert last_activity(profile, {}) == datetime(2024, 3, 1, 12)
+    # A timezone-aware time counts too, converted to local time
+    assert last_activity(profile, threads) > datetime(2024, 3, 30)
+    assert last_activity({}, {}) is None
+    print("✅ Last activity test successful!")
+
+def test_cutoffs():
+    print("🧪 Testing retention cutoffs...")
+    backend = InMemoryBackend(page_size=50)
+    previous = set_storage_backend(backend)
+    search = STORAGE_CONFIG['SEARCH_ENABLED']
+    STORAGE_CONFIG['SEARCH_ENABLED'] = True
+    try:
+        created = (datetime.now() - timedelta(days=10)).isoformat()
+        backend.put_user("google_user_0a1b2c3d", {"oauth_user": True, "created_at": created})
+        backend.put_user("demo_recent", {"demo_account": True, "created_at": datetime.now().isoformat()})
+        backend.put_user("dave", {"password": "secret", "created_at": created})
+        turns = [{"message_id": i, "user_message": f"idea {i}", "bot_reply": "noted"} for i in range(3)]
+        backend.save_turns("dave", turns, 3)
+        index_turns(backend, "dave", None, turns, 3)
+        save_chat_summary("dave", None, {"text": "Ideas.", "until": 2})
+        assert get_chat_summary("dave")["text"] == "Ideas."
+
+        # Nothing is idle long enough yet
+        report = apply_retention(backend, demo_user_days=30, thread_days=30, batch_pause=0)
+        assert report["users_deleted"] == report["threads_cleared"] == 0
+
+        # Ten days on: the old demo account goes, the recent one and the real user stay
+        now = datetime.now() + timedelta(days=10)
+        report = apply_retention(backend, demo_user_days=15, thread_days=5, batch_size=2, batch_pause=0, now=now)
+        assert report["users_scanned"] == 3 and report["users_deleted"] == 1
+        assert backend.get_user("google_user_0a1b2c3d") is None and backend.get_user("demo_recent") is not None
+
+        # The idle main conversation is cleared like Clear Chat, cached summary included
+        assert report["threads_cleared"] == 1 and report["turns_reclaimed"] == 3
+        assert backend.get_page("dave") == []
+        assert search_history(backend, "dave", "idea", total_turns=3) == []
+        assert get_chat_summary("dave") is None
+        assert backend.get_user("dave")["password"] == "secret"
+    finally:
+        STORAGE_CONFIG['SEARCH_ENABLED'] = search
+        set_storage_backend(previous)
+    print("✅ Cutoff test successful!")
+
+if __name__ == "__main__":
+    test_demo_accounts()
+    test_last_activity()
+    test_cutoffs()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the similarity cache only serves questions that mean the same
+"""
+
+import os
+import sys
+import time
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from semantic_cache import SemanticCache, HashingEmbedder, parse_thresholds, question_signature
+
+# Close in wording, different in meaning
+NEAR_MISSES = [
+    ("Which plans cost more than $20 a month?", "Which plans cost fewer than $20 a month?"),
+    ("How do I install the app on Windows?", "How do I install the app on macOS?"),
+    ("Should I retire next year?", "Should I retire in 30 years?"),
+    ("Can I delete my account?", "Can I not delete my account?"),
+    ("What is the capital of France?", "What is the capital of Spain?"),
+]
+
+def test_near_misses_are_not_served():
+    print("🧪 Testing similarity cache near misses...")
+    # Even a lax threshold must not serve a question that means something else
+    for threshold in (0.93, 0.5):
+        cache = SemanticCache(HashingEmbedder(1024), capacity=16, threshold=threshold)
+        for cached, asked in NEAR_MISSES:
+            cache.put(cached, "gpt-4", "helpful", f"answer to {cached}")
+            reply, _ = cache.get(asked, "gpt-4", "helpful")
+            assert reply is None, f"{asked!r} was served the reply to {cached!r}"
+    print("✅ Near-miss test successful!")
+
+def test_rewordings_are_served():
+    print("🧪 Testing similarity cache hits and scoping...")
+    cache = SemanticCache(HashingEmbedder(1024), capacity=16, thresholds=parse_thresholds("creative=0.99"))
+    cache.put("How can I reset my password?", "gpt-4", "helpful", "Use the login page.", user="alice")
+    reply, similarity = cache.get("how can I reset my password", "gpt-4", "helpful", user="alice")
+    assert reply == "Use the login page." and similarity > 0.99
+
+    # Another user, model, personality or context never shares the entry
+    assert cache.get("How can I reset my password?", "gpt-4", "helpful", user="bob")[0] is None
+    assert cache.get("How can I reset my password?", "gpt-3.5-turbo", "helpful", user="alice")[0] is None
+    assert cache.get("How can I reset my password?", "gpt-4", "creative", user="alice")[0] is None
+    assert cache.get("How can I reset my password?", "gpt-4", "helpful", "ctx", user="alice")[0] is None
+    assert question_signature("Is 5 more than 3?") == (frozenset({"5", "3"}), frozenset({"more"}), frozenset())
+    print("✅ Similarity cache test successful!")
+
+def test_eviction():
+    print("🧪 Testing similarity cache eviction...")
+    cache = SemanticCache(HashingEmbedder(256), capacity=2, ttl=3600)
+    cache.put("first question", "m", "p", "1")
+    cache.put("second question", "m", "p", "2")
+    assert cache.get("first question", "m", "p")[0] == "1"
+    # Full: the least recently used entry ("second") makes room
+    cache.put("third question", "m", "p", "3")
+    assert len(cache) == 2
+    assert cache.get("second question", "m", "p")[0] is None
+    assert cache.get("first question", "m", "p")[0] == "1"
+
+    cache.ttl = 0.01
+    time.sleep(0.02)
+    assert cache.get("first question", "m", "p")[0] is None
+    cache.put("fourth question", "m", "p", "4")
+    assert len(cache) == 1
+    print("✅ Eviction test successful!")
+
+if __name__ == "__main__":
+    test_near_misses_are_not_served()
+    test_rewordings_are_served()
+    test_eviction()
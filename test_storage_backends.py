@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the storage backends honour the same contract
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from firebase_admin import firestore
+from storage_backends import (
+    InMemoryBackend, LocalBackend, FailoverBackend, FirestoreBackend, WriteJournal, SEARCH_POSTINGS_BUCKETS
+)
+from circuit_breaker import CircuitBreaker, OPEN
+from cache_utils import TTLCache
+from config import STORAGE_CONFIG
+from sqlite_store import SQLiteStore
+from jsonl_store import JSONLStore
+import history_archive
+from history_archive import archive_cold_turns, read_archived_turns, truncate_archive, schedule_archive
+from search_index import index_turns, search_history
+from retention import apply_retention
+from firebase_utils import get_user_fields, set_storage_backend
+
+def check_backend(backend):
+    backend.put_user("alice", {"password": "secret", "chat_history": [("ignored", "ignored")]})
+    user = backend.get_user("alice")
+    assert user["password"] == "secret"
+    assert user["message_count"] == 0
+    assert "chat_history" not in user
+
+    backend.replace_history("alice", [(f"q{i}", f"a{i}") for i in range(5)])
+    assert backend.get_user("alice")["message_count"] == 5
+    assert [t["message_id"] for t in backend.get_page("alice", limit=2)] == [3, 4]
+    assert [t["message_id"] for t in backend.get_page("alice", before=3, limit=2)] == [1, 2]
+
+    # Edit one turn and truncate the rest, as a sync after Clear Chat would
+    backend.save_turns("alice", [{"message_id": 0, "user_message": "new", "bot_reply": "reply"}], 1, 5)
+    page = backend.get_page("alice")
+    assert [(t["user_message"], t["bot_reply"]) for t in page] == [("new", "reply")]
+    assert page[0]["timestamp"]
+
+    assert backend.get_user_fields("alice", ["password", "missing"]) == {"password": "secret"}
+    assert backend.get_user_fields("alice", []) == {}
+    backend.update_user("alice", {"last_login": "today"})
+    user = backend.get_user("alice")
+    assert user["password"] == "secret" and user["last_login"] == "today"
+    assert user["message_count"] == 1
+
+    # A second thread keeps its own turns and index entry
+    backend.put_thread("alice", "work", {"title": "Work", "model": "gpt-4"})
+    backend.save_turns("alice", [{"message_id": 0, "user_message": "plan", "bot_reply": "ok"}], 1, thread_id="work")
+    threads = backend.list_threads("alice")
+    assert threads["work"]["title"] == "Work" and threads["work"]["message_count"] == 1
+    assert threads["main"]["message_count"] == 1
+    assert [t["user_message"] for t in backend.get_page("alice", thread_id="work")] == ["plan"]
+    assert [t["user_message"] for t in backend.get_page("alice")] == ["new"]
+    assert backend.get_user("alice")["message_count"] == 1
+
+    assert backend.get_user("nobody") is None
+    assert backend.get_user_fields("nobody", ["password"]) is None
+    assert backend.get_page("nobody") == []
+
+def check_archive(backend):
+    turns = [{"message_id": i, "user_message": f"q{i}", "bot_reply": f"a{i}"} for i in range(25)]
+    backend.save_turns("bob", turns, 25, thread_id="long")
+
+    # Keep the newest 5 hot, archive the rest in segments of 8
+    assert archive_cold_turns(backend, "bob", "long", 25, hot_window=5, segment_turns=8) == 16
+    assert [s["start"] for s in backend.get_archive_manifest("bob", "long")] == [0, 8]
+    assert [t["message_id"] for t in backend.get_page("bob", limit=50, thread_id="long")] == list(range(16, 25))
+    archived = read_archived_turns(backend, "bob", "long", before=16, limit=10)
+    assert [t["message_id"] for t in archived] == list(range(6, 16))
+    assert archived[0]["user_message"] == "q6" and archived[0]["timestamp"]
+
+    # Truncating into the archive restores the survivors of the straddling segment
+    backend.save_turns("bob", [{"message_id": 3, "user_message": "new", "bot_reply": "reply"}], 4, 25, thread_id="long")
+    truncate_archive(backend, "bob", "long", 4, rewritten_ids=[3])
+    assert backend.get_archive_manifest("bob", "long") == []
+    page = backend.get_page("bob", thread_id="long")
+    assert [t["user_message"] for t in page] == ["q0", "q1", "q2", "new"]
+
+def check_search(backend):
+    turns = [
+        {"message_id": 0, "user_message": "How do I bake sourdough bread?", "bot_reply": "Feed the starter first."},
+        {"message_id": 1, "user_message": "What is a Python decorator?", "bot_reply": "A function wrapping a function."},
+        {"message_id": 2, "user_message": "More about bread crust", "bot_reply": "Bake with steam for a crisp bread crust."},
+    ]
+    index_turns(backend, "carol", None, turns, 3)
+    index_turns(backend, "carol", "work", [{"message_id": 0, "user_message": "python tests", "bot_reply": "use pytest"}], 1)
+    results = search_history(backend, "carol", "bread", total_turns=4)
+    assert [(r["thread_id"], r["message_id"]) for r in results] == [("main", 2), ("main", 0)]
+    assert results[0]["user_message"] == "More about bread crust"
+    assert {r["thread_id"] for r in search_history(backend, "carol", "Python", total_turns=4)} == {"main", "work"}
+
+    # Rewriting and truncating turns drops their old postings
+    index_turns(backend, "carol", None, [{"message_id": 0, "user_message": "hello", "bot_reply": "hi"}], 1, 3)
+    assert search_history(backend, "carol", "bread", total_turns=2) == []
+    assert [r["message_id"] for r in search_history(backend, "carol", "hello", total_turns=2)] == [0]
+    assert search_history(backend, "carol", "the", total_turns=2) == []
+
+    # Ranking follows term frequency; an edit moves a turn, new turns become searchable
+    index_turns(backend, "carol", None, [
+        {"message_id": 1, "user_message": "tea", "bot_reply": "green tea"},
+        {"message_id": 2, "user_message": "tea tea tea", "bot_reply": "so much tea"},
+    ], 3, 1)
+    assert [r["message_id"] for r in search_history(backend, "carol", "tea", total_turns=3)] == [2, 1]
+    index_turns(backend, "carol", None, [{"message_id": 2, "user_message": "coffee", "bot_reply": "black"}], 3, 3)
+    assert [r["message_id"] for r in search_history(backend, "carol", "tea", total_turns=3)] == [1]
+    assert [r["user_message"] for r in search_history(backend, "carol", "coffee", total_turns=3)] == ["coffee"]
+
+def check_summary(backend):
+    backend.save_turns("erin", [{"message_id": 0, "user_message": "hi", "bot_reply": "hello"}], 1, thread_id="work")
+    assert backend.get_summary("erin", "work") is None
+    backend.put_summary("erin", "work", {"text": "Greetings.", "until": 1})
+    backend.put_summary("erin", None, {"text": "Main.", "until": 3})
+    assert backend.get_summary("erin", "work")["text"] == "Greetings."
+    assert backend.get_summary("erin")["until"] == 3
+
+    backend.put_summary("erin", None, None)
+    assert backend.get_summary("erin") is None
+    backend.delete_thread("erin", "work")
+    assert backend.get_summary("erin", "work") is None
+
+def check_retention(backend):
+    backend.put_user("google_user_0a1b2c3d", {"oauth_user": True, "created_at": "2020-01-01 00:00:00"})
+    backend.put_user("dave", {"password": "secret", "created_at": "2020-01-01 00:00:00"})
+    backend.save_turns("dave", [{"message_id": 0, "user_message": "old", "bot_reply": "idea"}], 1, thread_id="old")
+    index_turns(backend, "dave", "old", [{"message_id": 0, "user_message": "old", "bot_reply": "idea"}], 1)
+
+    report = apply_retention(backend, demo_user_days=7, dry_run=True)
+    assert report["users_deleted"] == 1 and backend.get_user("google_user_0a1b2c3d") is not None
+
+    report = apply_retention(backend, demo_user_days=7, thread_days=36500, batch_pause=0)
+    assert report["users_deleted"] == 1 and report["threads_deleted"] == 0
+    assert backend.get_user("google_user_0a1b2c3d") is None
+    assert "google_user_0a1b2c3d" not in backend.list_users()
+
+    backend.delete_thread("dave", "old")
+    assert "old" not in backend.list_threads("dave")
+    assert backend.get_page("dave", thread_id="old") == []
+    assert search_history(backend, "dave", "idea", total_turns=1) == []
+    assert backend.get_user("dave")["password"] == "secret"
+
+def test_storage_backends():
+    print("🧪 Testing storage backends...")
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = [
+            InMemoryBackend(page_size=50),
+            LocalBackend(SQLiteStore(os.path.join(tmp, "chatbot.db")), 50, legacy_dir=tmp),
+            LocalBackend(JSONLStore(os.path.join(tmp, "logs")), 50, legacy_dir=tmp),
+        ]
+        for backend in backends:
+            print(f"   Checking {backend.name} backend ({type(backend).__name__})")
+            check_backend(backend)
+            check_archive(backend)
+            check_search(backend)
+            check_summary(backend)
+            check_retention(backend)
+    print("✅ Storage backend test successful!")
+
+class FakeFirestore:
+    """Just enough of a Firestore client for these tests, counting document reads and writes"""
+
+    def __init__(self):
+        self.docs = {}
+        self.versions = {}
+        self.reads = 0
+        self.writes = 0
+        self.field_masks = []
+
+    def collection(self, name):
+        return FakeRef(self, (name,))
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def get_all(self, refs, timeout=None):
+        return [ref.get() for ref in refs]
+
+    def write(self, path, data, merge=False):
+        self.writes += 1
+        self.versions[path] = self.versions.get(path, 0) + 1
+        if data is None:
+            self.docs.pop(path, None)
+        elif merge:
+            _merge(self.docs.setdefault(path, {}), data)
+        else:
+            self.docs[path] = json.loads(json.dumps(data))
+
+class FakeRef:
+    def __init__(self, db, path):
+        self.db, self.path = db, path
+
+    def collection(self, name):
+        return FakeRef(self.db, self.path + (name,))
+
+    def document(self, doc_id):
+        return FakeRef(self.db, self.path + (doc_id,))
+
+    def get(self, field_paths=None, timeout=None):
+        self.db.reads += 1
+        data = self.db.docs.get(self.path)
+        if field_paths is not None:
+            self.db.field_masks.append(list(field_paths))
+            if data is not None:
+                data = {k: v for k, v in data.items() if k in field_paths}
+        return FakeSnapshot(self, data, self.db.versions.get(self.path))
+
+    def set(self, data, merge=False, timeout=None):
+        self.db.write(self.path, data, merge)
+
+    def delete(self, timeout=None):
+        self.db.write(self.path, None)
+
+    def where(self, field, op, values):
+        assert op == "in"
+        docs = [(path, data) for path, data in self.db.docs.items()
+                if path[:-1] == self.path and data.get(field) in values]
+        return FakeQuery(self.db, docs)
+
+class FakeQuery:
+    def __init__(self, db, docs):
+        self.db, self.docs = db, docs
+
+    def select(self, field_paths):
+        return self
+
+    def stream(self, timeout=None):
+        self.db.reads += len(self.docs)
+        return [FakeSnapshot(FakeRef(self.db, path), data, self.db.versions.get(path)) for path, data in self.docs]
+
+class FakeSnapshot:
+    def __init__(self, ref, data, update_time=None):
+        self.reference, self.exists, self._data, self.update_time = ref, data is not None, data, update_time
+
+    def to_dict(self):
+        return json.loads(json.dumps(self._data))
+
+def _merge(target, data):
+    for key, value in data.items():
+        if value is firestore.DELETE_FIELD:
+            target.pop(key, None)
+        elif isinstance(value, dict):
+            _merge(target.setdefault(key, {}), value)
+        else:
+            target[key] = value
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db, self.ops = db, []
+
+    def set(self, ref, data, merge=False):
+        self.ops.append((ref, data, merge))
+
+    def delete(self, ref):
+        self.ops.append((ref, None, False))
+
+    def commit(self, timeout=None):
+        for ref, data, merge in self.ops:
+            self.db.write(ref.path, data, merge)
+
+def test_firestore_search_buckets():
+    print("🧪 Testing Firestore search postings...")
+    db = FakeFirestore()
+    backend = FirestoreBackend(db, cache=None, page_size=50)
+    check_search(backend)
+
+    # A turn with many terms writes one posting document per bucket, not one per term
+    db.writes = 0
+    words = " ".join(f"word{i}" for i in range(200))
+    index_turns(backend, "frank", None, [{"message_id": 0, "user_message": words, "bot_reply": ""}], 1)
+    assert db.writes <= SEARCH_POSTINGS_BUCKETS + 1
+    assert [r["message_id"] for r in search_history(backend, "frank", "word7 word150", total_turns=1)] == [0]
+    print("✅ Firestore search test successful!")
+
+def test_firestore_user_cache():
+    print("🧪 Testing the Firestore user cache and field masks...")
+    db = FakeFirestore()
+    cache = TTLCache(max_entries=2, ttl=60)
+    backend = FirestoreBackend(db, cache, page_size=50)
+    backend.put_user("alice", {"display_name": "Alice", "password": "secret"})
+
+    # One read, then fresh hits (including field lookups) cost nothing
+    reads = db.reads
+    assert backend.get_user("alice")["display_name"] == "Alice"
+    assert backend.get_user("alice")["message_count"] == 0
+    assert backend.get_user_fields("alice", ["display_name", "missing"]) == {"display_name": "Alice"}
+    assert db.reads == reads + 1
+
+    # A stale entry whose update_time still matches is kept, recent turns included
+    cache.update("alice", lambda entry: dict(entry, recent=[]))
+    cache.ttl = 0
+    assert backend.get_user("alice")["display_name"] == "Alice"
+    assert db.reads == reads + 2 and cache.lookup("alice")[0]["recent"] == []
+
+    # A write from another process changes update_time, so the new document is used
+    db.write(("users", "alice"), {"display_name": "Alicia"}, merge=True)
+    assert backend.get_user("alice")["display_name"] == "Alicia"
+    assert cache.lookup("alice")[0]["recent"] is None
+
+    # Without a fresh entry only the masked fields are fetched
+    cache.invalidate("alice")
+    assert backend.get_user_fields("alice", ["display_name"]) == {"display_name": "Alicia"}
+    assert db.field_masks[-1] == ["display_name"]
+    assert backend.get_user_fields("nobody", ["display_name"]) is None
+
+    # Writes through the backend invalidate; the LRU keeps at most max_entries users
+    cache.ttl = 60
+    backend.get_user("alice")
+    backend.update_user("alice", {"display_name": "Al"})
+    assert cache.lookup("alice")[0] is None and backend.get_user("alice")["display_name"] == "Al"
+    for username in ("bob", "carol"):
+        backend.put_user(username, {})
+        backend.get_user(username)
+    assert cache.lookup("alice")[0] is None and len(cache) == 2
+    print("✅ User cache test successful!")
+
+class UnreachableBackend(InMemoryBackend):
+    """In-memory backend that can be switched off to simulate an outage"""
+
+    name = "unreachable"
+    down = False
+
+    def __getattribute__(self, name):
+        if name in ("get_user", "get_user_fields", "put_user", "save_turns", "replace_history", "get_page") and object.__getattribute__(self, "down"):
+            raise ConnectionError("service unavailable")
+        return object.__getattribute__(self, name)
+
+def test_failover_reconciliation():
+    print("🧪 Testing circuit breaker failover and reconciliation...")
+    with tempfile.TemporaryDirectory() as tmp:
+        primary = UnreachableBackend()
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=3600)
+        backend = FailoverBackend(primary, InMemoryBackend(), breaker, WriteJournal(os.path.join(tmp, "journal.jsonl")))
+
+        backend.put_user("alice", {"password": "secret"})
+        primary.down = True
+        backend.save_turns("alice", [{"message_id": 0, "user_message": "hi", "bot_reply": "hello"}], 1)
+        assert breaker.state == OPEN
+        assert backend.journal.has_pending("alice")
+        assert [t["user_message"] for t in backend.get_page("alice")] == ["hi"]
+
+        primary.down = False
+        assert backend.reconcile() == 1
+        assert not backend.journal.has_pending("alice")
+        assert [t["user_message"] for t in primary.get_page("alice")] == ["hi"]
+        assert primary.get_user("alice")["password"] == "secret"
+
+        # The fallback cannot see that "bob" is taken, so no profile is created during an outage
+        primary.put_user("bob", {"password": "bobs"})
+        primary.down = True
+        breaker.record_failure()
+        try:
+            backend.put_user("bob", {"password": "intruder"})
+            assert False, "put_user succeeded while the primary was down"
+        except RuntimeError:
+            pass
+        assert not backend.journal.has_pending("bob")
+
+        # Profiles journaled by older versions are replayed create-only
+        primary.down = False
+        backend.journal.append("put_user", "bob", [{"password": "intruder"}])
+        backend.journal.append("update_user", "bob", [{"display_name": "Intruder"}])
+        backend.journal.append("put_user", "carol", [{"password": "carols"}])
+        assert backend.reconcile() == 3
+        assert primary.get_user("bob") == {"password": "bobs", "message_count": 0}
+        assert primary.get_user("carol")["password"] == "carols"
+        with open(backend.journal.conflicts_path) as f:
+            assert [json.loads(line)["op"] for line in f] == ["put_user", "update_user"]
+    print("✅ Failover test successful!")
+
+def test_archive_segment_size():
+    print("🧪 Testing archive segments stay under the size limit...")
+    backend = InMemoryBackend()
+    # Random text barely compresses, so each turn costs about 1 KB of blob
+    turns = [{"message_id": i, "user_message": os.urandom(500).hex(), "bot_reply": "b"} for i in range(40)]
+    backend.save_turns("bob", turns, 40)
+    assert archive_cold_turns(backend, "bob", None, 40, hot_window=8, segment_turns=16, max_bytes=6000) == 24
+    manifest = backend.get_archive_manifest("bob", None)
+    assert len(manifest) > 2 and all(s["bytes"] <= 6000 for s in manifest)
+    assert [s["end"] for s in manifest[:-1]] == [s["start"] for s in manifest[1:]]
+    assert [t["message_id"] for t in read_archived_turns(backend, "bob", None, before=24, limit=24)] == list(range(24))
+
+    # A turn too large for any segment stops archival, and the job is not restarted on every save
+    huge = {"message_id": 40, "user_message": os.urandom(8000).hex(), "bot_reply": "b"}
+    backend.save_turns("carol", [dict(t) for t in turns] + [huge], 41)
+    backend.save_turns("carol", [dict(t, message_id=41 + i) for i, t in enumerate(turns)], 81, 41)
+    max_bytes = STORAGE_CONFIG['ARCHIVE_SEGMENT_MAX_BYTES']
+    STORAGE_CONFIG['ARCHIVE_SEGMENT_MAX_BYTES'] = 6000
+    try:
+        assert schedule_archive(backend, "carol", None, 81, hot_window=8, segment_turns=16)
+        # The job holds the thread lock until it is done
+        with history_archive._thread_lock("carol", None):
+            pass
+        assert history_archive.archived_until(backend.get_archive_manifest("carol", None)) == 40
+        assert not schedule_archive(backend, "carol", None, 82, hot_window=8, segment_turns=16)
+        history_archive.forget_archive_state("carol", None)
+        assert schedule_archive(backend, "carol", None, 82, hot_window=8, segment_turns=16)
+        with history_archive._thread_lock("carol", None):
+            pass
+    finally:
+        STORAGE_CONFIG['ARCHIVE_SEGMENT_MAX_BYTES'] = max_bytes
+    print("✅ Archive segment size test successful!")
+
+def test_user_lookup_errors():
+    print("🧪 Testing that a failed user lookup is not read as a missing user...")
+    backend = UnreachableBackend()
+    backend.put_user("alice", {"password": "secret"})
+    previous = set_storage_backend(backend)
+    try:
+        assert get_user_fields("alice", [], raise_errors=True) == {}
+        assert get_user_fields("nobody", [], raise_errors=True) is None
+        backend.down = True
+        # Signup checks with raise_errors so an outage is never taken as a free username
+        assert get_user_fields("alice", []) is None
+        try:
+            get_user_fields("alice", [], raise_errors=True)
+            assert False, "lookup error was swallowed"
+        except ConnectionError:
+            pass
+    finally:
+        set_storage_backend(previous)
+    print("✅ User lookup test successful!")
+
+if __name__ == "__main__":
+    test_firestore_search_buckets()
+    test_firestore_user_cache()
+    test_storage_backends()
+    test_failover_reconciliation()
+    test_user_lookup_errors()
+    test_archive_segment_size()
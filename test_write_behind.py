@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the write-behind queue merges, retries and never drops turns
+"""
+
+import os
+import sys
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from write_behind import WriteBehindQueue, _combine
+
+def _turns(*ids):
+    return [{"message_id": i, "user_message": f"q{i}", "bot_reply": f"a{i}"} for i in ids]
+
+class FlakyWriter:
+    """Records writes; fails the first `failures` calls"""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.writes = []
+
+    def __call__(self, username, turns, message_count, previous_count, thread_id):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("service unavailable")
+        self.writes.append((username, [t["message_id"] for t in turns], message_count, previous_count, thread_id))
+        return True
+
+def _save(ids, message_count, previous_count):
+    return {"turns": {t["message_id"]: t for t in _turns(*ids)}, "message_count": message_count,
+            "previous_count": previous_count, "attempts": 0, "not_before": 0}
+
+def test_combine():
+    print("🧪 Testing write-behind save merging...")
+    older = _save([3, 4, 5], 6, 3)
+    newer = _save([4], 5, 6)
+    newer["turns"][4]["bot_reply"] = "edited"
+    merged = _combine(older, newer)
+    # Turns past the newer count were truncated away; the newer turn wins
+    assert sorted(merged["turns"]) == [3, 4]
+    assert merged["turns"][4]["bot_reply"] == "edited"
+    assert merged["message_count"] == 5
+    # Storage still holds what it held before the older save
+    assert merged["previous_count"] == 3
+    print("✅ Merge test successful!")
+
+def test_retry_and_flush():
+    print("🧪 Testing write-behind retries and flush...")
+    writer = FlakyWriter(failures=2)
+    queue = WriteBehindQueue(writer, max_retries=3, retry_delay=0.01)
+    queue.submit("alice", _turns(0, 1), 2, 0, "main")
+    queue.submit("alice", _turns(2), 3, 2, "main")
+    assert queue.flush("alice", timeout=5)
+    assert not queue.is_pending("alice") and queue.failed_writes("alice") == {}
+    assert writer.writes[-1] == ("alice", [0, 1, 2], 3, 0, "main")
+    print("✅ Retry test successful!")
+
+def test_failed_save_is_resent():
+    print("🧪 Testing write-behind saves that are given up on...")
+    writer = FlakyWriter(failures=2)
+    queue = WriteBehindQueue(writer, max_retries=1, retry_delay=0.01)
+    queue.submit("alice", _turns(0, 1), 2, 0, "main")
+    assert not queue.flush("alice", timeout=5)
+    assert writer.writes == []
+    # The failed save is kept and reported, not dropped
+    assert queue.failed_writes("alice") == {"main": 0}
+    assert not queue.flush("alice", timeout=5)
+
+    queue.submit("alice", _turns(2), 3, 2, "main")
+    assert queue.flush("alice", timeout=5)
+    assert queue.failed_writes("alice") == {}
+    assert writer.writes == [("alice", [0, 1, 2], 3, 0, "main")]
+    queue.shutdown()
+    print("✅ Failed save test successful!")
+
+if __name__ == "__main__":
+    test_combine()
+    test_retry_and_flush()
+    test_failed_save_is_resent()
@@ -0,0 +1,180 @@
+# Write-behind persistence queue
+# Chat turns are handed to a single background worker per process so the reply
+# path never waits on a storage round trip. Pending saves for the same user and
+# thread are merged into one batched write, failed writes are retried with exponential
+# backoff, and the queue is flushed on logout and at process shutdown.
+# A save that is given up on is kept as failed rather than dropped: the
+# session rolls its persisted watermark back (see chat_sync) and the failed
+# turns are merged into the next save submitted for that thread.
+
+import atexit
+import threading
+import time
+from config import STORAGE_CONFIG
+from firebase_utils import save_chat_turns
+
+def _combine(older, newer):
+    """Merge two pending saves for the same user; newer wins on conflicts"""
+    turns = {i: turn for i, turn in older["turns"].items() if i < newer["message_count"]}
+    turns.update(newer["turns"])
+    return {
+        "turns": turns,
+        "message_count": newer["message_count"],
+        # The older save was never written, so its previous_count is what storage holds
+        "previous_count": older["previous_count"],
+        "attempts": max(older["attempts"], newer["attempts"]),
+        "not_before": max(older["not_before"], newer["not_before"])
+    }
+
+class WriteBehindQueue:
+    def __init__(self, writer, max_retries=5, retry_delay=0.5, max_retry_delay=30):
+        self._writer = writer
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._pending = {}
+        self._in_flight = set()
+        self._failed = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+    def submit(self, username, turns, message_count, previous_count, thread_id=None):
+        """Queue turns for one of username's threads; returns immediately"""
+        save = {
+            "turns": {turn["message_id"]: turn for turn in turns},
+            "message_count": message_count,
+            "previous_count": previous_count,
+            "attempts": 0,
+            "not_before": 0
+        }
+        key = (username, thread_id)
+        with self._cond:
+            pending = self._pending.get(key)
+            if pending:
+                save = _combine(pending, save)
+            # Turns of a save that was given up on go out again with this one
+            failed = self._failed.pop(key, None)
+            if failed:
+                save = _combine(failed, save)
+                save["attempts"] = 0
+            self._pending[key] = save
+            self._ensure_worker()
+            self._cond.notify_all()
+
+    def failed_writes(self, username):
+        """{thread_id: stored turn count} for username's saves that were given up on"""
+        with self._cond:
+            return {key[1]: save["previous_count"] for key, save in self._failed.items() if key[0] == username}
+
+    def is_pending(self, username):
+        with self._cond:
+            return self._has_work(username)
+
+    def flush(self, username=None, timeout=10):
+        """Wait until queued writes (for username, or everyone) are done.
+
+        Returns False if they did not finish in time or were given up on.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            # Don't let a backoff delay hold up an explicit flush
+            for key, save in self._pending.items():
+                if username is None or key[0] == username:
+                    save["not_before"] = 0
+            self._cond.notify_all()
+
+            while self._has_work(username):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+
+            # Failed saves stay until a new save for the thread picks them up
+            return not any(username is None or key[0] == username for key in self._failed)
+
+    def shutdown(self, timeout=10):
+        self.flush(timeout=timeout)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+
+    def _has_work(self, username):
+        if username is None:
+            return bool(self._pending or self._in_flight)
+        return any(key[0] == username for key in (*self._pending, *self._in_flight))
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                ready = self._take_ready()
+                while not ready:
+                    if self._stopping:
+                        return
+                    self._cond.wait(self._next_wakeup())
+                    ready = self._take_ready()
+
+            for key, save in ready:
+                success = self._write(key, save)
+                with self._cond:
+                    self._in_flight.discard(key)
+                    if not success:
+                        self._schedule_retry(key, save)
+                    self._cond.notify_all()
+
+    def _take_ready(self):
+        now = time.monotonic()
+        ready = [(key, save) for key, save in self._pending.items() if save["not_before"] <= now]
+        for key, _ in ready:
+            del self._pending[key]
+            self._in_flight.add(key)
+        return ready
+
+    def _next_wakeup(self):
+        if not self._pending:
+            return None
+        return max(0, min(save["not_before"] for save in self._pending.values()) - time.monotonic())
+
+    def _write(self, key, save):
+        username, thread_id = key
+        turns = [save["turns"][i] for i in sorted(save["turns"])]
+        try:
+            return self._writer(username, turns, save["message_count"], save["previous_count"], thread_id)
+        except Exception as e:
+            print(f"❌ Write-behind save failed for {username}: {e}")
+            return False
+
+    def _schedule_retry(self, key, save):
+        username = key[0]
+        save["attempts"] += 1
+        if save["attempts"] > self.max_retries:
+            print(f"❌ Giving up on chat history save for {username} after {self.max_retries} retries")
+            self._failed[key] = save
+            return
+        delay = min(self.retry_delay * (2 ** (save["attempts"] - 1)), self.max_retry_delay)
+        save["not_before"] = time.monotonic() + delay
+        print(f"⚠️ Retrying chat history save for {username} in {delay:.1f}s")
+        # Anything submitted meanwhile is newer than the failed save
+        pending = self._pending.get(key)
+        self._pending[key] = _combine(save, pending) if pending else save
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_write_queue():
+    """Process-wide write-behind queue, started on first use"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = WriteBehindQueue(
+                save_chat_turns,
+                max_retries=STORAGE_CONFIG['WRITE_BEHIND_MAX_RETRIES'],
+                retry_delay=STORAGE_CONFIG['WRITE_BEHIND_RETRY_DELAY']
+            )
+            atexit.register(_queue.shutdown)
+        return _queue